@@ -1,8 +1,10 @@
 import os
 from optparse import OptionParser
 from pyautomd.src.parsing.input_file_parser import InputParser
+from pyautomd.src.external_program_runner import configure_runner
 from pyautomd.src.workflow import auto_rec_lig_solvated_preparation
 from pyautomd.src.workflow import auto_lig_parm_preparation
+from pyautomd.src.workflow import auto_lig_batch_parm_preparation
 from pyautomd.src.workflow import auto_nonstandard_aminoacid_parm_preparation
 
 class optParser():  
@@ -41,6 +43,12 @@ def main():
     gaussian = Externel_program_path['gaussian']
     gaussian_scr_path = Externel_program_path['gaussian_scr_path']
     amber_md = Externel_program_path['amber_md']
+    max_program_cpus = Externel_program_path['max_program_cpus']
+    program_timeout = Externel_program_path['program_timeout']
+    gaussian_timeout = Externel_program_path['gaussian_timeout']
+    gaussian_stall_timeout = Externel_program_path['gaussian_stall_timeout']
+    gaussian_total_mem = Externel_program_path['gaussian_total_mem']
+    ifgaussian_restart = Externel_program_path['ifgaussian_restart']
     MD_input_parameters = parser.get_MD_input_parameters()
     restraint_lig = MD_input_parameters['restraint_lig']
     restraint_rec = MD_input_parameters['restraint_rec']
@@ -52,6 +60,15 @@ def main():
     equil_nstlim = MD_input_parameters['equil_nstlim']
     prod_nstlim = MD_input_parameters['prod_nstlim']
     prod_steps = MD_input_parameters['prod_steps']
+    ifhmr = MD_input_parameters['ifhmr']
+    ifnetcdf = MD_input_parameters['ifnetcdf']
+    ifcompact_traj = MD_input_parameters['ifcompact_traj']
+    compact_stride = MD_input_parameters['compact_stride']
+    compact_precision = MD_input_parameters['compact_precision']
+    ifadaptive_equil = MD_input_parameters['ifadaptive_equil']
+    equil_chunk_nstlim = MD_input_parameters['equil_chunk_nstlim']
+    equil_min_nstlim = MD_input_parameters['equil_min_nstlim']
+    equil_max_nstlim = MD_input_parameters['equil_max_nstlim']
     Preparation_option = parser.get_Preparation_option()
     ligand_pdb = Preparation_option['ligand_pdb']
     lig_residue_name = Preparation_option['lig_residue_name']
@@ -61,10 +78,13 @@ def main():
     ifonly_protein_prepare = Preparation_option['ifonly_protein_prepare']
     ifcomplex_prepare = Preparation_option['ifcomplex_prepare']
     charge_model = Preparation_option['charge_model']
+    ligand_extra_formats = Preparation_option['ligand_extra_formats']
+    resp_engine = Preparation_option['resp_engine']
     boxtype = Preparation_option['boxtype']
     com_boxsize = Preparation_option['com_boxsize']
     lig_boxsize = Preparation_option['lig_boxsize']
     sbond_file = Preparation_option['sbond_file']
+    ifauto_disulfide = Preparation_option['ifauto_disulfide']
     tleap_file = Preparation_option['tleap_file']
     ifoptimization_ligand = Preparation_option['ifoptimization_ligand']
     iffull_auto = Preparation_option['iffull_auto']
@@ -76,6 +96,17 @@ def main():
     nonstandard_aminoacid_charge_model = non_standard_aminoacid_option['nonstandard_aminoacid_charge_model']
     nonstandard_aminoacid_charge = non_standard_aminoacid_option['nonstandard_aminoacid_charge']
     ifoptimization_nonstandard_aminoacid = non_standard_aminoacid_option['ifoptimization_nonstandard_aminoacid']
+    Batch_option = parser.get_Batch_option()
+    ifbatch_ligand_prepare = Batch_option['ifbatch_ligand_prepare']
+    ligand_library = Batch_option['ligand_library']
+    batch_workers = Batch_option['batch_workers']
+    batch_output_dir = Batch_option['batch_output_dir']
+    Cache_option = parser.get_Cache_option()
+    ifparm_cache = Cache_option['ifparm_cache']
+    cache_path = os.path.expanduser(Cache_option['cache_path'])
+    parm_cache_size = Cache_option['parm_cache_size']
+    ifrec_cache = Cache_option['ifrec_cache']
+    rec_cache_size = Cache_option['rec_cache_size']
 
 
 
@@ -87,10 +118,31 @@ def main():
     }
     externel_amber_parms = externel_amber_parms.split()
     externel_amber_prep = externel_amber_prep.split()
+    ligand_extra_formats = ligand_extra_formats.split() if ligand_extra_formats else []
+    parm_cache_path = os.path.join(cache_path, 'parm_cache') if ifparm_cache else None
+    runner = configure_runner(max_program_cpus, {'default': program_timeout, 'gaussian': gaussian_timeout, 'gaussian_stall': gaussian_stall_timeout})
 
 
 
-    if ifcomplex_prepare:
+    if ifbatch_ligand_prepare:
+        auto_lig_batch_parm_preparation.main(forcefield_needed=forcefield_needed,
+                                                ligand_library=ligand_library,
+                                                lig_resname=lig_residue_name,
+                                                charge_model=charge_model,
+                                                lig_net_charge=ligand_charge,
+                                                gaussian_scr_path=gaussian_scr_path,
+                                                gaussian_excute=gaussian,
+                                                ligifopt=ifoptimization_ligand,
+                                                batch_workers=batch_workers,
+                                                batch_output_dir=batch_output_dir,
+                                                parm_cache_path=parm_cache_path,
+                                                parm_cache_size=parm_cache_size,
+                                                gaussian_total_mem=gaussian_total_mem,
+                                                gaussian_restart=ifgaussian_restart,
+                                                resp_engine=resp_engine,
+                                                extra_formats=ligand_extra_formats,
+        )
+    elif ifcomplex_prepare:
         auto_rec_lig_solvated_preparation.main(automd_home=automd_home,
                                                 forcefield_needed=forcefield_needed,
                                                 amber_md=amber_md,
@@ -115,10 +167,29 @@ def main():
                                                 restraint_add=restraint_add,
                                                 receptor_pdb=receptor_pdb,
                                                 sbond_file=sbond_file,
+                                                auto_disulfide=ifauto_disulfide,
+                                                disulfide_cache_path=os.path.join(cache_path, 'disulfide_cache'),
                                                 lig_net_charge=ligand_charge,
                                                 gaussian_scr_path=gaussian_scr_path,
                                                 gaussian_excute=gaussian,
                                                 ligifopt=ifoptimization_ligand,
+                                                parm_cache_path=parm_cache_path,
+                                                parm_cache_size=parm_cache_size,
+                                                gaussian_total_mem=gaussian_total_mem,
+                                                gaussian_restart=ifgaussian_restart,
+                                                resp_engine=resp_engine,
+                                                extra_formats=ligand_extra_formats,
+                                                rec_cache_path=os.path.join(cache_path, 'rec_cache') if ifrec_cache else None,
+                                                rec_cache_size=rec_cache_size,
+                                                hmr=ifhmr,
+                                                netcdf=ifnetcdf,
+                                                compact_traj=ifcompact_traj,
+                                                compact_stride=compact_stride,
+                                                compact_precision=compact_precision,
+                                                adaptive_equil=ifadaptive_equil,
+                                                equil_chunk_nstlim=equil_chunk_nstlim,
+                                                equil_min_nstlim=equil_min_nstlim,
+                                                equil_max_nstlim=equil_max_nstlim,
         )
     elif ifonly_small_molecule_prepare:
         auto_lig_parm_preparation.main(forcefield_needed=forcefield_needed,
@@ -129,6 +200,12 @@ def main():
                                         gaussian_scr_path=gaussian_scr_path,
                                         gaussian_excute=gaussian,
                                         ligifopt=ifoptimization_ligand,
+                                        parm_cache_path=parm_cache_path,
+                                        parm_cache_size=parm_cache_size,
+                                        gaussian_total_mem=gaussian_total_mem,
+                                        gaussian_restart=ifgaussian_restart,
+                                        resp_engine=resp_engine,
+                                        extra_formats=ligand_extra_formats,
         )
     elif ifonly_nonstandard_aminoacid_prepare:
         auto_nonstandard_aminoacid_parm_preparation.main(protein_ff=protein_ff,
@@ -140,7 +217,13 @@ def main():
                                                             gaussian_scr_path=gaussian_scr_path,
                                                             gaussian_excute=gaussian,
                                                             ifopt=ifoptimization_nonstandard_aminoacid,
+                                                            parm_cache_path=parm_cache_path,
+                                                            parm_cache_size=parm_cache_size,
+                                                            gaussian_total_mem=gaussian_total_mem,
+                                                            gaussian_restart=ifgaussian_restart,
+                                                            resp_engine=resp_engine,
         )
+    runner.report()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,213 @@
+import os
+import math
+from .pdb_atoms import PDB_atoms
+from .parameter_cache import guess_element
+
+WATER_DENSITY = 0.0334 # water molecules per A^3 at 1 g/cm^3
+OCTAHEDRON_FACTOR = 0.7698 # volume of the truncated octahedron relative to the cube of its box vector length
+VDW_PADDING = 3.0 # twice a typical van der Waals radius, tleap measures the solute by its vdW surface
+PROTEIN_DENSITY = 1.35 # g/cm^3, used for the volume of the solute
+DALTON_VOLUME = 1.66054 / PROTEIN_DENSITY # A^3 per Da at the protein density
+ATOMIC_MASSES = {'H': 1.008, 'C': 12.011, 'N': 14.007, 'O': 15.999, 'S': 32.06, 'P': 30.974, 'F': 18.998,
+                 'Cl': 35.45, 'Br': 79.904, 'I': 126.904, 'Zn': 65.38, 'Mg': 24.305, 'Na': 22.990, 'K': 39.098, 'Ca': 40.078}
+BOX_TYPES = ('solvatebox', 'solvateoct')
+
+
+def jacobi_eigen(matrix, tolerance=1e-12, max_sweeps=50):
+    """
+    Diagonalizes a small symmetric matrix with the cyclic Jacobi method.
+
+    :param matrix: list of lists, the symmetric matrix.
+    :return: (eigenvalues, eigenvectors), the eigenvectors are the columns of the returned list of lists.
+    """
+    n = len(matrix)
+    a = [list(row) for row in matrix]
+    v = [[1.0 if i == j else 0.0 for j in range(n)] for i in range(n)]
+    for _ in range(max_sweeps):
+        off_diagonal = sum(a[i][j] ** 2 for i in range(n) for j in range(n) if i != j)
+        if off_diagonal < tolerance:
+            break
+        for p in range(n - 1):
+            for q in range(p + 1, n):
+                if abs(a[p][q]) < 1e-300:
+                    continue
+                theta = (a[q][q] - a[p][p]) / (2.0 * a[p][q])
+                t = math.copysign(1.0, theta) / (abs(theta) + math.sqrt(theta * theta + 1.0))
+                c = 1.0 / math.sqrt(t * t + 1.0)
+                s = t * c
+                for k in range(n):
+                    akp, akq = a[k][p], a[k][q]
+                    a[k][p], a[k][q] = c * akp - s * akq, s * akp + c * akq
+                for k in range(n):
+                    apk, aqk = a[p][k], a[q][k]
+                    a[p][k], a[q][k] = c * apk - s * aqk, s * apk + c * aqk
+                for k in range(n):
+                    vkp, vkq = v[k][p], v[k][q]
+                    v[k][p], v[k][q] = c * vkp - s * vkq, s * vkp + c * vkq
+    return [a[i][i] for i in range(n)], v
+
+
+def principal_axes(coords):
+    """
+    Returns the geometric center and the principal axes of flat x/y/z coordinates, the axes sorted by decreasing spread.
+
+    :return: (center, axes), axes is a list of three unit vectors forming a right-handed frame.
+    """
+    n = len(coords) // 3
+    center = [sum(coords[k::3]) / n for k in range(3)]
+    covariance = [[0.0] * 3 for _ in range(3)]
+    for i in range(n):
+        d = [coords[3 * i + k] - center[k] for k in range(3)]
+        for j in range(3):
+            for k in range(j, 3):
+                covariance[j][k] += d[j] * d[k]
+    for j in range(3):
+        for k in range(j):
+            covariance[j][k] = covariance[k][j]
+    eigenvalues, eigenvectors = jacobi_eigen(covariance)
+    order = sorted(range(3), key=lambda k: eigenvalues[k], reverse=True)
+    axes = [[eigenvectors[j][k] for j in range(3)] for k in order]
+    # Make the frame right-handed, so that the rotation is proper
+    x, y = axes[0], axes[1]
+    axes[2] = [x[1] * y[2] - x[2] * y[1], x[2] * y[0] - x[0] * y[2], x[0] * y[1] - x[1] * y[0]]
+    return center, axes
+
+
+def extents(coords, center=(0.0, 0.0, 0.0), axes=((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))):
+    """
+    Returns the extent of the coordinates along each of the axes.
+    """
+    low = [math.inf] * 3
+    high = [-math.inf] * 3
+    for i in range(len(coords) // 3):
+        d = [coords[3 * i + k] - center[k] for k in range(3)]
+        for j, axis in enumerate(axes):
+            value = d[0] * axis[0] + d[1] * axis[1] + d[2] * axis[2]
+            low[j] = min(low[j], value)
+            high[j] = max(high[j], value)
+    return [h - l for l, h in zip(low, high)]
+
+
+class Box_optimizer():
+    """
+    Chooses the periodic box with the fewest waters before tleap: the solute is rotated onto its principal axes,
+    which minimizes the rectangular box, and the number of waters of the rectangular box and of the truncated octahedron
+    at the requested buffer is estimated from the box volume minus the solute volume.
+    """
+    def __init__(self, pdb_file, buffer):
+        """
+        Initializes the Box_optimizer class.
+
+        :param pdb_file: string, the solute pdb file, e.g. the receptor-ligand complex with its crystal waters.
+        :param buffer: float, the distance between the solute and the edge of the box in Angstrom.
+        """
+        self.pdb_file = pdb_file
+        self.buffer = float(buffer)
+        self.atoms = PDB_atoms.read(pdb_file)
+        if not len(self.atoms):
+            raise ValueError(f"No atoms found in {pdb_file}.")
+        self.center, self.axes = principal_axes(self.atoms.coords)
+        mass = sum(ATOMIC_MASSES.get(guess_element(name, element), 12.011)
+                   for name, element in zip(self.atoms.column('name'), self.atoms.column('element')))
+        self.solute_volume = mass * DALTON_VOLUME
+        self.estimates = self.estimate()
+
+    def box_estimate(self, dims, volume):
+        waters = max(0, int((volume - self.solute_volume) * WATER_DENSITY))
+        return {'dims': dims, 'volume': volume, 'waters': waters, 'atoms': len(self.atoms) + 3 * waters}
+
+    def estimate(self):
+        """
+        Estimates the volume, the number of waters and the number of atoms of each box type.
+
+        :return: dictionary, box type -> estimate. 'solvatebox_unrotated' is the rectangular box of the input orientation.
+        """
+        solute = [extent + VDW_PADDING for extent in extents(self.atoms.coords, self.center, self.axes)]
+        aligned = [extent + 2 * self.buffer for extent in solute]
+        unrotated = [extent + VDW_PADDING + 2 * self.buffer for extent in extents(self.atoms.coords)]
+        # solvateOct builds a cube around the rotated solute, at least as large as the diagonal of the solute box,
+        # and cuts the truncated octahedron with the box vector length sqrt(3)/2 of the cube edge out of it
+        edge = max(max(aligned), math.sqrt(sum(extent ** 2 for extent in solute)))
+        box_vector = edge * math.sqrt(3.0) / 2.0
+        return {
+            'solvatebox': self.box_estimate(aligned, aligned[0] * aligned[1] * aligned[2]),
+            'solvatebox_unrotated': self.box_estimate(unrotated, unrotated[0] * unrotated[1] * unrotated[2]),
+            'solvateoct': self.box_estimate([box_vector] * 3, OCTAHEDRON_FACTOR * box_vector ** 3),
+        }
+
+    def rotation_helps(self):
+        """
+        Returns True if the rectangular box around the solute on its principal axes is smaller than around the input orientation.
+        """
+        return self.estimates['solvatebox']['volume'] < self.estimates['solvatebox_unrotated']['volume']
+
+    def box_atoms(self, boxtype):
+        if boxtype == 'solvatebox' and not self.rotation_helps():
+            boxtype = 'solvatebox_unrotated'
+        return self.estimates[boxtype]['atoms']
+
+    def best_boxtype(self):
+        return min(BOX_TYPES, key=self.box_atoms)
+
+    def orient(self, output_pdb=None):
+        """
+        Rotates the solute onto its principal axes (centered at the origin) and rewrites the coordinate columns of the pdb file,
+        keeping all other columns and records.
+
+        :param output_pdb: (Optional) string, the output pdb file. Default: overwrite the input.
+        """
+        output_pdb = output_pdb or self.pdb_file
+        tmp_pdb = f"{output_pdb}.{os.getpid()}.tmp"
+        with open(self.pdb_file, 'r') as infile, open(tmp_pdb, 'w') as outfile:
+            for line in infile:
+                if line.startswith(('ATOM', 'HETATM')):
+                    d = [float(line[30:38]) - self.center[0], float(line[38:46]) - self.center[1], float(line[46:54]) - self.center[2]]
+                    x, y, z = (d[0] * axis[0] + d[1] * axis[1] + d[2] * axis[2] for axis in self.axes)
+                    line = f"{line[:30]}{x:8.3f}{y:8.3f}{z:8.3f}{line[54:]}"
+                outfile.write(line)
+        os.replace(tmp_pdb, output_pdb)
+
+    def report(self, requested_boxtype=None):
+        """
+        Prints the estimates of all box types and the savings of the best one.
+
+        :param requested_boxtype: (Optional) string, the box type the savings are compared to. Default: the unrotated rectangular box.
+        """
+        print(f"Box estimates for {self.pdb_file} ({len(self.atoms)} solute atoms, buffer {self.buffer} A):")
+        for boxtype, estimate in self.estimates.items():
+            dims = ' x '.join(f"{dim:.1f}" for dim in estimate['dims'])
+            print(f"  {boxtype:21s} {dims} A, {estimate['volume']:.0f} A^3, ~{estimate['waters']} waters, ~{estimate['atoms']} atoms")
+        best = self.best_boxtype()
+        if requested_boxtype in BOX_TYPES:
+            reference, reference_name = self.box_atoms(requested_boxtype), f"the requested {requested_boxtype}"
+        else:
+            reference, reference_name = self.estimates['solvatebox_unrotated']['atoms'], "the unrotated solvatebox"
+        saving = reference - self.box_atoms(best)
+        print(f"Smallest box: {best}, ~{self.box_atoms(best)} atoms, {saving} fewer ({100.0 * saving / reference:.1f}%) than {reference_name}.")
+
+
+def choose_boxtype(pdb_file, buffer, boxtype='auto', oriented_pdb=None):
+    """
+    Reports the box estimates of the solute and returns the box type to use: the one with the fewest atoms for 'auto',
+    otherwise the requested one. When 'auto' chooses a rectangular box, the solute rotated onto its principal axes
+    is written to oriented_pdb, the input pdb file is never changed. solvateOct of tleap orients the solute by itself.
+
+    :param pdb_file: string, the solute pdb file passed to tleap.
+    :param buffer: float, the distance between the solute and the edge of the box in Angstrom.
+    :param boxtype: (Optional) string, 'auto', 'solvatebox' or 'solvateoct'.
+    :param oriented_pdb: (Optional) string, the pdb file of the rotated solute. Default: {pdb_file}_oriented.pdb.
+    :return: (box type, solute pdb file), the box type 'solvatebox' or 'solvateoct', and the pdb file to solvate.
+    """
+    if boxtype != 'auto' and boxtype not in BOX_TYPES:
+        raise ValueError(f"Unknown boxtype {boxtype}, expected auto, solvatebox or solvateoct.")
+    optimizer = Box_optimizer(pdb_file, buffer)
+    optimizer.report(None if boxtype == 'auto' else boxtype)
+    solute_pdb = pdb_file
+    if boxtype == 'auto':
+        boxtype = optimizer.best_boxtype()
+        if boxtype == 'solvatebox' and optimizer.rotation_helps():
+            solute_pdb = oriented_pdb or f"{os.path.splitext(pdb_file)[0]}_oriented.pdb"
+            optimizer.orient(solute_pdb)
+            print(f"{pdb_file} rotated onto its principal axes in {solute_pdb}.")
+    print(f"Using {boxtype} for {solute_pdb}.")
+    return boxtype, solute_pdb
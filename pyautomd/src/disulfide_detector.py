@@ -0,0 +1,139 @@
+import os
+import json
+import array
+from .spatial_index import Cell_list
+from .parameter_cache import Parameter_cache, file_key
+
+SG_BOND_CUTOFF = 2.5 # Angstrom, S-S bonds are about 2.05 A
+CYSTEINE_NAMES = (b'CYS', b'CYX', b'CYM')
+DISULFIDE_FILE = 'disulfides.json'
+DISULFIDE_CACHE_SIZE = 50 # MB
+WRITE_CHUNK = 65536 # lines per write call
+DISULFIDE_VERSION = 2 # part of the cache keys of the detected bonds and of the receptor topology, changed with the detection or the bond commands
+
+
+def residue_key(line):
+    """
+    The residue of an ATOM/HETATM record: residue name, chain, residue number and insertion code.
+    """
+    return line[17:27]
+
+
+class Disulfide_detector():
+    """
+    Detects the disulfide bonds of a receptor from the SG-SG distances of its cysteines, renames the bonded cysteines to CYX
+    (removing their HG atoms) and writes the tleap bond commands. The residues are numbered as tleap numbers them:
+    consecutively in the order of the file.
+    """
+    def __init__(self, receptor_pdb, cutoff=SG_BOND_CUTOFF, cache_path=None):
+        """
+        Initializes the Disulfide_detector class.
+
+        :param receptor_pdb: string, the receptor pdb file.
+        :param cutoff: (Optional) float, the largest SG-SG distance of a disulfide bond in Angstrom.
+        :param cache_path: (Optional) string, the directory caching the detected bonds per receptor content. None to disable the cache.
+        """
+        self.receptor_pdb = receptor_pdb
+        self.cutoff = cutoff
+        self.cache_path = cache_path
+        self.disulfides = None
+
+    def detect(self):
+        """
+        Finds the disulfide bonds in one pass over the receptor. Every SG is bonded to its nearest partner within the cutoff at most once,
+        the SGs of alternate locations other than the first one are ignored.
+
+        :return: list of dictionaries with the residue index, name, chain and number of both cysteines.
+        """
+        cache = None
+        if self.cache_path is not None:
+            cache = Parameter_cache(self.cache_path, DISULFIDE_CACHE_SIZE)
+            key = file_key([self.receptor_pdb], cutoff=self.cutoff, version=DISULFIDE_VERSION)
+            if cache.lookup(key, [DISULFIDE_FILE]):
+                with open(DISULFIDE_FILE, 'r') as f:
+                    self.disulfides = json.load(f)
+                print(f"Disulfide bonds of {self.receptor_pdb} found in the cache (key {key[:12]}).")
+                return self.disulfides
+        coords = array.array('d')
+        residues = []
+        residue_index = 0
+        last_residue = None
+        with open(self.receptor_pdb, 'rb') as f:
+            for line in f:
+                if not line.startswith((b'ATOM', b'HETATM')):
+                    continue
+                residue = residue_key(line)
+                if residue != last_residue:
+                    residue_index += 1
+                    last_residue = residue
+                # Only the first alternate location of an SG, the other ones are about 1 A away and would be bonded to it
+                if line[17:20] in CYSTEINE_NAMES and line[12:16].strip() == b'SG' and line[16:17] in (b' ', b'A'):
+                    coords.extend((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+                    residues.append({'index': residue_index, 'resname': line[17:20].decode(), 'chain': line[21:22].decode().strip(),
+                                     'resseq': line[22:27].decode().strip()})
+        index = Cell_list(coords, self.cutoff)
+        pairs = sorted((distance, i, j) for i, j, distance in index.pairs_within(coords, self.cutoff) if i < j)
+        bonded = set()
+        self.disulfides = []
+        for distance, i, j in pairs:
+            if i in bonded or j in bonded or residues[i]['index'] == residues[j]['index']:
+                continue
+            bonded.update((i, j))
+            self.disulfides.append({'residue1': residues[i], 'residue2': residues[j], 'distance': round(distance, 3)})
+        self.disulfides.sort(key=lambda bond: bond['residue1']['index'])
+        if cache is not None:
+            with open(DISULFIDE_FILE, 'w') as f:
+                json.dump(self.disulfides, f, indent=1)
+            cache.store(key, [DISULFIDE_FILE], label=os.path.basename(self.receptor_pdb))
+        return self.disulfides
+
+    def write_cyx_receptor(self, output_pdb):
+        """
+        Writes the receptor with the bonded cysteines renamed to CYX and without their HG atoms.
+
+        :param output_pdb: string, the output pdb file.
+        :return: bool, False if nothing had to be changed and no file was written.
+        """
+        cyx_indices = {bond[f'residue{k}']['index'] for bond in self.disulfides for k in (1, 2)}
+        if not cyx_indices:
+            return False
+        residue_index = 0
+        last_residue = None
+        lines = []
+        changed = False
+        with open(self.receptor_pdb, 'rb') as f, open(output_pdb, 'wb') as out:
+            for line in f:
+                if line.startswith((b'ATOM', b'HETATM')):
+                    residue = residue_key(line)
+                    if residue != last_residue:
+                        residue_index += 1
+                        last_residue = residue
+                    if residue_index in cyx_indices:
+                        if line[12:16].strip() == b'HG':
+                            changed = True
+                            continue
+                        if line[17:20] != b'CYX':
+                            line = line[:17] + b'CYX' + line[20:]
+                            changed = True
+                lines.append(line)
+                if len(lines) >= WRITE_CHUNK:
+                    out.writelines(lines)
+                    lines = []
+            out.writelines(lines)
+        if not changed:
+            os.remove(output_pdb)
+        return changed
+
+    def write_sbond_file(self, sbond_file, model_name='model'):
+        """
+        Writes the tleap bond commands of the disulfide bonds, in the format of the sbond_file option.
+        """
+        with open(sbond_file, 'w') as f:
+            for bond in self.disulfides:
+                f.write(f"bond {model_name}.{bond['residue1']['index']}.SG {model_name}.{bond['residue2']['index']}.SG\n")
+
+    def report(self):
+        print(f"{len(self.disulfides)} disulfide bonds detected in {self.receptor_pdb}:")
+        for bond in self.disulfides:
+            residue1, residue2 = bond['residue1'], bond['residue2']
+            print(f"  {residue1['resname']}{residue1['resseq']}{residue1['chain']} - {residue2['resname']}{residue2['resseq']}{residue2['chain']}: {bond['distance']:.2f} A")
@@ -0,0 +1,151 @@
+import re
+import sys
+import time
+from optparse import OptionParser
+
+# Relative drift allowed between the two halves of the analysis window, per observable of the mdout energy records
+TOLERANCES = {'Density': 0.002, 'VOLUME': 0.002, 'TEMP(K)': 0.005, 'EPtot': 0.002}
+MIN_WINDOW = 4 # records in the analysis window before a plateau can be reported
+RECORD_PATTERN = re.compile(r"(NSTEP|TIME\(PS\)|TEMP\(K\)|EPtot|VOLUME|Density)\s*=\s*([-+]?\d+\.?\d*(?:[eE][-+]?\d+)?)")
+# Exit codes of the command line
+CONVERGED = 0
+CONTINUE = 1
+
+
+def iter_mdout_records(mdout_file):
+    """
+    Yields the energy records of an Amber mdout file, one at a time, as dictionaries of the values of RECORD_PATTERN.
+    The file is read line by line up to the averages, so that a running or truncated output can be read too.
+    """
+    record = {}
+    with open(mdout_file, 'r', errors='replace') as file:
+        for line in file:
+            if "A V E R A G E S" in line:
+                break
+            if line.lstrip().startswith("NSTEP") and record:
+                yield record
+                record = {}
+            for name, value in RECORD_PATTERN.findall(line):
+                record[name] = float(value)
+    if 'NSTEP' in record:
+        yield record
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+class Plateau_detector():
+    """
+    Decides whether the observables of an equilibration have plateaued: the first half of the records is discarded,
+    and the mean of every observable over the older and the newer half of the remaining window must agree within its tolerance.
+    """
+    def __init__(self, tolerances=None):
+        """
+        Initializes the Plateau_detector class.
+
+        :param tolerances: (Optional) dictionary, observable -> relative tolerance of the drift. Default: TOLERANCES.
+        """
+        self.tolerances = dict(TOLERANCES if tolerances is None else tolerances)
+        self.series = {name: [] for name in self.tolerances}
+        self.n_records = 0
+
+    def add(self, record):
+        self.n_records += 1
+        for name, values in self.series.items():
+            if name in record:
+                values.append(record[name])
+
+    def read(self, mdout_files):
+        for mdout_file in mdout_files:
+            for record in iter_mdout_records(mdout_file):
+                self.add(record)
+
+    def check(self):
+        """
+        Checks the plateau of every observable found in the records.
+
+        :return: (converged, details), details is a list of (observable, older mean, newer mean, relative drift, tolerance).
+        """
+        details = []
+        converged = True
+        for name, values in self.series.items():
+            if not values:
+                continue
+            window = values[len(values) // 2:]
+            if len(window) < MIN_WINDOW:
+                converged = False
+                details.append((name, None, None, None, self.tolerances[name]))
+                continue
+            older, newer = mean(window[:len(window) // 2]), mean(window[len(window) // 2:])
+            drift = (newer - older) / abs(mean(window)) if mean(window) else newer - older
+            converged = converged and abs(drift) <= self.tolerances[name]
+            details.append((name, older, newer, drift, self.tolerances[name]))
+        return converged and bool(details), details
+
+
+def decide(mdout_files, min_chunks, max_chunks, tolerances=None):
+    """
+    Decides whether a chunked equilibration stage stops after its last chunk.
+
+    :param mdout_files: list of strings, the outputs of the chunks run so far, in order.
+    :param min_chunks: int, the chunks run before a plateau is accepted.
+    :param max_chunks: int, the chunks after which the stage stops without a plateau.
+    :param tolerances: (Optional) dictionary, observable -> relative tolerance of the drift.
+    :return: (stop, decision, details).
+    """
+    detector = Plateau_detector(tolerances)
+    detector.read(mdout_files)
+    converged, details = detector.check()
+    n_chunks = len(mdout_files)
+    if n_chunks < min_chunks:
+        return False, "continue, minimum length not reached", details
+    if converged:
+        return True, "converged", details
+    if n_chunks >= max_chunks:
+        return True, "maximum length reached without a plateau", details
+    return False, "continue, not converged", details
+
+
+def format_details(details):
+    items = []
+    for name, older, newer, drift, tolerance in details:
+        if drift is None:
+            items.append(f"{name} too few records")
+        else:
+            items.append(f"{name} {older:.4f}->{newer:.4f} drift {100.0 * drift:+.3f}% (tol {100.0 * tolerance:.3f}%)")
+    return ', '.join(items)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] chunk1.out [chunk2.out ...]\nChecks whether the density, volume, temperature and potential energy "
+                                "of a chunked equilibration have plateaued. Exits with 0 when the stage should stop, 1 when it should continue.")
+    parser.add_option('--stage', dest='stage', default='equil', help="The stage name written to the log. Default: equil")
+    parser.add_option('--min-chunks', dest='min_chunks', type='int', default=1, help="The chunks run before a plateau is accepted. Default: 1")
+    parser.add_option('--max-chunks', dest='max_chunks', type='int', default=None, help="The chunks after which the stage stops anyway. Default: no limit")
+    parser.add_option('--tolerance', dest='tolerances', action='append', default=[], metavar='NAME=VALUE',
+                      help=f"The relative drift tolerance of an observable, e.g. Density=0.001, may be repeated. Defaults: {TOLERANCES}")
+    parser.add_option('--log', dest='log', default=None, help="The file the decision is appended to. Default: only printed")
+    options, args = parser.parse_args()
+    if not args:
+        parser.error("no mdout file given")
+    tolerances = dict(TOLERANCES)
+    for item in options.tolerances:
+        name, _, value = item.partition('=')
+        if name not in TOLERANCES:
+            parser.error(f"unknown observable {name}, expected one of {', '.join(TOLERANCES)}")
+        tolerances[name] = float(value)
+    try:
+        stop, decision, details = decide(args, options.min_chunks, options.max_chunks or sys.maxsize, tolerances)
+    except OSError as error:
+        stop, decision, details = False, f"continue, {error}", []
+    line = f"{time.strftime('%Y-%m-%d %H:%M:%S')} {options.stage} chunk {len(args)}: {format_details(details) or 'no records'} -> {decision}"
+    print(line)
+    if options.log:
+        with open(options.log, 'a') as log_file:
+            log_file.write(line + "\n")
+    sys.exit(CONVERGED if stop else CONTINUE)
+
+
+if __name__ == '__main__':
+    main()
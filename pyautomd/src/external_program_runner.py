@@ -0,0 +1,218 @@
+import os
+import time
+import signal
+import asyncio
+import itertools
+import threading
+import subprocess
+
+
+class Program_run_record():
+    """
+    The result and the resource usage of one external program call.
+    """
+    def __init__(self, command, name, cwd):
+        self.command = list(command)
+        self.name = name
+        self.cwd = cwd
+        self.returncode = None
+        self.timed_out = False
+        self.killed_reason = None # why the watchdog killed the program, None if it was not killed
+        self.wall_time = 0.0 # seconds
+        self.cpu_time = 0.0 # user + system seconds of the child
+        self.max_rss = 0 # peak resident set size of the child, KB
+        self.stdout_log = None
+        self.stderr_log = None
+
+    @property
+    def success(self):
+        return self.returncode == 0 and not self.timed_out and self.killed_reason is None
+
+    def __str__(self):
+        if self.timed_out:
+            state = "timed out"
+        elif self.killed_reason is not None:
+            state = f"killed ({self.killed_reason})"
+        else:
+            state = f"exit code {self.returncode}"
+        return (f"{' '.join(self.command)}: {state}, wall {self.wall_time:.2f} s, cpu {self.cpu_time:.2f} s, "
+                f"peak RSS {self.max_rss / 1024:.1f} MB (log: {self.stdout_log})")
+
+
+class External_program_runner:
+    """
+    Runs external programs (antechamber, parmchk2, prepgen, resp, tleap, Gaussian) with a shared CPU budget,
+    timeouts, per-call stdout/stderr logs and per-call resource accounting.
+    Independent calls can be overlapped with run_many, which schedules them on an asyncio event loop.
+    """
+    def __init__(self, max_cpus=None, timeouts=None, log_dir='pyautomd_logs'):
+        """
+        Initializes the External_program_runner class.
+
+        :param max_cpus: (Optional) int, the number of CPUs shared by all running programs. Default: os.cpu_count().
+        :param timeouts: (Optional) dictionary, program name -> timeout in seconds. The 'default' key applies to the other programs. None means no timeout.
+        :param log_dir: (Optional) string, the directory (relative to the working directory of the call) of the per-call logs.
+        """
+        self.max_cpus = int(max_cpus) if max_cpus else os.cpu_count()
+        self.timeouts = dict(timeouts) if timeouts else {}
+        self.log_dir = log_dir
+        self.used_cpus = 0
+        self.cpu_condition = threading.Condition()
+        self.call_counter = itertools.count(1)
+        self.records = []
+
+    def acquire_cpus(self, cpus):
+        with self.cpu_condition:
+            self.cpu_condition.wait_for(lambda: self.used_cpus == 0 or self.used_cpus + cpus <= self.max_cpus)
+            self.used_cpus += cpus
+
+    def release_cpus(self, cpus):
+        with self.cpu_condition:
+            self.used_cpus -= cpus
+            self.cpu_condition.notify_all()
+
+    def run_blocking(self, command, name=None, cpus=1, timeout=None, stdout=None, stderr=None, cwd=None, watchdog=None):
+        """
+        Runs one program and waits for it. The program is killed (with its process group) once the timeout is exceeded,
+        or once the watchdog returns a reason to stop it.
+
+        :param command: list of strings, the command line.
+        :param name: (Optional) string, the program name used for the logs and the timeouts. Default: the basename of the executable.
+        :param cpus: (Optional) int, the number of CPUs taken from the shared budget while the program runs.
+        :param timeout: (Optional) float, the timeout in seconds. Default: the timeout configured for the program name.
+        :param stdout: (Optional) string, the stdout log file. Default: <log_dir>/<call number>_<name>.out
+        :param stderr: (Optional) string, the stderr log file. Default: <log_dir>/<call number>_<name>.err
+        :param cwd: (Optional) string, the working directory of the program.
+        :param watchdog: (Optional) callable without arguments, polled while the program runs. It returns None to let the program go on,
+                         or a string explaining why the program has to be killed.
+        :return: Program_run_record object.
+        """
+        name = name or os.path.basename(command[0])
+        cwd = os.path.abspath(cwd or os.getcwd())
+        if timeout is None:
+            timeout = self.timeouts.get(name, self.timeouts.get('default'))
+        record = Program_run_record(command, name, cwd)
+        call_id = next(self.call_counter)
+        log_dir = os.path.join(cwd, self.log_dir)
+        os.makedirs(log_dir, exist_ok=True)
+        record.stdout_log = os.path.join(cwd, stdout) if stdout else os.path.join(log_dir, f"{call_id:04d}_{name}.out")
+        record.stderr_log = os.path.join(cwd, stderr) if stderr else os.path.join(log_dir, f"{call_id:04d}_{name}.err")
+        cpus = max(1, min(int(cpus), self.max_cpus))
+
+        self.acquire_cpus(cpus)
+        try:
+            with open(record.stdout_log, 'w') as out, open(record.stderr_log, 'w') as err:
+                start = time.monotonic()
+                process = subprocess.Popen(command, stdout=out, stderr=err, cwd=cwd, start_new_session=True)
+                interval = 0.01
+                while True:
+                    pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                    if pid:
+                        break
+                    if timeout is not None and time.monotonic() - start > timeout:
+                        record.timed_out = True
+                        self.kill(process)
+                        pid, status, rusage = os.wait4(process.pid, 0)
+                        break
+                    if watchdog is not None:
+                        record.killed_reason = watchdog()
+                        if record.killed_reason is not None:
+                            self.kill(process)
+                            pid, status, rusage = os.wait4(process.pid, 0)
+                            break
+                    time.sleep(interval)
+                    interval = min(interval * 2, 0.5)
+                record.wall_time = time.monotonic() - start
+        finally:
+            self.release_cpus(cpus)
+        process.returncode = record.returncode = os.waitstatus_to_exitcode(status)
+        record.cpu_time = rusage.ru_utime + rusage.ru_stime
+        record.max_rss = rusage.ru_maxrss
+        self.records.append(record)
+        self.write_resource_usage(record, log_dir)
+        if record.timed_out:
+            print(f"Warning: {name} killed after the timeout of {timeout} s.")
+        elif record.killed_reason is not None:
+            print(f"Warning: {name} killed: {record.killed_reason}.")
+        return record
+
+    def kill(self, process):
+        """
+        Kills the process and all the processes it started.
+        """
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def write_resource_usage(self, record, log_dir):
+        """
+        Appends the resource usage of the call to <log_dir>/resource_usage.tsv.
+        """
+        usage_file = os.path.join(log_dir, 'resource_usage.tsv')
+        with open(usage_file, 'a') as f:
+            if f.tell() == 0:
+                f.write("name\treturncode\ttimed_out\twall_time_s\tcpu_time_s\tmax_rss_kb\tcommand\n")
+            f.write(f"{record.name}\t{record.returncode}\t{record.timed_out or record.killed_reason is not None}\t{record.wall_time:.3f}\t{record.cpu_time:.3f}\t{record.max_rss}\t{' '.join(record.command)}\n")
+
+    async def run_async(self, command, **kwargs):
+        """
+        Coroutine version of run_blocking, so that independent calls can overlap on an event loop.
+        """
+        return await asyncio.to_thread(self.run_blocking, command, **kwargs)
+
+    def run(self, command, **kwargs):
+        """
+        Runs one program. See run_blocking for the arguments.
+        """
+        return self.run_blocking(command, **kwargs)
+
+    def run_many(self, calls):
+        """
+        Runs independent programs concurrently within the CPU budget.
+
+        :param calls: list of (command, kwargs) tuples, kwargs are the arguments of run_blocking.
+        :return: list of Program_run_record objects in the order of the calls.
+        """
+        async def gather():
+            return await asyncio.gather(*(self.run_async(command, **kwargs) for command, kwargs in calls))
+        return asyncio.run(gather())
+
+    def report(self):
+        """
+        Prints the total resource usage of all calls, grouped by program name.
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record.name, [0, 0.0, 0.0, 0])
+            total[0] += 1
+            total[1] += record.wall_time
+            total[2] += record.cpu_time
+            total[3] = max(total[3], record.max_rss)
+        for name, (calls, wall_time, cpu_time, max_rss) in sorted(totals.items()):
+            print(f"{name}: {calls} calls, wall {wall_time:.2f} s, cpu {cpu_time:.2f} s, peak RSS {max_rss / 1024:.1f} MB")
+
+
+_runner = None
+
+
+def get_runner():
+    """
+    Returns the runner shared by all modules of the process.
+    """
+    global _runner
+    if _runner is None:
+        _runner = External_program_runner()
+    return _runner
+
+
+def configure_runner(max_cpus=None, timeouts=None):
+    """
+    Replaces the shared runner with one using the given CPU budget and timeouts.
+
+    :param max_cpus: (Optional) int, the number of CPUs shared by all running programs. Default: os.cpu_count().
+    :param timeouts: (Optional) dictionary, program name -> timeout in seconds, with the 'default' key for the other programs.
+    """
+    global _runner
+    _runner = External_program_runner(max_cpus, timeouts)
+    return _runner
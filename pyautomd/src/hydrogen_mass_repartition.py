@@ -0,0 +1,53 @@
+import os
+from .prmtop_reader import Prmtop_reader
+
+HMR_HYDROGEN_MASS = 3.024 # Da, three times the hydrogen mass
+HMR_TIMESTEP = 0.004 # ps, the time step allowed by the repartitioned masses with SHAKE
+HYDROGEN_MASS_LIMIT = 1.5 # Da, hydrogens lighter than this have not been repartitioned yet
+
+
+def repartition_hydrogen_masses(prmtop_file, hydrogen_mass=HMR_HYDROGEN_MASS, output_file=None):
+    """
+    Hydrogen mass repartitioning: every hydrogen bonded to a heavy atom gets hydrogen_mass, and the added mass is taken from the heavy atom,
+    so that the total mass is unchanged. The waters keep their masses, they are rigid anyway. Hydrogens that are already heavier than
+    1.5 Da are left alone, so repartitioning twice changes nothing.
+
+    :param prmtop_file: string, the prmtop file.
+    :param hydrogen_mass: (Optional) float, the mass of the hydrogens in Da.
+    :param output_file: (Optional) string, the output prmtop file. Default: overwrite the input.
+    :return: int, the number of repartitioned hydrogens.
+    """
+    output_file = output_file or prmtop_file
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    with Prmtop_reader(prmtop_file) as prmtop:
+        masses = list(prmtop.section('MASS'))
+        if prmtop.has_section('ATOMIC_NUMBER'):
+            hydrogens = [number == 1 for number in prmtop.section('ATOMIC_NUMBER')]
+        else:
+            hydrogens = [mass < HYDROGEN_MASS_LIMIT for mass in masses]
+        water_atoms = set()
+        for first, last in prmtop.atom_ranges(prmtop.classify_residues()['water']):
+            water_atoms.update(range(first - 1, last))
+        bonds = prmtop.section('BONDS_INC_HYDROGEN')
+        repartitioned = 0
+        for k in range(0, len(bonds) - 2, 3):
+            # The bond lists hold coordinate indices, 3 * (atom number - 1)
+            i, j = bonds[k] // 3, bonds[k + 1] // 3
+            if hydrogens[j] and not hydrogens[i]:
+                i, j = j, i
+            if not hydrogens[i] or hydrogens[j] or i in water_atoms or masses[i] >= HYDROGEN_MASS_LIMIT:
+                continue
+            masses[j] -= hydrogen_mass - masses[i]
+            masses[i] = hydrogen_mass
+            repartitioned += 1
+        light = [j + 1 for j, mass in enumerate(masses) if not hydrogens[j] and 0.0 < mass < hydrogen_mass]
+        if light:
+            raise ValueError(f"Hydrogen mass repartitioning of {prmtop_file} leaves heavy atoms lighter than {hydrogen_mass} Da: {light[:10]}")
+        if repartitioned:
+            prmtop.write(tmp_file, {'MASS': masses})
+    if repartitioned:
+        os.replace(tmp_file, output_file)
+        print(f"Hydrogen masses of {repartitioned} hydrogens set to {hydrogen_mass} Da in {output_file}")
+    else:
+        print(f"No hydrogen to repartition in {prmtop_file}, the masses were already repartitioned")
+    return repartitioned
@@ -1,9 +1,58 @@
 import os
+import sys
 import shutil
 import subprocess
+from .pdb_atoms import PDB_atoms
+from .prmtop_reader import Prmtop_reader
+from .hydrogen_mass_repartition import repartition_hydrogen_masses, HMR_TIMESTEP
+
+TIMESTEP = 0.002 # ps, the time step the step counts are given for
+NTPR = 1000 # steps between energy prints at TIMESTEP
+NTWX = 1000 # steps between trajectory frames at TIMESTEP
+NETCDF_OUTPUT_FORMAT = " ioutfm=1, ntxo=2," # NetCDF trajectories and restarts
+# Makes submit.pbs resumable: finished stages are skipped when the job is submitted again, a failed stage stops the chain
+RUN_STAGE_FUNCTION = """
+# run_stage <stage> <restart> <command...>: a stage is finished when its restart is not empty and its output reports the total wall time
+run_stage() {
+    local stage=$1 restart=$2
+    shift 2
+    if [ -s "$restart" ] && grep -q "Total wall time" "$stage.out" 2>/dev/null; then
+        echo "$stage finished, skipped"
+        return 0
+    fi
+    "$@" || { echo "$stage failed, resubmit to resume from $stage"; wait; exit 1; }
+}
+
+"""
+# Runs density or equil in chunks of ins/<stage>.in until equilibration_monitor.py reports a plateau of the chunk outputs,
+# the last chunk restart becomes <stage>.<rst> and the joined chunk outputs <stage>.out, so that the next stages are unchanged
+ADAPTIVE_STAGE_FUNCTION = """
+# run_adaptive_stage <stage> <input restart> <reference> <min chunks> <max chunks>: the decisions are appended to equilibration.log
+run_adaptive_stage() {
+    local stage=$1 coord=$2 ref=$3 min_chunks=$4 max_chunks=$5 chunk=1
+    if [ -s "$stage._RST_EXT_" ] && grep -q "Total wall time" "$stage.out" 2>/dev/null; then
+        echo "$stage finished, skipped"
+        return 0
+    fi
+    while true; do
+        run_stage ${stage}_$chunk ${stage}_$chunk._RST_EXT_ _EXEC_PROG_ -O -i ./ins/$stage.in -o ${stage}_$chunk.out -p _PRMTOP_ -c $coord -r ${stage}_$chunk._RST_EXT_ -x _REC_-${stage}_$chunk._TRAJ_EXT_ -ref $ref
+_COMPRESS_        coord=${stage}_$chunk._RST_EXT_
+        if _MONITOR_ --stage $stage --min-chunks $min_chunks --max-chunks $max_chunks --log equilibration.log $(seq -f "${stage}_%g.out" 1 $chunk) || [ $chunk -ge $max_chunks ]; then
+            break
+        fi
+        chunk=$((chunk + 1))
+    done
+    cp $coord $stage._RST_EXT_
+    cat $(seq -f "${stage}_%g.out" 1 $chunk) > $stage.out
+}
+
+"""
+ADAPTIVE_STAGES = ('density', 'equil')
 
 class MD_input_prep:
-    def __init__(self, automd_home, exec_prog, rec_name_u, lig_resn_name, prod_steps, cutoff, final_temp, heat_nstlim, density_nstlim, equil_nstlim, prod_nstlim, restraint_lig, restraint_rec, restraint_add):
+    def __init__(self, automd_home, exec_prog, rec_name_u, lig_resn_name, prod_steps, cutoff, final_temp, heat_nstlim, density_nstlim, equil_nstlim, prod_nstlim, restraint_lig, restraint_rec, restraint_add, hmr=False, netcdf=False,
+                 compact_traj=False, compact_stride=1, compact_precision=None, adaptive_equil=False, equil_chunk_nstlim=5000, equil_min_nstlim=10000,
+                 equil_max_nstlim=100000):
         self.automd_home = automd_home
         self.exec_prog = exec_prog
         self.rec_name_u = rec_name_u
@@ -20,22 +69,59 @@ class MD_input_prep:
         self.restraint_lig = restraint_lig # the residue index of the ligand in the tleap-protein-wat.pdb
         self.restraint_rec = restraint_rec # the residue index range of the receptor in the tleap-protein-wat.pdb
         self.restraint_add = restraint_add # the residue index range of the additional restraint in the tleap-protein-wat.pdb
+        self.hmr = hmr # hydrogen mass repartitioning with the 4 fs time step
+        self.dt = HMR_TIMESTEP if hmr else TIMESTEP
+        self.netcdf = netcdf # NetCDF trajectories (.nc) and restarts (.ncrst) instead of ASCII files compressed by gzip
+        self.rst_ext = "ncrst" if netcdf else "rst"
+        self.traj_ext = "nc" if netcdf else "mdcrd"
+        self.compact_traj = compact_traj # strip the solvent of every production segment while the next one runs
+        self.compact_stride = compact_stride
+        self.compact_precision = compact_precision
+        self.adaptive_equil = adaptive_equil # run density and equil in chunks until their observables plateau
+        self.equil_chunk_nstlim = equil_chunk_nstlim
+        self.equil_min_nstlim = equil_min_nstlim
+        self.equil_max_nstlim = equil_max_nstlim
 
 
     def run(self):
+        if self.hmr:
+            self.repartition_masses()
         self.set_restraint_parameters()
         self.create_run_directory()
         self.generate_submit_pbs()
         self.generate_input_files()
         print("automd preparation finished")
 
+    def repartition_masses(self):
+        """
+        Repartitions the hydrogen masses of the solvated complex and the solvated ligand topologies for the 4 fs time step.
+        """
+        for prmtop_file in (f"{self.rec_name_u}.prmtop", "lig-wat.prmtop"):
+            if os.path.isfile(prmtop_file):
+                repartition_hydrogen_masses(prmtop_file)
+
+    def scale_steps(self, nstlim):
+        """
+        Converts a step count given for the 2 fs time step into the step count of the same simulated time at self.dt.
+        """
+        return max(1, int(round(int(nstlim) * TIMESTEP / self.dt)))
+
     def set_restraint_parameters(self):
+        prmtop_file = f"{self.rec_name_u}.prmtop"
+        if (not self.restraint_lig or not self.restraint_rec) and os.path.isfile(prmtop_file):
+            # Exact residue ranges from the topology: the receptor excludes the ligand, the counter ions and the waters
+            with Prmtop_reader(prmtop_file) as prmtop:
+                restraint_rec, restraint_lig = prmtop.restraint_masks(self.lig_resn_name)
+            if not self.restraint_lig and restraint_lig:
+                self.restraint_lig = restraint_lig
+            if not self.restraint_rec and restraint_rec:
+                self.restraint_rec = restraint_rec
+            print(f"Restraint masks from {prmtop_file}: receptor :{self.restraint_rec}, ligand :{self.restraint_lig}")
         if not self.restraint_lig:
-            with open(f"tleap-{self.rec_name_u}-wat.pdb", "r") as file:
-                for line in file:
-                    if self.lig_resn_name in line:
-                        self.restraint_lig = line.split()[4]
-                        break
+            # Only the atoms of the ligand residue are parsed
+            lig_atoms = PDB_atoms.read(f"tleap-{self.rec_name_u}-wat.pdb", residue_names=[self.lig_resn_name])
+            if len(lig_atoms):
+                self.restraint_lig = str(lig_atoms.resseq[0])
         if not self.restraint_rec:
             self.restraint_rec = f"1-{int(self.restraint_lig) - 1}" # assume the ligand is the next residue after the receptor
 
@@ -43,25 +129,97 @@ class MD_input_prep:
         os.makedirs("run", exist_ok=True)
         os.chdir("run")
 
+    def stage_line(self, line):
+        """
+        Wraps a pmemd command line of the template into run_stage, using its -o output and -r restart, and guards the gzip lines
+        so that a resumed job does not compress the files of skipped stages again.
+        """
+        tokens = line.split()
+        if tokens and tokens[0] == "gzip":
+            trajectory = tokens[-1].rstrip("&") if tokens[-1] != "&" else tokens[-2]
+            return f"[ -f {trajectory} ] && gzip -9 -f {trajectory} &\n"
+        if "-o" in tokens and "-r" in tokens:
+            stage = tokens[tokens.index("-o") + 1].rsplit(".", 1)[0]
+            return f"run_stage {stage} {tokens[tokens.index('-r') + 1]} {line.strip()}\n"
+        return line
+
+    def chunk_counts(self):
+        """
+        Returns the minimum and the maximum number of chunks of an adaptive stage, both at least one chunk.
+        """
+        chunk = int(self.equil_chunk_nstlim)
+        min_chunks = max(1, -(-int(self.equil_min_nstlim) // chunk))
+        return min_chunks, max(min_chunks, -(-int(self.equil_max_nstlim) // chunk))
+
+    def adaptive_stage_function(self):
+        package_root = os.path.dirname(os.path.abspath(self.automd_home))
+        monitor = f"PYTHONPATH={package_root}:$PYTHONPATH {sys.executable} -m pyautomd.src.equilibration_monitor"
+        compress = "" if self.netcdf else "        [ -f _REC_-${stage}_$chunk._TRAJ_EXT_ ] && gzip -9 -f _REC_-${stage}_$chunk._TRAJ_EXT_ &\n"
+        function = ADAPTIVE_STAGE_FUNCTION.replace("_COMPRESS_", compress).replace("_MONITOR_", monitor)
+        function = function.replace("_EXEC_PROG_", self.exec_prog).replace("_PRMTOP_", f"{self.rec_name_u}.prmtop").replace("_REC_", self.rec_name_u)
+        return function.replace("_RST_EXT_", self.rst_ext).replace("_TRAJ_EXT_", self.traj_ext)
+
+    def adaptive_stage_line(self, line):
+        """
+        Replaces the pmemd command line of density or equil by run_adaptive_stage, keeping its input restart and reference.
+        """
+        tokens = line.split()
+        stage = tokens[tokens.index("-o") + 1].rsplit(".", 1)[0]
+        min_chunks, max_chunks = self.chunk_counts()
+        return f"run_adaptive_stage {stage} {tokens[tokens.index('-c') + 1]} {tokens[tokens.index('-ref') + 1]} {min_chunks} {max_chunks}\n"
+
     def generate_submit_pbs(self):
         print("Generating submit.pbs")
         with open("submit.pbs", "w") as file:
             with open(self.submit_pbs_head, "r") as head_file:
                 file.write(head_file.read())
+            file.write(RUN_STAGE_FUNCTION)
+            if self.adaptive_equil:
+                file.write(self.adaptive_stage_function())
             with open(os.path.join(f"{self.automd_home}", "src", "template_files", "submit2.template"), "r") as template_file:
                 for line in template_file:
+                    if self.netcdf and line.startswith("gzip"):
+                        continue # NetCDF files are binary and compact already
                     line = line.replace("_EXEC_PROG_", self.exec_prog.replace("/", "\/"))
                     line = line.replace("_rec_name_l_", self.rec_name_u)
-                    file.write(line)
+                    line = line.replace("_RST_EXT_", self.rst_ext).replace("_TRAJ_EXT_", self.traj_ext)
+                    if self.adaptive_equil and any(f"{self.rec_name_u}-{stage}.{self.traj_ext}" in line for stage in ADAPTIVE_STAGES):
+                        if line.startswith("gzip"):
+                            continue # the chunk trajectories are compressed by run_adaptive_stage
+                        file.write(self.adaptive_stage_line(line))
+                        continue
+                    file.write(self.stage_line(line))
             for i in range(1, self.prod_steps + 1):
                 last_step = i - 1
-                incoord = "equil.rst" if last_step == 0 else f"prod{last_step}.rst"
-                file.write(f"{self.exec_prog} -O -i ./ins/prod.in -o prod{i}.out -p {self.rec_name_u}.prmtop -c {incoord} -r prod{i}.rst -x {self.rec_name_u}-prod{i}.mdcrd\n")
-                file.write(f"gzip -9 {self.rec_name_u}-prod{i}.mdcrd&\n")
+                incoord = f"equil.{self.rst_ext}" if last_step == 0 else f"prod{last_step}.{self.rst_ext}"
+                trajectory = f"{self.rec_name_u}-prod{i}.{self.traj_ext}"
+                file.write(f"run_stage prod{i} prod{i}.{self.rst_ext} {self.exec_prog} -O -i ./ins/prod.in -o prod{i}.out -p {self.rec_name_u}.prmtop -c {incoord} -r prod{i}.{self.rst_ext} -x {trajectory}\n")
+                if self.compact_traj:
+                    # The ASCII trajectory is only compressed once it has been compacted, a compacted segment is not compacted again
+                    compact_output = f"{self.rec_name_u}-prod{i}-strip.{'zqt' if self.compact_precision else 'nc'}"
+                    compact = f"{self.compact_command(trajectory)} -o {compact_output}"
+                    if self.netcdf:
+                        file.write(f"[ -s {compact_output} ] || {compact} &\n")
+                    else:
+                        file.write(f"[ -s {compact_output} ] || ({compact} && gzip -9 -f {trajectory}) &\n")
+                elif not self.netcdf:
+                    file.write(f"[ -f {trajectory} ] && gzip -9 -f {trajectory} &\n")
             file.write("wait\n")
         os.chmod("submit.pbs", 0o755)
         print("submit.pbs successfully generated")
 
+    def compact_command(self, trajectory):
+        """
+        Returns the command stripping the solvent of a production segment, see trajectory_compactor.py.
+        The stripped topology {rec}-strip.prmtop is written by the first segment.
+        """
+        package_root = os.path.dirname(os.path.abspath(self.automd_home))
+        options = f"--stride {self.compact_stride}"
+        if self.compact_precision:
+            options += f" --precision {self.compact_precision}"
+        return (f"PYTHONPATH={package_root}:$PYTHONPATH {sys.executable} -m pyautomd.src.trajectory_compactor "
+                f"-p {self.rec_name_u}.prmtop -y {trajectory} -s {self.rec_name_u}-strip.prmtop {options}")
+
     def generate_input_files(self):
         print("Generating MD ins files")
         shutil.copytree(os.path.join(self.automd_home, "src", "template_files", "ins"), os.path.join(".", "ins"), dirs_exist_ok=True)
@@ -79,16 +237,21 @@ class MD_input_prep:
             content = content.replace("_RESTRAINT_ADD_", self.restraint_add)
             content = content.replace("_CUTOFF_", str(self.cutoff))
             content = content.replace("_FINAL_TEMP_", str(self.final_temp))
+            # The step counts are scaled to the time step, so that the simulated time and the output intervals stay the same
+            content = content.replace("_DT_", str(self.dt))
+            content = content.replace("_NTPR_", str(self.scale_steps(NTPR)))
+            content = content.replace("_NTWX_", str(self.scale_steps(NTWX)))
+            content = content.replace("_OUTPUT_FORMAT_", NETCDF_OUTPUT_FORMAT if self.netcdf else "")
 
             # Special replacements for specific files
             if filename == "heat.in":
-                content = content.replace("_HEAT_NSTLIM_", str(self.heat_nstlim))
+                content = content.replace("_HEAT_NSTLIM_", str(self.scale_steps(self.heat_nstlim)))
             elif filename == "density.in":
-                content = content.replace("_DENSITY_NSTLIM_", str(self.density_nstlim))
+                content = content.replace("_DENSITY_NSTLIM_", str(self.scale_steps(self.equil_chunk_nstlim if self.adaptive_equil else self.density_nstlim)))
             elif filename == "equil.in":
-                content = content.replace("_EQUIL_NSTLIM_", str(self.equil_nstlim))
+                content = content.replace("_EQUIL_NSTLIM_", str(self.scale_steps(self.equil_chunk_nstlim if self.adaptive_equil else self.equil_nstlim)))
             elif filename == "prod.in":
-                content = content.replace("_PROD_NSTLIM_", str(self.prod_nstlim))
+                content = content.replace("_PROD_NSTLIM_", str(self.scale_steps(self.prod_nstlim)))
 
             with open(f"ins/{filename}", "w") as file:
                 file.write(content)
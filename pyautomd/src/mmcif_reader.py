@@ -0,0 +1,177 @@
+import os
+import re
+
+MMCIF_EXTENSIONS = ('.cif', '.mmcif')
+TOKEN_PATTERN = re.compile(r"'(?:[^']|'(?=\S))*'(?=\s|$)|\"(?:[^\"]|\"(?=\S))*\"(?=\s|$)|\S+")
+CHAIN_IDS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+WRITE_CHUNK = 65536 # lines per write call
+
+
+def is_mmcif(file_path):
+    """
+    Returns True if the file name has an mmCIF extension.
+    """
+    return file_path.lower().endswith(MMCIF_EXTENSIONS)
+
+
+def cif_tokens(line):
+    """
+    Splits a data line of an mmCIF loop into its values, removing the quotes.
+    """
+    tokens = TOKEN_PATTERN.findall(line)
+    return [token[1:-1] if token[0] in "'\"" and len(token) > 1 else token for token in tokens]
+
+
+def iter_atom_site(cif_file):
+    """
+    Yields the rows of the _atom_site loop of an mmCIF/PDBx file as dictionaries (item name without the category -> value),
+    reading the file line by line. Only the first model is read.
+
+    :param cif_file: string, the mmCIF file name.
+    """
+    with open(cif_file, 'r') as f:
+        in_loop = False
+        items = []
+        values = []
+        first_model = None
+        for line in f:
+            stripped = line.strip()
+            if not items:
+                if stripped == 'loop_':
+                    in_loop = True
+                elif in_loop and stripped.startswith('_atom_site.'):
+                    items.append(stripped.split()[0][len('_atom_site.'):])
+                elif stripped:
+                    in_loop = False
+                continue
+            if stripped.startswith('_atom_site.'):
+                items.append(stripped.split()[0][len('_atom_site.'):])
+                continue
+            if not stripped or stripped.startswith('#'):
+                if values:
+                    continue
+                break
+            if stripped.startswith(('loop_', '_', 'data_')):
+                break
+            if stripped.startswith(';'):
+                raise ValueError(f"{cif_file}: multi-line values are not supported in the _atom_site loop.")
+            values.extend(cif_tokens(stripped))
+            # A row may be split over several lines
+            while len(values) >= len(items):
+                row = dict(zip(items, values[:len(items)]))
+                values = values[len(items):]
+                model = row.get('pdbx_PDB_model_num', '1')
+                if first_model is None:
+                    first_model = model
+                if model != first_model:
+                    return
+                yield row
+    if not items:
+        raise ValueError(f"No _atom_site loop found in {cif_file}.")
+
+
+def cif_value(row, *names, default=''):
+    """
+    Returns the first present value of the items, '.' and '?' meaning absent.
+    """
+    for name in names:
+        value = row.get(name)
+        if value is not None and value not in ('.', '?'):
+            return value
+    return default
+
+
+def one_character_chains(cif_file):
+    """
+    Returns the one-character chain ids of the atoms of an mmCIF file, read in a first streaming pass.
+    """
+    return {chain for chain in (cif_value(row, 'auth_asym_id', 'label_asym_id') for row in iter_atom_site(cif_file)) if len(chain) == 1}
+
+
+def assign_chain_id(chain, chain_ids, reserved=()):
+    """
+    Returns the one-character PDB chain id of an mmCIF chain and records it in chain_ids.
+    A one-character chain keeps its id, the other chains get the first id neither used nor reserved,
+    so that two chains never share an id. Once all ids are used they are reused cyclically, with a warning.
+
+    :param chain: string, the mmCIF chain id.
+    :param chain_ids: dictionary, mmCIF chain id -> PDB chain id, of the chains seen so far.
+    :param reserved: (Optional) set of strings, the one-character chains of the file, kept for themselves.
+    """
+    used = set(chain_ids.values())
+    if len(chain) == 1 and chain not in used:
+        chain_id = chain
+    else:
+        chain_id = next((candidate for candidate in CHAIN_IDS if candidate not in used and candidate not in reserved), None)
+        if chain_id is None:
+            chain_id = next((candidate for candidate in CHAIN_IDS if candidate not in used), None)
+        if chain_id is None:
+            if len(chain_ids) == len(CHAIN_IDS):
+                print(f"Warning: more than {len(CHAIN_IDS)} chains, the PDB chain ids are reused. The chains stay separated by TER records "
+                      "and the original chain ids are listed in the residue map.")
+            chain_id = CHAIN_IDS[len(chain_ids) % len(CHAIN_IDS)]
+    if chain_id != chain:
+        print(f"Chain {chain} written as chain {chain_id}.")
+    chain_ids[chain] = chain_id
+    return chain_id
+
+
+def cif_to_pdb(cif_file, pdb_file, resmap_file=None):
+    """
+    Converts the atoms of an mmCIF/PDBx file into a PDB file readable by tleap, streaming both files.
+    The residues are renumbered consecutively and the numbers wrap at 10000, the atom serial numbers wrap at 100000,
+    so that systems beyond the PDB fixed-width limits stay valid. A TER record separates the chains, which get distinct one-character ids.
+    The original chain and residue number of every written residue are listed in the residue map.
+
+    :param cif_file: string, the mmCIF file name.
+    :param pdb_file: string, the output PDB file name.
+    :param resmap_file: (Optional) string, the residue map file. Default: <pdb_file without extension>.resmap
+    :return: (number of atoms, number of residues).
+    """
+    if resmap_file is None:
+        resmap_file = f"{os.path.splitext(pdb_file)[0]}.resmap"
+    reserved = one_character_chains(cif_file)
+    chain_ids = {}
+    n_atoms = 0
+    n_residues = 0
+    last_chain = None
+    last_residue = None
+    lines = []
+    with open(pdb_file, 'w') as pdb, open(resmap_file, 'w') as resmap:
+        resmap.write("resseq\tresname\tchain\toriginal_resseq\tinsertion_code\n")
+        for row in iter_atom_site(cif_file):
+            chain = cif_value(row, 'auth_asym_id', 'label_asym_id')
+            resname = cif_value(row, 'auth_comp_id', 'label_comp_id')
+            original_resseq = cif_value(row, 'auth_seq_id', 'label_seq_id')
+            icode = cif_value(row, 'pdbx_PDB_ins_code')
+            name = cif_value(row, 'auth_atom_id', 'label_atom_id')
+            if len(name) > 4 or len(resname) > 4:
+                raise ValueError(f"{cif_file}: atom {name} of residue {resname} does not fit into the PDB name columns.")
+            if chain != last_chain and last_chain is not None:
+                lines.append("TER\n")
+            residue = (chain, original_resseq, icode, resname)
+            if residue != last_residue:
+                n_residues += 1
+                if chain not in chain_ids:
+                    assign_chain_id(chain, chain_ids, reserved)
+                resmap.write(f"{n_residues}\t{resname}\t{chain}\t{original_resseq}\t{icode}\n")
+            last_chain, last_residue = chain, residue
+            n_atoms += 1
+            record = 'HETATM' if row.get('group_PDB') == 'HETATM' else 'ATOM  '
+            name_field = name if len(name) == 4 else f" {name:<3s}"
+            resname_field = f"{resname:>3s} " if len(resname) <= 3 else resname
+            altloc = cif_value(row, 'label_alt_id')[:1]
+            element = cif_value(row, 'type_symbol')[:2]
+            charge = cif_value(row, 'pdbx_formal_charge')
+            charge = f"{charge.lstrip('+-')}{'-' if charge.startswith('-') else '+'}" if charge not in ('', '0') else ''
+            lines.append(f"{record}{n_atoms % 100000:5d} {name_field}{altloc:1s}{resname_field}{chain_ids[chain]:1s}{n_residues % 10000:4d}"
+                         f"    {float(row['Cartn_x']):8.3f}{float(row['Cartn_y']):8.3f}{float(row['Cartn_z']):8.3f}"
+                         f"{float(cif_value(row, 'occupancy', default='1.0')):6.2f}{float(cif_value(row, 'B_iso_or_equiv', default='0.0')):6.2f}"
+                         f"          {element:>2s}{charge:2s}\n")
+            if len(lines) >= WRITE_CHUNK:
+                pdb.writelines(lines)
+                lines = []
+        lines.append("END\n")
+        pdb.writelines(lines)
+    print(f"Converted {cif_file} to {pdb_file}: {n_atoms} atoms, {n_residues} residues, {len(chain_ids)} chains. Residue map written to {resmap_file}")
+    return n_atoms, n_residues
@@ -0,0 +1,234 @@
+import os
+import sys
+import array
+import struct
+from optparse import OptionParser
+
+# NetCDF-3 header tags and types, see the NetCDF classic format specification
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+STREAMING = 0xFFFFFFFF
+NC_TYPES = {1: ('b', 1), 2: ('c', 1), 3: ('h', 2), 4: ('i', 4), 5: ('f', 4), 6: ('d', 8)} # nc_type -> (struct code, size)
+HEADER_CHUNK = 65536
+
+
+class Netcdf_reader():
+    """
+    A reader of NetCDF-3 files (classic and 64-bit offset format), e.g. the Amber trajectories written with ioutfm=1
+    and the restarts written with ntxo=2. Only the header is parsed on opening, a frame is then read with a single seek,
+    so that frames can be counted and checked without reading the whole file.
+    """
+    def __init__(self, nc_file):
+        """
+        Initializes the Netcdf_reader class.
+
+        :param nc_file: string, the NetCDF file name.
+        """
+        self.nc_file = nc_file
+        self.file = open(nc_file, 'rb')
+        self.file_size = os.fstat(self.file.fileno()).st_size
+        self.buffer = b''
+        self.pos = 0
+        self.dimensions = {} # name -> length, 0 for the record dimension
+        self.attributes = {}
+        self.variables = {} # name -> dictionary with dims, type, vsize, begin, attributes and record
+        self.read_header()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def take(self, size):
+        while self.pos + size > len(self.buffer):
+            chunk = self.file.read(HEADER_CHUNK)
+            if not chunk:
+                raise ValueError(f"{self.nc_file}: truncated NetCDF header.")
+            self.buffer += chunk
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def take_int(self):
+        return struct.unpack('>i', self.take(4))[0]
+
+    def take_name(self):
+        length = self.take_int()
+        name = self.take(length).decode('utf-8', errors='replace')
+        self.take((-length) % 4)
+        return name
+
+    def take_values(self, nc_type, count):
+        code, size = NC_TYPES[nc_type]
+        data = self.take(count * size)
+        self.take((-count * size) % 4)
+        if nc_type == 2:
+            return data.rstrip(b'\0').decode('utf-8', errors='replace')
+        values = struct.unpack(f">{count}{code}", data)
+        return values[0] if count == 1 else list(values)
+
+    def take_attributes(self):
+        tag, count = self.take_int(), self.take_int()
+        if tag not in (0, NC_ATTRIBUTE):
+            raise ValueError(f"{self.nc_file}: malformed NetCDF attribute list.")
+        attributes = {}
+        for _ in range(count):
+            name = self.take_name()
+            nc_type = self.take_int()
+            attributes[name] = self.take_values(nc_type, self.take_int())
+        return attributes
+
+    def read_header(self):
+        magic = self.take(4)
+        if magic[:3] != b'CDF' or magic[3] not in (1, 2):
+            raise ValueError(f"{self.nc_file} is not a NetCDF-3 file (NetCDF-4/HDF5 files are not supported).")
+        offset_size = 8 if magic[3] == 2 else 4
+        self.numrecs = struct.unpack('>I', self.take(4))[0]
+        tag, count = self.take_int(), self.take_int()
+        if tag not in (0, NC_DIMENSION):
+            raise ValueError(f"{self.nc_file}: malformed NetCDF dimension list.")
+        dimension_names = []
+        for _ in range(count):
+            name = self.take_name()
+            self.dimensions[name] = self.take_int()
+            dimension_names.append(name)
+        self.record_dimension = next((name for name in dimension_names if self.dimensions[name] == 0), None)
+        self.attributes = self.take_attributes()
+        tag, count = self.take_int(), self.take_int()
+        if tag not in (0, NC_VARIABLE):
+            raise ValueError(f"{self.nc_file}: malformed NetCDF variable list.")
+        for _ in range(count):
+            name = self.take_name()
+            dims = [dimension_names[self.take_int()] for _ in range(self.take_int())]
+            attributes = self.take_attributes()
+            nc_type = self.take_int()
+            vsize = struct.unpack('>I', self.take(4))[0]
+            begin = struct.unpack('>Q' if offset_size == 8 else '>I', self.take(offset_size))[0]
+            self.variables[name] = {'dims': dims, 'type': nc_type, 'vsize': vsize, 'begin': begin, 'attributes': attributes,
+                                    'record': bool(dims) and dims[0] == self.record_dimension}
+        record_variables = [variable for variable in self.variables.values() if variable['record']]
+        if len(record_variables) == 1:
+            # A single record variable is not padded
+            self.record_size = self.value_count(record_variables[0]) * NC_TYPES[record_variables[0]['type']][1]
+        else:
+            self.record_size = sum(variable['vsize'] for variable in record_variables)
+        self.records_begin = min((variable['begin'] for variable in record_variables), default=self.file_size)
+
+    def value_count(self, variable):
+        """
+        Returns the number of values of a variable in one record (record variables) or in total.
+        """
+        count = 1
+        for dim in variable['dims'][1:] if variable['record'] else variable['dims']:
+            count *= self.dimensions[dim]
+        return count
+
+    @property
+    def complete_frames(self):
+        """
+        The number of records completely present in the file.
+        """
+        if not self.record_size:
+            return 0
+        return max(0, (self.file_size - self.records_begin) // self.record_size)
+
+    @property
+    def n_frames(self):
+        """
+        The number of frames: the number of records of the header, limited to the complete records of the file
+        (a trajectory that is still written or was cut short by a crash).
+        """
+        if self.numrecs == STREAMING:
+            return self.complete_frames
+        return min(self.numrecs, self.complete_frames)
+
+    @property
+    def n_atoms(self):
+        return self.dimensions.get('atom', 0)
+
+    def read(self, name, frame=None):
+        """
+        Reads the values of a variable, of one frame for a record variable.
+
+        :param name: string, the variable name, e.g. 'coordinates', 'time' or 'cell_lengths'.
+        :param frame: (Optional) int, the 0-based frame of a record variable.
+        :return: array.array of the values in the native byte order, or a string for character variables.
+        """
+        if name not in self.variables:
+            raise ValueError(f"{self.nc_file} has no variable {name}.")
+        variable = self.variables[name]
+        code, size = NC_TYPES[variable['type']]
+        count = self.value_count(variable)
+        offset = variable['begin']
+        if variable['record']:
+            if frame is None or not 0 <= frame < self.n_frames:
+                raise ValueError(f"{self.nc_file}: frame {frame} out of range, {self.n_frames} frames.")
+            offset += frame * self.record_size
+        self.file.seek(offset)
+        data = self.file.read(count * size)
+        if len(data) < count * size:
+            raise ValueError(f"{self.nc_file}: variable {name} is truncated.")
+        if code == 'c':
+            return data.rstrip(b'\0').decode('utf-8', errors='replace')
+        values = array.array(code)
+        values.frombytes(data)
+        if sys.byteorder == 'little' and size > 1:
+            values.byteswap()
+        return values
+
+    def iter_frames(self, name='coordinates', start=0, stop=None, stride=1):
+        """
+        Yields (frame, values) of a record variable, one frame in memory at a time.
+        """
+        stop = self.n_frames if stop is None else min(stop, self.n_frames)
+        for frame in range(start, stop, stride):
+            yield frame, self.read(name, frame)
+
+    def check(self, n_atoms=None):
+        """
+        Checks an Amber NetCDF trajectory or restart: the conventions, the number of atoms and the completeness of the frames.
+
+        :param n_atoms: (Optional) int, the expected number of atoms, e.g. from the prmtop.
+        :return: list of strings, the problems found, empty if the file is fine.
+        """
+        problems = []
+        conventions = self.attributes.get('Conventions', '')
+        if conventions not in ('AMBER', 'AMBERRESTART'):
+            problems.append(f"unexpected Conventions '{conventions}'")
+        if 'coordinates' not in self.variables:
+            problems.append("no coordinates variable")
+        if n_atoms is not None and self.n_atoms != n_atoms:
+            problems.append(f"{self.n_atoms} atoms instead of {n_atoms}")
+        if self.numrecs != STREAMING and self.complete_frames < self.numrecs:
+            problems.append(f"only {self.complete_frames} of {self.numrecs} frames are complete")
+        if self.record_dimension is None and self.file_size < max((variable['begin'] + variable['vsize'] for variable in self.variables.values()), default=0):
+            problems.append("the file is truncated")
+        return problems
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] file.nc [file.nc ...]\nCounts the frames of Amber NetCDF trajectories and restarts and checks their integrity.")
+    parser.add_option('-n', '--atoms', dest='n_atoms', type='int', default=None, help="The expected number of atoms. Default: not checked")
+    options, args = parser.parse_args()
+    if not args:
+        parser.error("no NetCDF file given")
+    failed = False
+    for nc_file in args:
+        try:
+            with Netcdf_reader(nc_file) as nc:
+                problems = nc.check(options.n_atoms)
+                print(f"{nc_file}: {nc.attributes.get('Conventions', '')}, {nc.n_atoms} atoms, {nc.n_frames} frames" + (f", {'; '.join(problems)}" if problems else ''))
+        except (OSError, ValueError) as error:
+            problems = [str(error)]
+            print(f"{nc_file}: {error}")
+        failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,18 @@
 import os
-import subprocess
 import sys
 import glob
-import re
 import shutil
 from ..executable_checker import Executable_checker
+from ..external_program_runner import get_runner
+from .prepi_model import Prepi
+from .gaussian_esp_parser import extract_esp
+from . import resp_fit
 
 class PrepiGenerator:
     """
     A class for generating prepi and frcmod files for nonstandard amino acids and small molecules.
     """
-    def __init__(self, pdb, resn, netcharge, charge_method='bcc', lig_ff='gaff', gau=None):
+    def __init__(self, pdb, resn, netcharge, charge_method='bcc', lig_ff='gaff', gau=None, extra_formats=None, resp_engine='resp'):
         """
         Initializes the PrepiGenerator class.
 
@@ -20,6 +22,9 @@ class PrepiGenerator:
         :param lig_ff: Ligand force field. 'gaff' or 'gaff2'
         :param gau: Gaussian output file name. Required for resp charge method.
         :param netcharge: Net charge of the ligand. 
+        :param extra_formats: (Optional) Additional output formats of small molecules, 'mol2' and/or 'lib'. Generated from the same charges as the prepi file.
+        :param resp_engine: (Optional) The RESP fitting engine. 'resp' runs the resp program, 'native' fits in-process (requires numpy),
+            'validate' runs the resp program and checks that the in-process fit gives the same charges.
         """
         self.pdb = pdb
         self.resn = resn
@@ -27,15 +32,30 @@ class PrepiGenerator:
         self.charge_method = charge_method # 'bcc' or 'resp'
         self.lig_ff = lig_ff # 'gaff' or 'gaff2'
         self.gau = gau
+        self.extra_formats = list(extra_formats) if extra_formats else []
+        for extra_format in self.extra_formats:
+            if extra_format not in ['mol2', 'lib']:
+                raise ValueError(f"Invalid extra output format {extra_format}. Supported formats are 'mol2' and 'lib'.")
         if self.charge_method == 'resp':
             if self.gau is None:
                 raise ValueError("Gaussian output file is required for resp charge method.")
+        if resp_engine not in ['resp', 'native', 'validate']:
+            raise ValueError(f"Invalid RESP engine {resp_engine}. Supported engines are 'resp', 'native' and 'validate'.")
+        if resp_engine != 'resp' and not resp_fit.numpy_available():
+            raise ImportError(f"numpy is required for the RESP engine {resp_engine}, install it with 'pip install pyautomd[resp]' or use resp_engine = resp.")
+        self.resp_engine = resp_engine
         self.prefix = f"{resn}tmpwgXeY"
+        self.prepi_model = None # Prepi object of the final prepi file
+        self.esp_data = None # Gaussian_esp_data object of the Gaussian output, read once for the RESP fit
         # Define charge dictionaries
         self.ace = {"h1": 0.11230, "ch": -0.36620, "c": 0.59720, "o": -0.56790}
         self.nme = {"n": -0.41570, "h": 0.27190, "ch": -0.14900, "h1": 0.09760}
         self.ac = {"c": 0.59730, "o": -0.56790, "n": -0.41570, "h": 0.27190}
         self.use_programs = ["antechamber", "parmchk2", "prepgen", "resp"]
+        if 'lib' in self.extra_formats:
+            self.use_programs.append("tleap")
+        if self.charge_method == 'resp':
+            self.use_programs.append("respgen")
         self.check_programs()
 
     def check_programs(self):
@@ -68,30 +88,46 @@ class PrepiGenerator:
                     pass
                 #     print(f"Error while removing {file_path}: {e}")
 
-    def gen_atominfo_template(self, input_file):
+    def read_atominfo(self, input_file):
         """
-        Returns a function that generates a template file by extracting lines starting with 'ATOM'.
-        The input file is specified by the input_file parameter.
+        Returns the 'ATOM' lines of the input file (pdb or ac) in the file order.
         """
-        def generate_template():
-            output_file = f"{self.prefix}.{input_file.split('.')[-1]}tmp"
-            with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-                for line in infile:
-                    if line.startswith("ATOM"):
-                        outfile.write(line[:20] + '\n')
-            return output_file
+        with open(input_file, 'r') as infile:
+            return [line for line in infile if line.startswith("ATOM")]
 
-        return generate_template
+    def run_commands(self, commands):
+        """
+        Runs independent external program commands concurrently through the shared runner and reports the failed ones.
+
+        :param commands: list of command lines.
+        :return: list of Program_run_record objects in the order of the commands.
+        """
+        runner = get_runner()
+        if len(commands) == 1:
+            records = [runner.run(commands[0])]
+        else:
+            records = runner.run_many([(command, {}) for command in commands])
+        for record in records:
+            if not record.success:
+                print(f"An error occurred while running {record.name}: {record}")
+        return records
 
-    def run_antechamber(self, fi, fo, i, o, c, nc=None, rn=None, rf=None, at=None, cf=None):
+    def run_antechamber(self, fi, fo, i, o, c=None, nc=None, rn=None, rf=None, at=None, cf=None):
         """
         Executes the antechamber command with the given options.
+        See antechamber_command for the options.
+        """
+        return self.run_commands([self.antechamber_command(fi, fo, i, o, c, nc, rn, rf, at, cf)])[0]
+
+    def antechamber_command(self, fi, fo, i, o, c=None, nc=None, rn=None, rf=None, at=None, cf=None):
+        """
+        Returns the antechamber command line with the given options.
 
         :param fi: Input file format.
         :param fo: Output file format.
         :param i: Input file name.
         :param o: Output file name.
-        :param c: Charge method.
+        :param c: (Optional) Charge method. If None, the charges of the input file are kept.
         :param nc: (Optional) Net charge.
         :param rn: (Optional) Residue name.
         :param rf: (Optional) Residue topology file name.
@@ -99,9 +135,11 @@ class PrepiGenerator:
         :param cf: (Optional) Charge file name.
         """
         # Base command
-        command = ["antechamber", "-fi", fi, "-fo", fo, "-i", i, "-o", o, "-c", c]
+        command = ["antechamber", "-fi", fi, "-fo", fo, "-i", i, "-o", o]
 
         # Optional parameters
+        if c is not None:
+            command.extend(["-c", c])
         if nc is not None:
             command.extend(["-nc", nc])
         if rn is not None:
@@ -112,10 +150,44 @@ class PrepiGenerator:
             command.extend(["-at", at])
         if cf is not None:
             command.extend(["-cf", cf])
-        try:
-            subprocess.run(command, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"An error occurred while running antechamber: {e}")  
+        return command
+
+    def write_charge_file(self, ac_file, crg_file):
+        """
+        Writes the atomic charges of an antechamber .ac file into a charge file readable by 'antechamber -c rc -cf'.
+
+        :param ac_file: The .ac file name.
+        :param crg_file: The output charge file name.
+        """
+        charges = []
+        with open(ac_file, "r") as infile:
+            for line in infile:
+                if line.startswith("ATOM"):
+                    charges.append(float(line.split()[-2]))
+        if not charges:
+            raise ValueError(f"No atomic charges found in {ac_file}. Please check if the antechamber charge calculation succeeded.")
+        with open(crg_file, "w") as outfile:
+            for start in range(0, len(charges), 8):
+                outfile.write("".join(f"{charge:10.6f}" for charge in charges[start:start + 8]) + "\n")
+
+    def gen_frcmod_and_extra_outputs(self):
+        """
+        Generates the frcmod file and the additional output formats ('mol2' and/or 'lib') from the final prepi file, so that they carry the same charges and atom names.
+        parmchk2 and the mol2 conversion are independent and run concurrently.
+        """
+        commands = [self.parmchk2_command(f"{self.resn}.prepi", "prepi", f"{self.resn}.frcmod")]
+        if 'mol2' in self.extra_formats:
+            commands.append(self.antechamber_command(fi="prepi", fo="mol2", i=f"{self.resn}.prepi", o=f"{self.resn}.mol2", rn=self.resn, at=self.lig_ff))
+        self.run_commands(commands)
+        if 'lib' in self.extra_formats:
+            leap_input = f"""source leaprc.{self.lig_ff}
+loadamberparams {self.resn}.frcmod
+loadamberprep {self.resn}.prepi
+saveoff {self.resn} {self.resn}.lib
+quit"""
+            with open(f"{self.prefix}.leap", "w") as leap_file:
+                leap_file.write(leap_input)
+            self.run_commands([["tleap", "-f", f"{self.prefix}.leap"]])
 
     def run_resp(self, i, o, e, t, q=None):
         """
@@ -134,10 +206,60 @@ class PrepiGenerator:
         if q is not None:
             command.extend(["-q", q])
 
-        try:
-            subprocess.run(command, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"An error occurred while running RESP: {e}")
+        return self.run_commands([command])[0]
+
+    def write_resp_inputs(self, constraints_file=None):
+        """
+        Writes the inputs of the two-stage RESP fit: the ESP file of the resp program, extracted once from the Gaussian output,
+        and the step1/step2 respin files generated by respgen from the {prefix}.ac file.
+        The molecule section of respgen is followed by the group constraints, if any, and by the blank lines that end the input.
+
+        :param constraints_file: (Optional) string, a file of group constraints ('ngrp charge' and the (molecule, atom) pairs) added to both respin files.
+        """
+        self.esp_data = extract_esp(self.gau)
+        self.esp_data.write_esp(f"{self.prefix}.esp")
+        self.run_commands([["respgen", "-i", f"{self.prefix}.ac", "-o", f"{self.prefix}.respgen1", "-f", "resp1"],
+                           ["respgen", "-i", f"{self.prefix}.ac", "-o", f"{self.prefix}.respgen2", "-f", "resp2"]])
+        for resp_file, output_suffix in [(f"{self.prefix}.respgen1", "step1.respin"), (f"{self.prefix}.respgen2", "step2.respin")]:
+            if not os.path.exists(resp_file):
+                raise FileNotFoundError(f"{resp_file} not found. Please check if respgen succeeded.")
+            with open(resp_file, "r") as infile, open(f"{self.prefix}.{output_suffix}", "w") as outfile:
+                n_after_end = None
+                for line in infile:
+                    if line.strip() == "&end":
+                        n_after_end = 0
+                    elif n_after_end is not None:
+                        if len(line.strip()) == 0:
+                            break
+                        n_after_end += 1
+                        if n_after_end == 3:
+                            # The molecule charge and the number of atoms, the charge of the .ac file may differ from the requested net charge
+                            line = f"{int(self.netcharge):5d}{int(line.split()[1]):5d}\n"
+                    outfile.write(line)
+                if constraints_file is not None:
+                    with open(constraints_file, "r") as constraints:
+                        shutil.copyfileobj(constraints, outfile)
+                # The blank lines that end the group constraints and the input of the resp program
+                outfile.write("\n\n")
+
+    def run_two_stage_resp(self):
+        """
+        Runs the two-stage RESP fit on the respin files written by write_resp_inputs, in-process or with the resp program.
+        Both engines write the charge files in the same format. With the 'validate' engine the charges of the resp program are used,
+        and both stages are refitted in-process and compared to them.
+
+        :return: the charge file of the second stage.
+        """
+        if self.resp_engine == 'native':
+            resp_fit.two_stage_resp(f"{self.prefix}.step1.respin", f"{self.prefix}.step2.respin", [self.esp_data],
+                                    f"{self.prefix}.step1.crg", f"{self.prefix}.step2.crg")
+            return f"{self.prefix}.step2.crg"
+        self.run_resp(i=f"{self.prefix}.step1.respin", o=f"{self.prefix}.step1.respout", e=f"{self.prefix}.esp", t=f"{self.prefix}.step1.crg")
+        self.run_resp(i=f"{self.prefix}.step2.respin", o=f"{self.prefix}.step2.respout", e=f"{self.prefix}.esp", q=f"{self.prefix}.step1.crg", t=f"{self.prefix}.step2.crg")
+        if self.resp_engine == 'validate':
+            resp_fit.validate_two_stage_resp(f"{self.prefix}.step1.respin", f"{self.prefix}.step2.respin", [self.esp_data],
+                                             f"{self.prefix}.step1.crg", f"{self.prefix}.step2.crg")
+        return f"{self.prefix}.step2.crg"
 
     def has_nme_or_ace_cap(self):
         """
@@ -153,18 +275,19 @@ class PrepiGenerator:
     def run_parmchk2(self, i, f, o):
         """
         Executes the parmchk2 command with the given options.
+        See parmchk2_command for the options.
+        """
+        return self.run_commands([self.parmchk2_command(i, f, o)])[0]
+
+    def parmchk2_command(self, i, f, o):
+        """
+        Returns the parmchk2 command line with the given options.
 
         :param i: Input file name.
         :param f: Input file format.
         :param o: Output file name.
         """
-        command = ["parmchk2", "-i", i, "-f", f, "-o", o]
-
-        # Execute the command
-        try:
-            subprocess.run(command, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"An error occurred while running parmchk2: {e}")
+        return ["parmchk2", "-i", i, "-f", f, "-o", o]
 
     def run_prepgen(self, i, o, f, m, rn, rf):
         """
@@ -180,136 +303,34 @@ class PrepiGenerator:
         command = ["prepgen", "-i", i, "-o", o, "-f", f, "-m", m, "-rn", rn, "-rf", rf]
 
         # Execute the command
-        try:
-            subprocess.run(command, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"An error occurred while running prepgen: {e}")
+        return self.run_commands([command])[0]
 
     def keep_atominfo_prepi_to_pdb(self, ifnonstandard_aminoa_acid=False):
         """
         Change the atom names in the .prepi file to match the atom names in the .pdb file.
+        The atoms of the .ac file and the .pdb file are in the same order, which gives the name mapping.
 
         :param ifnonstandard_aminoa_acid: (Optional) If the residue is a nonstandard amino acid.
         """
-        if ifnonstandard_aminoa_acid:
-            with open(f"{self.prefix}.prepi", "r") as prepi_file:
-                prepi_content = prepi_file.read()
-            m1_count = prepi_content.count("+M")
-            m2_count = prepi_content.count("-M")
-        # Read contents of tmp1 and tmp2 files
         convert_name = {}
-        with open(f"{self.prefix}.pdbtmp", "r") as file1, open(f"{self.prefix}.actmp", "r") as file2:
-            for line1, line2 in zip(file1, file2):
-                # Concatenate lines from both files
-                combined_line = line1.strip() + line2.strip()
-                
-                # Extract residue name, pdb atom name, and ac atom name
-                resname = combined_line[17:20]
-                if resname != "ACE" and resname != "NME":
-                    pdb_atm = combined_line[12:16].strip()
-                    ac_atm = combined_line[33:37].strip()
-                    convert_name[ac_atm] = pdb_atm
-                    # print(convert_name)
-        # Process the .prepi file
-        output_lines = []
-
-        with open(f"{self.prefix}.prepi", "r") as prepi_file:
-            i = 0
-            for line in prepi_file:
-                i += 1
-                fields = line.split()
-
-                if len(line) > 60 and len(fields) == 11 and fields[2] != "DU":
-                    if fields[1] not in convert_name:
-                        raise KeyError(f"Key {fields[1]} not found in convert_name for line: {line}")
-                    else:
-                        new_line = f"{line[:6]}{convert_name[fields[1]]:<4}{line[10:]}"
-                elif line.startswith("IMPROPER"):
-                    new_line = line
-                    i = 1000
-                elif i > 1000 and i < 2000:
-                    if len(fields) == 0:
-                        new_line = "\n"
-                        i = 0
-                        if ifnonstandard_aminoa_acid:
-                            if m1_count < 1:
-                                output_lines.append(" CA   +M   C    O\n")
-                            if m2_count < 1:
-                                output_lines.append(" -M   CA   N    H\n")
-                            output_lines.append("\n")
-                            i = 0
-                    else:
-                        imprp = []
-                        for atom in fields[:4]:
-                            if "M" not in atom:
-                                # If "M" is not in atom name, convert the atom name using convert_name dictionary
-                                if atom not in convert_name:
-                                    raise KeyError(f"Key {atom} not found in convert_name for line: {line}")
-                                else:
-                                    imprp.append(convert_name[atom])
-                            else:
-                                # If "M" is in atom name, use the atom name as it is
-                                imprp.append(atom)
-                        # imprp = [convert_name.get(atom, atom) for atom in fields[:4]]
-                        new_line = f"{''.join(f'{atom:>5}' for atom in imprp)}\n"
-                elif line.startswith("LOOP"):
-                    new_line = line
-                    i = 2000
-                elif i > 2000:
-                    if len(fields) == 0:
-                        new_line = "\n"
-                        i = 0
-                    else:
-                        if fields[0] not in convert_name:
-                            raise KeyError(f"Key {fields[0]} not found in convert_name for line: {line}")
-                        else:
-                            new_line = f"{convert_name[fields[0]]:>5}{convert_name[fields[1]]:>5}\n"
-                else:
-                    new_line = line
-
-                output_lines.append(new_line)
-        # Apply sed replacements using regular expressions
-        sed_replacements = [
-            (r" 2HB ", " HB2 "), (r" 3HB ", " HB3 "), (r" 1H1 ", " H11 "), 
-            (r" 2H1 ", " H12 "), (r" 3H1 ", " H13 "), (r" 1H2 ", " H21 "),
-            (r" 2H2 ", " H22 "), (r" 3H2 ", " H23 "), (r" 1H5 ", " H51 "),
-            (r" 2H5 ", " H52 "), (r" 3H5 ", " H53 "), (r" 1H1' ", " H1'1 "),
-            (r" 2H1' ", " H1'2 "), (r" 3H1' ", " H1'3 "), (r" 1H2' ", " H2'1 "),
-            (r" 2H2' ", " H2'2 "), (r" 3H2' ", " H2'3 "), (r" 1H5' ", " H5'1 "),
-            (r" 2H5' ", " H5'2 "), (r" 3H5' ", " H5'3 "),
-        ]
-
-        processed_output = "".join(output_lines)
-        for pattern, replacement in sed_replacements:
-            processed_output = re.sub(pattern, replacement, processed_output)
-
-        # Write the processed output to the .prepi file
-        with open(f"{self.resn}.prepi", "w") as output_file:
-            output_file.write(processed_output)
+        for pdb_line, ac_line in zip(self.read_atominfo(self.pdb), self.read_atominfo(f"{self.prefix}.ac")):
+            resname = pdb_line[17:20].strip()
+            if resname != "ACE" and resname != "NME":
+                convert_name[ac_line[13:17].strip()] = pdb_line[12:16].strip()
+        prepi = Prepi.read(f"{self.prefix}.prepi")
+        prepi.rename_atoms(convert_name)
+        if ifnonstandard_aminoa_acid:
+            prepi.add_backbone_impropers()
+        prepi.write(f"{self.resn}.prepi")
+        self.prepi_model = prepi
 
     def gen_nonstandard_amino_acid_prepi(self):
         """
         Generates the prepi file and frcmod file for nonstandard amino acids.
         """
         if self.charge_method == 'resp':
-            #  1). run antechamber to get template ac file and resp input file
-            self.run_antechamber(fi="gout", fo="ac", i=self.gau, o=f"{self.prefix}.ac", c="resp", nc=self.netcharge)
-            if os.path.exists("ANTECHAMBER.ESP"):
-                shutil.copy("ANTECHAMBER.ESP", f"{self.prefix}.esp")
-            else:
-                raise FileNotFoundError("ANTECHAMBER.ESP not found. Please check if the Gaussian output file is correct.")
-            # Process ANTECHAMBER_RESP1.IN and ANTECHAMBER_RESP2.IN
-            for resp_file, output_suffix in [("ANTECHAMBER_RESP1.IN", "step1.respin"), ("ANTECHAMBER_RESP2.IN", "step2.respin")]:
-                with open(resp_file, "r") as infile, open(f"{self.prefix}.{output_suffix}", "w") as outfile:
-                    go = False
-                    for line in infile:
-                        if line.strip() == "&end":
-                            go = True
-                            outfile.write(line)
-                        elif go and len(line.strip()) == 0:
-                            break
-                        else:
-                            outfile.write(line)
+            #  1). run antechamber to get template ac file, then the ESP file and the resp input files
+            self.run_antechamber(fi="gout", fo="ac", i=self.gau, o=f"{self.prefix}.ac", nc=self.netcharge)
             #  2). add constraints to resp input files
             #      - constrain charges of NME and ACE exactly the same as in 
             #        AMBER database
@@ -354,18 +375,9 @@ class PrepiGenerator:
                         if atmname == "O":
                             tmp_file.write(f"{1:5d}{ac['o']:10.5f}\n{1:5d}{i:5d}\n")
 
-            # Append additional lines
-            with open(f"{self.prefix}.tmp", "a") as tmp_file:
-                tmp_file.write("\n\n")
-
-
-            # Append content to step1 and step2 respin files
-            for step_file in [f"{self.prefix}.step1.respin", f"{self.prefix}.step2.respin"]:
-                with open(f"{self.prefix}.tmp", 'r') as tmp_file, open(step_file, 'a') as resp_file:
-                    shutil.copyfileobj(tmp_file, resp_file)
-            self.run_resp(i=f"{self.prefix}.step1.respin", o=f"{self.prefix}.step1.respout", e=f"{self.prefix}.esp", t=f"{self.prefix}.step1.crg")
-            self.run_resp(i=f"{self.prefix}.step2.respin", o=f"{self.prefix}.step2.respout", e=f"{self.prefix}.esp", q=f"{self.prefix}.step1.crg", t=f"{self.prefix}.step2.crg")
-            self.run_antechamber(fi="gout", fo="ac", i=self.gau, o=f"{self.prefix}.ac.2", c="rc", cf=f"{self.prefix}.step2.crg", at="amber")
+            self.write_resp_inputs(constraints_file=f"{self.prefix}.tmp")
+            crg_file = self.run_two_stage_resp()
+            self.run_antechamber(fi="ac", fo="ac", i=f"{self.prefix}.ac", o=f"{self.prefix}.ac.2", c="rc", cf=crg_file, at="amber")
             os.remove(f"{self.prefix}.ac")
             os.rename(f"{self.prefix}.ac.2", f"{self.prefix}.ac")
             #  3). make mainchain file
@@ -406,8 +418,6 @@ class PrepiGenerator:
             self.run_prepgen(i=f"{self.prefix}.ac", o=f"{self.prefix}.prepi", f="prepi", m=f"{self.prefix}.mainchain", rn=self.resn, rf="")
         elif self.charge_method == 'bcc':
             raise NotImplementedError("Charge method 'bcc' is not supported for the parameters preparation nonstandard amino acid yet.")
-        self.gen_atominfo_template(f"{self.prefix}.ac")()
-        self.gen_atominfo_template(self.pdb)()
         self.keep_atominfo_prepi_to_pdb(ifnonstandard_aminoa_acid=True)
         self.run_parmchk2(f"{self.resn}.prepi", "prepi", f"{self.resn}.frcmod")
         self.clean_up()
@@ -415,19 +425,24 @@ class PrepiGenerator:
     def gen_small_molecule_prepi(self):
         """
         Generates the prepi file for small molecules.
+        The charges are calculated once (the expensive sqm or RESP step) and reused by every output format through 'antechamber -c rc'.
+        For RESP, the Gaussian output is parsed once by antechamber (geometry and connectivity) and once for the ESP.
         """
         if self.charge_method == 'resp':
-            self.run_antechamber(fi="gout", fo="ac", i=self.gau, o=f"{self.prefix}.ac", c="resp", nc=self.netcharge,  rn=self.resn, rf='\"\"',at=self.lig_ff)
-            self.run_antechamber(fi="gout", fo="prepi", i=self.gau, o=f"{self.prefix}.prepi", c="resp", nc=self.netcharge, rn=self.resn, rf='\"\"', at=self.lig_ff)
+            rf = '\"\"'
+            self.run_antechamber(fi="gout", fo="ac", i=self.gau, o=f"{self.prefix}.ac", nc=self.netcharge,  rn=self.resn, rf=rf, at=self.lig_ff)
+            self.write_resp_inputs()
+            crg_file = self.run_two_stage_resp()
         elif self.charge_method == 'bcc':
+            rf = None
             self.run_antechamber(fi="pdb", fo="ac", i=self.pdb, o=f"{self.prefix}.ac", c="bcc", nc=self.netcharge, rn=self.resn, at=self.lig_ff)
-            self.run_antechamber(fi="pdb", fo="prepi", i=self.pdb, o=f"{self.prefix}.prepi", c="bcc", nc=self.netcharge, rn=self.resn, at=self.lig_ff)
+            crg_file = f"{self.prefix}.crg"
+            self.write_charge_file(f"{self.prefix}.ac", crg_file)
         else:
             raise ValueError("Invalid charge method.")
-        self.gen_atominfo_template(f"{self.prefix}.ac")()
-        self.gen_atominfo_template(self.pdb)()
+        self.run_antechamber(fi="ac", fo="prepi", i=f"{self.prefix}.ac", o=f"{self.prefix}.prepi", c="rc", cf=crg_file, nc=self.netcharge, rn=self.resn, rf=rf, at=self.lig_ff)
         self.keep_atominfo_prepi_to_pdb()
-        self.run_parmchk2(f"{self.resn}.prepi", "prepi", f"{self.resn}.frcmod")
+        self.gen_frcmod_and_extra_outputs()
         self.clean_up()
 
 
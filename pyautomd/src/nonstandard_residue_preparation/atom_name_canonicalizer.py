@@ -0,0 +1,101 @@
+MAX_NAME_LENGTH = 4 # PDB atom name columns 13-16
+SPECIAL_TYPES = ['CL', 'Cl', 'BR', 'Br']
+BASE36_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def atom_name_type(name):
+    """
+    Returns the type prefix of an atom name used for the new names, the first letter or Cl/Br.
+    """
+    if name[0:2] in SPECIAL_TYPES:
+        return name[0:2]
+    return name[0:1] or 'X'
+
+
+def base36(number, width):
+    digits = ''
+    while number:
+        number, digit = divmod(number, 36)
+        digits = BASE36_DIGITS[digit] + digits
+    return digits.rjust(width, '0')
+
+
+class Atom_name_canonicalizer():
+    """
+    Assigns unique PDB atom names (at most 4 characters) in linear time.
+    The first occurrence of a name is kept, the later duplicates are renamed {type}X{k} with the smallest free k,
+    the type being the first letter of the name or Cl/Br. When {type}X{k} no longer fits into 4 characters,
+    the remaining characters hold a base-36 counter. The used names are indexed in a set and every type keeps
+    its own counter, so that no name is probed twice.
+    """
+    def __init__(self, reserved_names=()):
+        """
+        Initializes the Atom_name_canonicalizer class.
+
+        :param reserved_names: (Optional) iterable of strings, names that must not be given to renamed atoms.
+        """
+        self.used = set(reserved_names)
+        self.counters = {}
+
+    def next_name(self, atmtype):
+        """
+        Returns the next free name of the given type and marks it as used.
+        """
+        k = self.counters.get(atmtype, 1)
+        while True:
+            candidate = f"{atmtype}X{k}"
+            if len(candidate) > MAX_NAME_LENGTH:
+                # Continue the counter in base 36 over all remaining characters once the decimal form does not fit
+                width = MAX_NAME_LENGTH - len(atmtype)
+                overflow = k - 10 ** (width - 1)
+                if overflow >= 36 ** width:
+                    raise ValueError(f"Too many duplicated atom names of type {atmtype}, no 4-character name left.")
+                candidate = f"{atmtype}{base36(overflow, width)}"
+            k += 1
+            if candidate not in self.used:
+                self.counters[atmtype] = k
+                self.used.add(candidate)
+                return candidate
+
+    def canonicalize(self, names):
+        """
+        Makes the atom names unique.
+
+        :param names: list of strings, the atom names.
+        :return: (new_names, renames), the list of the unique names and a dictionary atom index -> (old name, new name) of the renamed atoms.
+        """
+        # The names present in the input are never given to a renamed atom
+        self.used.update(names)
+        seen = set()
+        new_names = []
+        renames = {}
+        for i, name in enumerate(names):
+            if name in seen or not name or len(name) > MAX_NAME_LENGTH:
+                new_name = self.next_name(atom_name_type(name))
+                renames[i] = (name, new_name)
+                name = new_name
+            seen.add(name)
+            new_names.append(name)
+        return new_names, renames
+
+
+def canonicalize_atom_names(names, reserved_names=()):
+    """
+    Makes the atom names unique, see Atom_name_canonicalizer.
+
+    :return: (new_names, renames), the list of the unique names and a dictionary atom index -> (old name, new name) of the renamed atoms.
+    """
+    return Atom_name_canonicalizer(reserved_names).canonicalize(names)
+
+
+def find_duplicate_names(names):
+    """
+    Returns the atom names occurring more than once, in the order of their first repetition.
+    """
+    seen = set()
+    duplicates = {}
+    for name in names:
+        if name in seen:
+            duplicates[name] = None
+        seen.add(name)
+    return list(duplicates)
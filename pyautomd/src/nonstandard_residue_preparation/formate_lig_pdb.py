@@ -1,9 +1,8 @@
 import sys
 import os
-if len(sys.argv) > 1:
-    pdbfile=sys.argv[1]
-    resname=sys.argv[2]
-
+from .prepi_model import Prepi
+from ..pdb_atoms import PDB_atoms
+from .atom_name_canonicalizer import canonicalize_atom_names
 
 
 class Atom():
@@ -103,121 +102,67 @@ def format_lig_pdb(pdbfile, resname):
     elif len(resname) >= 4:
         resname = resname[0:3]
 
-    atom_records = []
-    special_list = ['CL', 'Cl', 'BR', 'Br']
-    with open(pdbfile, 'r') as f:
-        for line in f:
-            if line.startswith(('ATOM', 'HETATM')):
-                record_type = line[0:6].strip()
-                serial = int(line[6:11].strip())
-                name = line[12:16].strip()
-                altLoc = line[16].strip()
-                resName = line[17:20].strip()
-                chainID = line[21].strip()
-                resSeq = int(line[22:26].strip())
-                iCode = line[26].strip()
-                x = float(line[30:38].strip())
-                y = float(line[38:46].strip())
-                z = float(line[46:54].strip())
-                occupancy = float(line[54:60].strip())
-                tempFactor = float(line[60:66].strip())
-                element = line[76:78].strip()
-                charge = line[78:80].strip()
-
-                atom_record = {
-                    'record_type': record_type,
-                    'serial': serial,
-                    'name': name,
-                    'altLoc': altLoc,
-                    'resName': resName,
-                    'chainID': chainID,
-                    'resSeq': resSeq,
-                    'iCode': iCode,
-                    'x': x,
-                    'y': y,
-                    'z': z,
-                    'occupancy': occupancy,
-                    'tempFactor': tempFactor,
-                    'element': element,
-                    'charge': charge
-                }
-                atom_records.append(atom_record)
+    atoms = PDB_atoms.read(pdbfile)
 
     # 处理重复的原子名称
-    namelst = []
-    for atom in atom_records:
-        name = atom['name']
-        if name in namelst:
-            if name[0:2] in special_list:
-                atmtype = name[0:2]
-            else:
-                atmtype = name[0]
-            i = 1
-            while f"{atmtype}X{i}" in namelst:
-                i += 1
-            atom['name'] = f"{atmtype}X{i}"
-        namelst.append(atom['name'])
+    _, renames = canonicalize_atom_names(atoms.column('name'))
+    for i, (name, new_name) in renames.items():
+        atoms.set('name', i, new_name)
+    if renames:
+        print(f"Renamed {len(renames)} duplicated atom names:", ' '.join(f"{name}->{new_name}" for name, new_name in renames.values()))
 
     # 写入新的PDB文件
-    with open('ligand-format.pdb', 'w') as fo:
-        for i, atom in enumerate(atom_records, start=1):
-            line = f"ATOM  {i:5d}  {atom['name']:<3s} {resname:3s}{1:6d}    {atom['x']:8.3f}{atom['y']:8.3f}{atom['z']:8.3f}{atom['occupancy']:6.2f}{atom['tempFactor']:6.2f}          {atom['element']:>2s}{atom['charge']:2s}\n"
-            fo.write(line)
+    for i in range(len(atoms)):
+        atoms.set('resname', i, resname)
+        atoms.set('altloc', i, '')
+        atoms.set('chain', i, '')
+        atoms.set('icode', i, '')
+        atoms.hetatm[i] = 0
+        atoms.resseq[i] = 1
+    atoms.write('ligand-format.pdb', renumber=True)
+
+def atom_type(atmname):
+    """
+    Returns the atom type of an atom name, the first letter or Cl/Br, as in the Atom class.
+    """
+    if atmname[0:2] in ['CL', 'Cl', 'BR', 'Br']:
+        return atmname[0:2]
+    return atmname[0]
 
 def pdb_to_xyz(ligfile, xyzfile):
-    f=open(ligfile)
-    LG_lst=[]
-    for line in f:
-        line=line.strip().split()
-        if (line[0] == 'ATOM' or line[0] == 'HETATM') and (len(line) >= 8) :
-            LG_lst+=[Atom(line[2],line[3],line[5],line[6],line[7])]
-    f.close()
-    fo=open(xyzfile,'w')
+    atoms = PDB_atoms.read(ligfile)
     xyz_content_list = []
-    for atom in LG_lst:
-        print(" %-2s %10.5f%10.5f%10.5f" % (atom.atmtype,atom.coord_x,atom.coord_y,atom.coord_z),file=fo)
-        xyz_content_list.append(" %-2s %10.5f%10.5f%10.5f\n" % (atom.atmtype,atom.coord_x,atom.coord_y,atom.coord_z))
-    print("", file=fo)
+    for i, name in enumerate(atoms.column('name')):
+        x, y, z = atoms.xyz(i)
+        xyz_content_list.append(" %-2s %10.5f%10.5f%10.5f\n" % (atom_type(name), x, y, z))
     xyz_content_list.append("\n")
+    with open(xyzfile, 'w') as fo:
+        fo.writelines(xyz_content_list)
     return xyz_content_list
 
 def gen_ligpdb_by_prepi_formated_pdb(formated_pdb, prepi_file, ligpdb):
-    f=open(formated_pdb)
-    LG_dir={}
-    for line in f:
-        if line.startswith('ATOM') or line.startswith('HETATM'):
-            record_name = line[0:6].strip()
-            serial = int(line[6:11].strip())
-            atom_name = line[12:16].strip()
-            alt_loc = line[16].strip()
-            res_name = line[17:20].strip()
-            chain_id = line[21].strip()
-            res_seq = int(line[22:26].strip())
-            icode = line[26].strip()
-            x = float(line[30:38].strip())
-            y = float(line[38:46].strip())
-            z = float(line[46:54].strip())
-            occupancy = float(line[54:60].strip())
-            tempFactor = float(line[60:66].strip())
-            element = line[76:78].strip()
-            charge = line[78:80].strip()
-            LG_dir[atom_name]=Atom(atom_name,res_name,x,y,z)
-    f.close()
-
-    fp=open(prepi_file)
-    chg_lst=[]
-    for line in fp:
-        line=line.strip().split()
-        if len(line) == 11 and line[1] != 'DUMM':
-            chg_lst+=[AtomChg(line[1],line[-1])]
-    fp.close()
-
-    fo=open(ligpdb, 'w')
-    i=0
-    for atmchg in chg_lst:
-        i=i+1
-        LG_dir[atmchg.atmname].set_seq(i)
-        LG_dir[atmchg.atmname].set_chg(atmchg.chg)
-        print(LG_dir[atmchg.atmname], file=fo)
-
-    
\ No newline at end of file
+    """
+    Writes the ligand pdb with the atom order and the charges of the prepi file.
+
+    :param formated_pdb: string, the formatted ligand pdb file, e.g. ligand-format.pdb.
+    :param prepi_file: string or Prepi, the prepi file name or an already parsed Prepi object.
+    :param ligpdb: string, the output ligand pdb file.
+    """
+    atoms = PDB_atoms.read(formated_pdb)
+    index_of = {name: i for i, name in enumerate(atoms.column('name'))}
+
+    prepi = prepi_file if isinstance(prepi_file, Prepi) else Prepi.read(prepi_file)
+    chg_lst = [AtomChg(atmname, chg) for atmname, chg in prepi.atom_charges()]
+
+    lig_atoms = atoms.select([index_of[atmchg.atmname] for atmchg in chg_lst])
+    for i, atmchg in enumerate(chg_lst):
+        lig_atoms.charges[i] = atmchg.chg
+        lig_atoms.resseq[i] = 1
+    lig_atoms.write(ligpdb, renumber=True, with_charges=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        pdbfile = sys.argv[1]
+        resname = sys.argv[2]
+        format_lig_pdb(pdbfile, resname)
@@ -0,0 +1,150 @@
+import os
+import re
+import mmap
+import array
+import struct
+
+BOHR = 0.52917721067 # Angstrom
+ESP_BLOCK = b"Electrostatic Properties Using The SCF Density"
+ESP_VALUES = b"Electrostatic Properties (Atomic Units)"
+ORIENTATIONS = (b"Standard orientation:", b"Input orientation:")
+CENTER_PATTERN = re.compile(rb"(Atomic Center|ESP Fit Center)\s*(\d+) is at\s*(-?\d+\.\d+)\s*(-?\d+\.\d+)\s*(-?\d+\.\d+)")
+FIT_PATTERN = re.compile(rb"^\s*\d+\s+Fit\s+(-?\d+\.\d+)", re.MULTILINE)
+ESPBIN_MAGIC = b"ESPB"
+ESPBIN_HEADER = struct.Struct("<4sIII") # magic, version, number of atoms, number of ESP points
+ESPBIN_VERSION = 1
+
+
+class Gaussian_esp_data():
+    """
+    The molecular electrostatic potential of a Gaussian Pop=MK calculation: the atoms and the ESP fit points (Angstrom) and the potentials (atomic units).
+    The data are kept in flat arrays, x/y/z interleaved.
+    """
+    def __init__(self, atomic_numbers, atom_coords, point_coords, potentials):
+        self.atomic_numbers = array.array('i', atomic_numbers)
+        self.atom_coords = array.array('d', atom_coords)
+        self.point_coords = array.array('d', point_coords)
+        self.potentials = array.array('d', potentials)
+
+    @property
+    def n_atoms(self):
+        return len(self.atomic_numbers)
+
+    @property
+    def n_points(self):
+        return len(self.potentials)
+
+    def write_esp(self, esp_file):
+        """
+        Writes the ESP file read by the resp program (coordinates in bohr): the numbers of atoms and points (2I5),
+        the atoms (17X,3E16.7), then the potential and the coordinates of each point (1X,4E16.7).
+        """
+        lines = [f"{self.n_atoms:5d}{self.n_points:5d}\n"]
+        coords = self.atom_coords
+        for i in range(0, len(coords), 3):
+            lines.append(f"{'':17s}{coords[i] / BOHR:16.7E}{coords[i + 1] / BOHR:16.7E}{coords[i + 2] / BOHR:16.7E}\n")
+        coords = self.point_coords
+        for k, potential in enumerate(self.potentials):
+            i = 3 * k
+            lines.append(f" {potential:16.7E}{coords[i] / BOHR:16.7E}{coords[i + 1] / BOHR:16.7E}{coords[i + 2] / BOHR:16.7E}\n")
+        with open(esp_file, 'w') as f:
+            f.writelines(lines)
+
+    def write_binary(self, espbin_file):
+        """
+        Writes the compact binary form of the data: a header, then the atomic numbers (int32), the atom coordinates,
+        the point coordinates and the potentials (float64).
+        """
+        with open(espbin_file, 'wb') as f:
+            f.write(ESPBIN_HEADER.pack(ESPBIN_MAGIC, ESPBIN_VERSION, self.n_atoms, self.n_points))
+            for values in (self.atomic_numbers, self.atom_coords, self.point_coords, self.potentials):
+                values.tofile(f)
+
+    @classmethod
+    def read_binary(cls, espbin_file):
+        """
+        Reads the compact binary form written by write_binary.
+        """
+        with open(espbin_file, 'rb') as f:
+            magic, version, n_atoms, n_points = ESPBIN_HEADER.unpack(f.read(ESPBIN_HEADER.size))
+            if magic != ESPBIN_MAGIC or version != ESPBIN_VERSION:
+                raise ValueError(f"{espbin_file} is not a pyautomd ESP binary file.")
+            data = []
+            for typecode, count in (('i', n_atoms), ('d', 3 * n_atoms), ('d', 3 * n_points), ('d', n_points)):
+                values = array.array(typecode)
+                values.fromfile(f, count)
+                data.append(values)
+        return cls(*data)
+
+
+def read_orientation_atomic_numbers(mm, end):
+    """
+    Returns the atomic numbers of the last orientation table before the offset end.
+    """
+    start = max(mm.rfind(orientation, 0, end) for orientation in ORIENTATIONS)
+    if start < 0:
+        return []
+    atomic_numbers = []
+    # Title, dashes, two header lines, dashes, then the atoms until the next dashes
+    pos = start
+    for _ in range(5):
+        pos = mm.find(b"\n", pos) + 1
+    while True:
+        line_end = mm.find(b"\n", pos)
+        fields = mm[pos:line_end].split()
+        if not fields or fields[0].startswith(b"---"):
+            break
+        atomic_numbers.append(int(fields[1]))
+        pos = line_end + 1
+    return atomic_numbers
+
+
+def read_gaussian_esp(log_file):
+    """
+    Extracts the ESP of the last 'Electrostatic Properties Using The SCF Density' block of a Gaussian log.
+    The log is memory-mapped and only the ESP block and the orientation table before it are scanned.
+
+    :param log_file: string, the Gaussian log file of a Pop=(MK) iop(6/33=2) calculation.
+    :return: Gaussian_esp_data object.
+    """
+    with open(log_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        block_start = mm.rfind(ESP_BLOCK)
+        if block_start < 0:
+            raise ValueError(f"No ESP found in {log_file}. Please check if the Gaussian calculation used Pop=MK and iop(6/33=2).")
+        values_start = mm.find(ESP_VALUES, block_start)
+        if values_start < 0:
+            raise ValueError(f"The ESP values are missing in {log_file}. Please check if the Gaussian calculation terminated normally.")
+        atom_coords = array.array('d')
+        point_coords = array.array('d')
+        for match in CENTER_PATTERN.finditer(mm, block_start, values_start):
+            coords = atom_coords if match.group(1) == b"Atomic Center" else point_coords
+            coords.extend((float(match.group(3)), float(match.group(4)), float(match.group(5))))
+        # The values table is framed by three dashed lines: above the header, below the header and at the end
+        values_end = mm.find(b"\n ---", mm.find(b"\n ---", mm.find(b"\n ---", values_start) + 1) + 1)
+        if values_end < 0:
+            values_end = len(mm)
+        potentials = array.array('d', (float(match.group(1)) for match in FIT_PATTERN.finditer(mm, values_start, values_end)))
+        atomic_numbers = read_orientation_atomic_numbers(mm, block_start)
+    n_atoms = len(atom_coords) // 3
+    if len(potentials) != len(point_coords) // 3:
+        raise ValueError(f"{log_file}: {len(point_coords) // 3} ESP fit centers but {len(potentials)} potentials.")
+    if len(atomic_numbers) != n_atoms:
+        raise ValueError(f"{log_file}: {n_atoms} atomic centers but {len(atomic_numbers)} atoms in the orientation table.")
+    return Gaussian_esp_data(atomic_numbers, atom_coords, point_coords, potentials)
+
+
+def extract_esp(log_file, espbin_file=None):
+    """
+    Returns the ESP of a Gaussian log. The log is parsed once, later calls read the compact binary file written next to it.
+
+    :param log_file: string, the Gaussian log file.
+    :param espbin_file: (Optional) string, the binary file. Default: <log_file without extension>.espbin
+    :return: Gaussian_esp_data object.
+    """
+    if espbin_file is None:
+        espbin_file = f"{os.path.splitext(log_file)[0]}.espbin"
+    if os.path.exists(espbin_file) and os.path.getmtime(espbin_file) >= os.path.getmtime(log_file):
+        return Gaussian_esp_data.read_binary(espbin_file)
+    esp_data = read_gaussian_esp(log_file)
+    esp_data.write_binary(espbin_file)
+    return esp_data
@@ -0,0 +1,137 @@
+import os
+import time
+
+# Messages after which the Gaussian job can not succeed any more
+FATAL_MESSAGES = {
+    "Error termination": "error termination",
+    "Convergence failure -- run terminated.": "SCF convergence failure",
+    ">>>>>>>>>> Convergence criterion not met.": "SCF convergence failure",
+    "Optimization stopped.": "optimization not converged",
+    "Number of steps exceeded": "optimization not converged",
+}
+
+
+class Gaussian_log_monitor():
+    """
+    Follows the log of a running Gaussian job by reading only the bytes appended since the last poll.
+    Reports the SCF and optimization progress, and detects error terminations, SCF non-convergence and stalled jobs early,
+    so that the job can be killed instead of running to its end.
+    """
+    def __init__(self, log_file, stall_timeout=None, stall_steps=50, energy_tolerance=1e-5):
+        """
+        Initializes the Gaussian_log_monitor class.
+
+        :param log_file: string, the Gaussian log file.
+        :param stall_timeout: (Optional) float, the job is considered stalled if the log does not grow for this many seconds. None to disable.
+        :param stall_steps: (Optional) int, the optimization is considered stalled if the energy did not improve over this many steps.
+        :param energy_tolerance: (Optional) float, the smallest energy improvement in Hartree counted as progress.
+        """
+        self.log_file = log_file
+        self.stall_timeout = stall_timeout
+        self.stall_steps = stall_steps
+        self.energy_tolerance = energy_tolerance
+        self.offset = 0
+        self.partial_line = ''
+        self.last_growth = time.monotonic()
+        self.scf_energy = None
+        self.best_energy = None
+        self.best_step = 0
+        self.opt_step = 0
+        self.max_opt_steps = None
+        self.n_normal_terminations = 0
+        self.failure = None
+
+    def read_new_lines(self):
+        """
+        Returns the complete lines appended to the log since the last call.
+        """
+        try:
+            size = os.path.getsize(self.log_file)
+        except OSError:
+            return []
+        if size < self.offset:
+            # The log was replaced, start again from its beginning
+            self.offset = 0
+            self.partial_line = ''
+        if size == self.offset:
+            return []
+        with open(self.log_file, 'r', errors='replace') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset = size
+        self.last_growth = time.monotonic()
+        lines = (self.partial_line + data).split('\n')
+        self.partial_line = lines.pop()
+        return lines
+
+    def parse_line(self, line):
+        """
+        Updates the progress from one line of the log.
+        """
+        if line.startswith(' SCF Done:'):
+            # SCF Done:  E(RHF) =  -1234.56789012     A.U. after   12 cycles
+            fields = line.split('=')[1].split()
+            self.scf_energy = float(fields[0])
+            if self.opt_step == 0:
+                print(f"Gaussian {os.path.basename(self.log_file)}: SCF energy {self.scf_energy:.6f} Hartree")
+        elif line.startswith(' Step number'):
+            # Step number   3 out of a maximum of  100
+            fields = line.split()
+            self.opt_step = int(fields[2])
+            self.max_opt_steps = int(fields[-1])
+            if self.scf_energy is not None:
+                if self.best_energy is None or self.scf_energy < self.best_energy - self.energy_tolerance:
+                    self.best_energy = self.scf_energy
+                    self.best_step = self.opt_step
+            energy = f", energy {self.scf_energy:.6f} Hartree" if self.scf_energy is not None else ''
+            print(f"Gaussian {os.path.basename(self.log_file)}: optimization step {self.opt_step}/{self.max_opt_steps}{energy}")
+        elif line.startswith(' Normal termination'):
+            self.n_normal_terminations += 1
+            self.opt_step = 0
+            self.best_energy = None
+            self.best_step = 0
+        else:
+            stripped = line.strip()
+            for message, reason in FATAL_MESSAGES.items():
+                if stripped.startswith(message):
+                    self.failure = reason
+                    break
+
+    def poll(self):
+        """
+        Reads the new part of the log. Meant to be called periodically while the job runs, e.g. as the watchdog of the external program runner.
+
+        :return: string, the reason to kill the job, or None if the job should go on.
+        """
+        for line in self.read_new_lines():
+            self.parse_line(line)
+            if self.failure is not None:
+                return self.failure
+        if self.opt_step - self.best_step >= self.stall_steps and self.best_energy is not None:
+            self.failure = f"optimization stalled, no energy improvement in {self.opt_step - self.best_step} steps"
+        elif self.stall_timeout is not None and time.monotonic() - self.last_growth > self.stall_timeout:
+            self.failure = f"no output for {self.stall_timeout} s"
+        return self.failure
+
+
+def last_line(file_path, block_size=4096):
+    """
+    Returns the last non-empty line of a file by reading only its end.
+
+    :param file_path: string, the file name.
+    :param block_size: (Optional) int, the number of bytes read from the end of the file at a time.
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        data = b''
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+            lines = [line for line in data.split(b'\n') if line.strip()]
+            # The first line of the block may be incomplete unless the beginning of the file is reached
+            if len(lines) > 1 or (lines and end == 0):
+                return lines[-1].decode(errors='replace')
+    return ''
@@ -1,8 +1,13 @@
-import subprocess
 import os
+import glob
+import hashlib
 # from formate_lig_pdb import pdb_to_xyz # for directly excute this script
 from .formate_lig_pdb import pdb_to_xyz # for import this script
 from ..executable_checker import Executable_checker
+from ..external_program_runner import get_runner
+from ..pdb_atoms import PDB_atoms
+from .atom_name_canonicalizer import canonicalize_atom_names, find_duplicate_names
+from .gaussian_log_monitor import Gaussian_log_monitor, last_line
 
 
 class Format_pdb_gen_gaussian:
@@ -26,7 +31,9 @@ class Format_pdb_gen_gaussian:
             raise SystemExit
         self.gaussian_pdb = self.process_pdb_for_gaussian()
         self.gaussian_input_name = f"{os.path.splitext(self.pdb_file)[0]}.com"
-        self.chk_file = os.path.join(self.gaussian_scr_path, f'{os.getpid()}.chk')
+        # One checkpoint file per working directory, so that jobs of several ligands can run side by side
+        workdir_hash = hashlib.sha1(os.getcwd().encode()).hexdigest()[:12]
+        self.chk_file = os.path.join(self.gaussian_scr_path, f'{self.resn}_{workdir_hash}.chk')
         self.gaussian_excute = gaussian_excute
         if not ifcheck_gaussian_excute:
             self.use_programs = ["tleap"]
@@ -83,7 +90,9 @@ quit"""
         with open(f'{self.pdb_file}.leap', 'w') as file:
             file.write(leap_input)
         
-        subprocess.run(["tleap", "-f", f"{self.pdb_file}.leap"], stdout=subprocess.PIPE)
+        record = get_runner().run(["tleap", "-f", f"{self.pdb_file}.leap"])
+        if not record.success:
+            print(f"An error occurred while running tleap: {record}")
 
         os.remove(f"{self.pdb_file}.tmp")
         os.remove(f"{self.pdb_file}.leap")
@@ -170,30 +179,27 @@ quit"""
         """
         gaussian_pdb = f'{os.path.splitext(self.pdb_file)[0]}_gaussian.pdb'
 
-        # Extract ATOM and HETATM lines and convert HETATM to ATOM
-        with open(self.pdb_file, 'r') as infile, open(gaussian_pdb, 'w') as outfile:
-            for line in infile:
-                if line.startswith(('ATOM', 'HETATM')):
-                    outfile.write(line.replace('HETATM', 'ATOM  '))
+        # Read the ATOM and HETATM records once and write them as ATOM
+        atoms = PDB_atoms.read(self.pdb_file)
+        for i in range(len(atoms)):
+            atoms.hetatm[i] = 0
+        atoms.write(gaussian_pdb)
 
         # Check for NME/ACE caps
-        with open(gaussian_pdb, 'r') as file:
-            cap_count = sum(1 for line in file if 'NME' in line or 'ACE' in line)
+        resnames = atoms.column('resname')
+        cap_count = sum(1 for resname in resnames if resname in ('NME', 'ACE'))
 
         if cap_count > 0:
             print("* Found NME/ACE Cap!")
 
         # Check for duplicate atom names excluding NME and ACE
-        atom_names = []
-        with open(gaussian_pdb, 'r') as file:
-            for line in file:
-                if 'NME' not in line and 'ACE' not in line:
-                    atom_names.append(line[12:16].strip())
-
-        duplicates = set([name for name in atom_names if atom_names.count(name) > 1])
+        residue_names = [name for name, resname in zip(atoms.column('name'), resnames) if resname not in ('NME', 'ACE')]
+        duplicates = find_duplicate_names(residue_names)
         if duplicates:
             print(f"*Error: There are {len(duplicates)} duplicated atom names in \"{self.pdb_file}\"")
             print("*They are:", ' '.join(duplicates))
+            _, renames = canonicalize_atom_names(residue_names)
+            print("*Unique names would be:", ' '.join(f"{name}->{new_name}" for name, new_name in renames.values()))
             raise SystemExit
         return gaussian_pdb  # Successful processing
 
@@ -204,13 +210,18 @@ quit"""
         xyz_content_list = pdb_to_xyz(pdb_file, f'{os.path.splitext(pdb_file)[0]}.xyz')
         return xyz_content_list
 
-    def create_gaussian_com(self, ifopt=False):
+    def create_gaussian_com(self, ifopt=False, nproc=None, mem_mb=None):
         """
         Create Gaussian .com file based on the shell script details.
+
+        :param ifopt: bool, whether to optimize the structure in the PM3MM link.
+        :param nproc: (Optional) int, %nproc of the job. Default: all cores of the node.
+        :param mem_mb: (Optional) int, %mem of the job in MB. Default: 2Gb.
         """
         outname = self.gaussian_input_name
         charge = self.lig_net_charge
-        nproc = self.nproc
+        nproc = nproc or self.nproc
+        mem = f'{mem_mb}MB' if mem_mb else '2Gb'
         if ifopt == True:
             opt_str = 'opt'
         else:
@@ -218,7 +229,7 @@ quit"""
         chk_file = self.chk_file
         com_content = [
             f'%nproc={nproc}\n',
-            '%mem=2Gb\n',
+            f'%mem={mem}\n',
             f'%chk={chk_file}\n',
             f'# PM3MM {opt_str}\n\n',
             'test\n\n',
@@ -232,7 +243,7 @@ quit"""
         com_content.extend([
             '--link1--\n',
             f'%nproc={nproc}\n',
-            '%mem=2Gb\n',
+            f'%mem={mem}\n',
             f'%chk={chk_file}\n',
             '# HF/gen SCF=tight Pop=(MK,ReadRadii) iop(6/33=2,6/41=10,6/42=17,6/50=1) Geom=AllCheck\n\n',
         ])
@@ -245,22 +256,135 @@ class Gaussian_run():
     '''
     Class to run Gaussian calculations and handle the output.
     '''
-    def __init__(self, input_file, gaussian_excute, chk_file):
+    def __init__(self, input_file, gaussian_excute, chk_file, nproc=1, workdir=None, restart=False):
         self.gaussian_excute = gaussian_excute
         self.input_file = input_file
-        self.output_file = f'{os.path.splitext(self.input_file)[0]}.log'
+        self.workdir = workdir # working directory of the job, None for the current directory
+        self.output_file = os.path.join(workdir or '', f'{os.path.splitext(self.input_file)[0]}.log')
         self.chk_file = chk_file
+        self.nproc = nproc # CPUs taken from the shared runner budget, should match %nproc of the input file
+        self.restart = restart # resume a failed or interrupted run from its checkpoint file
 
     def run_gaussian(self):
         # Run Gaussian and generate output file
-        subprocess.run([self.gaussian_excute, self.input_file], stdout=subprocess.PIPE)
+        input_file = self.prepare_restart() if self.restart else self.input_file
+        if input_file is None:
+            print(f'Gaussian calculation already completed in {self.output_file}, skipped.')
+            self.remove_chk_file()
+            return
+        runner = get_runner()
+        run_output = os.path.join(self.workdir or '', f'{os.path.splitext(input_file)[0]}.log')
+        if not self.restart and os.path.exists(run_output):
+            # The monitor would read the log of an earlier run before Gaussian truncates it, and kill the new job on its errors
+            os.remove(run_output)
+            print(f'The Gaussian output {run_output} of a previous run is removed before the new run.')
+        monitor = Gaussian_log_monitor(run_output, stall_timeout=runner.timeouts.get('gaussian_stall'))
+        record = runner.run([self.gaussian_excute, input_file], name='gaussian', cpus=self.nproc, cwd=self.workdir, watchdog=monitor.poll)
+        print(f"Gaussian run: {record}")
+        if run_output != self.output_file and os.path.exists(run_output):
+            os.replace(run_output, self.output_file)
+        if record.timed_out or record.killed_reason is not None:
+            print(f'Gaussian calculation failed! The checkpoint file {self.chk_file} is kept, rerun with ifgaussian_restart = True to resume.')
+            raise SystemExit
         if self.check_normal_termination():
             print('Gaussian calculation completed successfully!')
         else:
-            print('Gaussian calculation failed!')
+            print(f'Gaussian calculation failed! The checkpoint file {self.chk_file} is kept, rerun with ifgaussian_restart = True to resume.')
             raise SystemExit
         self.remove_chk_file()
 
+    def read_links(self):
+        """
+        Reads the links of the input file.
+
+        :return: list of links, each link is the list of its lines without the --link1-- line.
+        """
+        links = [[]]
+        with open(os.path.join(self.workdir or '', self.input_file), 'r') as f:
+            for line in f:
+                if line.strip().lower() == '--link1--':
+                    links.append([])
+                else:
+                    links[-1].append(line)
+        return links
+
+    @staticmethod
+    def link_method(route_line):
+        """
+        Returns the method of a route line, e.g. 'PM3MM' for '# PM3MM opt'.
+        """
+        fields = route_line.strip().lstrip('#').split()
+        return fields[0].upper() if fields else None
+
+    def completed_methods(self):
+        """
+        Returns the methods of the links that terminated normally in the output file and in its archived parts.
+        """
+        completed = set()
+        log_files = sorted(glob.glob(f'{self.output_file}.part*')) + [self.output_file]
+        for log_file in log_files:
+            if not os.path.exists(log_file):
+                continue
+            method = None
+            with open(log_file, 'r', errors='replace') as f:
+                for line in f:
+                    if line.startswith(' #'):
+                        method = self.link_method(line)
+                    elif line.startswith(' Normal termination') and method is not None:
+                        completed.add(method)
+        return completed
+
+    def archive_output(self):
+        """
+        Renames the output file of the previous run to <output>.partN, so that the restarted run writes a new output file.
+        """
+        if not os.path.exists(self.output_file):
+            return
+        n = 1
+        while os.path.exists(f'{self.output_file}.part{n}'):
+            n += 1
+        os.replace(self.output_file, f'{self.output_file}.part{n}')
+        print(f'The previous Gaussian output is archived as {self.output_file}.part{n}')
+
+    def prepare_restart(self):
+        """
+        Prepares the restart of a failed or interrupted run from its checkpoint file.
+        The links which terminated normally are skipped, e.g. the PM3MM link when its (optimized) geometry is already in the checkpoint file.
+        An interrupted optimization restarts from the last geometry of the checkpoint file.
+
+        :return: the input file to run, or None if all links have already terminated normally.
+        """
+        if not os.path.exists(self.output_file) and not glob.glob(f'{self.output_file}.part*'):
+            return self.input_file
+        links = self.read_links()
+        completed = self.completed_methods()
+        route_index = [next(i for i, line in enumerate(link) if line.startswith('#')) for link in links]
+        remaining = [i for i in range(len(links)) if self.link_method(links[i][route_index[i]]) not in completed]
+        if not remaining:
+            return None
+        self.archive_output()
+        if not os.path.exists(self.chk_file):
+            print(f'Checkpoint file {self.chk_file} not found, the Gaussian calculation restarts from scratch.')
+            return self.input_file
+        restart_links = []
+        for i in remaining:
+            link = list(links[i])
+            route = link[route_index[i]].rstrip()
+            if i == remaining[0]:
+                if i == 0:
+                    if 'opt' not in route.lower().split():
+                        return self.input_file
+                    # Continue the optimization from the last geometry of the checkpoint file, without the title and the molecule sections
+                    link = link[:route_index[i]] + [f'{route} Geom=AllCheck Guess=Read\n', '\n']
+                else:
+                    link[route_index[i]] = f'{route} Guess=Read\n'
+            restart_links.append(''.join(link))
+        restart_input = f'{os.path.splitext(self.input_file)[0]}_restart.com'
+        with open(os.path.join(self.workdir or '', restart_input), 'w') as f:
+            f.write('--link1--\n'.join(restart_links))
+        print(f'Restarting the Gaussian calculation from {self.chk_file} with {restart_input}')
+        return restart_input
+
     def remove_chk_file(self):
         """
         Remove the checkpoint file.
@@ -272,17 +396,14 @@ class Gaussian_run():
 
     def check_normal_termination(self):
         """
-        Checks if the last line of a file starts with 'Normal termination'.
+        Checks if the last line of the output file starts with 'Normal termination'.
+        Only the end of the file is read, the output of large jobs can be hundreds of MB.
 
-        :param file_path: Path to the file to be checked.
         :return: True if the last line starts with 'Normal termination', False otherwise.
         """
         file_path = self.output_file
         try:
-            with open(file_path, 'r') as file:
-                for last_line in file:
-                    pass
-                return last_line.startswith(" Normal termination")
+            return last_line(file_path).startswith(" Normal termination")
         except FileNotFoundError:
             print(f"Error: File not found - {file_path}")
             return False
@@ -303,5 +424,5 @@ if __name__ == '__main__':
     gaussian_excute = 'g03'
     input_file = gen_gaussian.gaussian_input_name
     chk_file = gen_gaussian.chk_file
-    run_gaussian = Gaussian_run(input_file, gaussian_excute, chk_file)
+    run_gaussian = Gaussian_run(input_file, gaussian_excute, chk_file, gen_gaussian.nproc)
     run_gaussian.run_gaussian()
\ No newline at end of file
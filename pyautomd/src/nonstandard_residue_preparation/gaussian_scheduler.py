@@ -0,0 +1,231 @@
+import os
+import math
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .gaussian_relate_module import Gaussian_run
+from ..external_program_runner import get_runner
+
+# Number of cartesian basis functions per element of the HF/gen basis set written by create_gaussian_com
+# (6-31G* for the light elements, the self-defined all electron basis set for iodine).
+BASIS_FUNCTIONS = {
+    'H': 2, 'He': 5,
+    'B': 15, 'C': 15, 'N': 15, 'O': 15, 'F': 15,
+    'Si': 19, 'P': 19, 'S': 19, 'Cl': 19,
+    'Br': 36, 'I': 67,
+}
+DEFAULT_BASIS_FUNCTIONS = 19
+# Basis functions handled efficiently by one core, used to size %nproc
+BASIS_FUNCTIONS_PER_CPU = 60
+# Granularity of %mem in MB
+MEMORY_STEP_MB = 128
+
+
+def total_memory_mb():
+    """
+    Returns the physical memory of the node in MB, or 4096 if it can not be determined.
+    """
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 4096
+
+
+class Gaussian_job():
+    """
+    One queued Gaussian job: the .com file, its working directory and the size of the molecule.
+    """
+    def __init__(self, input_file, gaussian_excute, chk_file, workdir='.', restart=False):
+        """
+        Initializes the Gaussian_job class and reads the molecule of the .com file.
+
+        :param input_file: string, the Gaussian input file name, relative to the working directory.
+        :param gaussian_excute: string, the excute file of the gaussian.
+        :param chk_file: string, the checkpoint file of the job.
+        :param workdir: (Optional) string, the working directory of the job.
+        :param restart: (Optional) bool, whether to resume a failed or interrupted run from its checkpoint file.
+        """
+        self.input_file = input_file
+        self.restart = restart
+        self.gaussian_excute = gaussian_excute
+        self.chk_file = chk_file
+        self.workdir = os.path.abspath(workdir)
+        self.elements, self.ifopt = self.read_molecule()
+        self.n_atoms = len(self.elements)
+        self.n_basis = sum(BASIS_FUNCTIONS.get(element, DEFAULT_BASIS_FUNCTIONS) for element in self.elements)
+        self.nproc = None
+        self.mem_mb = None
+        self.success = None
+
+    def read_molecule(self):
+        """
+        Reads the elements of the molecule and whether the first link is an optimization from the .com file.
+        """
+        elements = []
+        ifopt = False
+        with open(os.path.join(self.workdir, self.input_file), 'r') as f:
+            lines = f.readlines()
+        for i, line in enumerate(lines):
+            if line.startswith('#'):
+                ifopt = 'opt' in line.lower().split()
+                # Skip the route and the title sections, then the charge/multiplicity line, the atoms follow until a blank line
+                j = i + 1
+                blank_lines = 0
+                while j < len(lines) and blank_lines < 2:
+                    if not lines[j].strip():
+                        blank_lines += 1
+                    j += 1
+                j += 1
+                while j < len(lines) and lines[j].strip():
+                    element = lines[j].split()[0].split('-')[0]
+                    elements.append(element[0:1].upper() + element[1:2].lower())
+                    j += 1
+                break
+        return elements, ifopt
+
+    @property
+    def cost(self):
+        """
+        A relative estimate of the run time, HF scales about cubically with the number of basis functions.
+        """
+        return self.n_basis ** 3 * (5 if self.ifopt else 1)
+
+    def ideal_nproc(self):
+        """
+        The number of cores the job can use efficiently.
+        """
+        return max(1, math.ceil(self.n_basis / BASIS_FUNCTIONS_PER_CPU))
+
+    def memory_mb(self, nproc):
+        """
+        Estimates %mem in MB: a fixed base, a per-core overhead and the HF matrices (about 10 + 2*nproc n_basis x n_basis arrays of doubles).
+        """
+        mem_mb = 256 + 64 * nproc + 8 * self.n_basis ** 2 * (10 + 2 * nproc) / (1024 * 1024)
+        return int(math.ceil(mem_mb / MEMORY_STEP_MB) * MEMORY_STEP_MB)
+
+    def write_resources(self, nproc, mem_mb):
+        """
+        Rewrites the %nproc and %mem lines of every link of the .com file.
+        """
+        input_path = os.path.join(self.workdir, self.input_file)
+        with open(input_path, 'r') as f:
+            lines = f.readlines()
+        for i, line in enumerate(lines):
+            if line.lower().startswith('%nproc'):
+                lines[i] = f'%nproc={nproc}\n'
+            elif line.lower().startswith('%mem'):
+                lines[i] = f'%mem={mem_mb}MB\n'
+        with open(input_path, 'w') as f:
+            f.writelines(lines)
+        self.nproc = nproc
+        self.mem_mb = mem_mb
+
+    def run(self):
+        """
+        Runs the job through Gaussian_run. Returns True if Gaussian terminated normally.
+        """
+        try:
+            Gaussian_run(self.input_file, self.gaussian_excute, self.chk_file, self.nproc, self.workdir, self.restart).run_gaussian()
+            self.success = True
+        except SystemExit:
+            self.success = False
+        return self.success
+
+    def __str__(self):
+        return f"{os.path.join(self.workdir, self.input_file)} ({self.n_atoms} atoms, {self.n_basis} basis functions)"
+
+
+class Gaussian_job_scheduler():
+    """
+    Queues Gaussian jobs of many ligands/residues, sizes %nproc and %mem of each job from its number of basis functions,
+    and packs the jobs onto the available cores and memory, largest job first, so that the total QM wall time is minimized.
+    """
+    def __init__(self, total_cpus=None, total_mem_mb=None, restart=False):
+        """
+        Initializes the Gaussian_job_scheduler class.
+
+        :param total_cpus: (Optional) int, the cores shared by the Gaussian jobs. Default: the CPU budget of the external program runner.
+        :param total_mem_mb: (Optional) int, the memory in MB shared by the Gaussian jobs. Default: 80% of the physical memory.
+        :param restart: (Optional) bool, whether to resume failed or interrupted runs from their checkpoint files.
+        """
+        self.restart = restart
+        self.total_cpus = int(total_cpus) if total_cpus else get_runner().max_cpus
+        self.total_mem_mb = int(total_mem_mb) if total_mem_mb else int(total_memory_mb() * 0.8)
+        self.jobs = []
+
+    def add_job(self, input_file, gaussian_excute, chk_file, workdir='.'):
+        """
+        Queues a Gaussian job.
+
+        :param input_file: string, the Gaussian input file name, relative to the working directory.
+        :param gaussian_excute: string, the excute file of the gaussian.
+        :param chk_file: string, the checkpoint file of the job.
+        :param workdir: (Optional) string, the working directory of the job.
+        :return: Gaussian_job object.
+        """
+        job = Gaussian_job(input_file, gaussian_excute, chk_file, workdir, self.restart)
+        self.jobs.append(job)
+        return job
+
+    def size_job(self, job, share, free_mem_mb):
+        """
+        Chooses %nproc and %mem of a job for the free resources.
+
+        :param share: int, the cores offered to the job. While many jobs are waiting the free cores are shared out between them,
+                      since small core counts run more efficiently.
+        :param free_mem_mb: int, the free memory in MB.
+        :return: (nproc, mem_mb), or None if the job does not fit into the free memory.
+        """
+        nproc = min(job.ideal_nproc(), share)
+        while nproc >= 1:
+            mem_mb = job.memory_mb(nproc)
+            if mem_mb <= free_mem_mb:
+                return nproc, mem_mb
+            nproc -= 1
+        return None
+
+    def run(self):
+        """
+        Runs all queued jobs.
+
+        :return: True if all jobs terminated normally.
+        """
+        pending = sorted([job for job in self.jobs if job.success is None], key=lambda job: job.cost, reverse=True)
+        if not pending:
+            return True
+        print(f"Scheduling {len(pending)} Gaussian jobs on {self.total_cpus} cores and {self.total_mem_mb} MB memory.")
+        free_cpus = self.total_cpus
+        free_mem_mb = self.total_mem_mb
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.total_cpus) as executor:
+            while pending or running:
+                # Share the free cores out between the waiting jobs, the largest jobs get the remainder
+                n_slots = min(len(pending), free_cpus)
+                shares = [free_cpus // n_slots + (1 if k < free_cpus % n_slots else 0) for k in range(n_slots)] if n_slots else []
+                for job in list(pending):
+                    if not shares:
+                        break
+                    size = self.size_job(job, shares[0], free_mem_mb)
+                    if size is None and not running:
+                        # The job does not fit even into the empty node, run it alone with what there is
+                        size = (shares[0], min(job.memory_mb(shares[0]), self.total_mem_mb))
+                        print(f"Warning: {job} needs more memory than available, it runs with %mem={size[1]}MB.")
+                    if size is None:
+                        continue
+                    nproc, mem_mb = size
+                    shares.pop(0)
+                    job.write_resources(nproc, mem_mb)
+                    free_cpus -= nproc
+                    free_mem_mb -= mem_mb
+                    pending.remove(job)
+                    print(f"Starting Gaussian job {job} with %nproc={nproc} %mem={mem_mb}MB")
+                    running[executor.submit(job.run)] = job
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    future.result()
+                    free_cpus += job.nproc
+                    free_mem_mb += job.mem_mb
+        failed = [job for job in self.jobs if not job.success]
+        for job in failed:
+            print(f"Gaussian job failed: {job}")
+        print(f"Gaussian jobs finished: {len(self.jobs) - len(failed)}/{len(self.jobs)} terminated normally.")
+        return not failed
@@ -0,0 +1,146 @@
+# PDB v2 hydrogen names converted to the amber convention, e.g. 2HB -> HB2
+HYDROGEN_NAME_MAP = {
+    "2HB": "HB2", "3HB": "HB3", "1H1": "H11", "2H1": "H12", "3H1": "H13",
+    "1H2": "H21", "2H2": "H22", "3H2": "H23", "1H5": "H51", "2H5": "H52",
+    "3H5": "H53", "1H1'": "H1'1", "2H1'": "H1'2", "3H1'": "H1'3", "1H2'": "H2'1",
+    "2H2'": "H2'2", "3H2'": "H2'3", "1H5'": "H5'1", "2H5'": "H5'2", "3H5'": "H5'3",
+}
+# Atoms of the neighboring residues referenced in the IMPROPER section
+NEIGHBOR_ATOMS = ("-M", "+M")
+
+
+class PrepiAtom():
+    """
+    An atom line of the prepi file. The original line is kept so that unchanged atoms are written back verbatim.
+    """
+    def __init__(self, line):
+        fields = line.split()
+        self.line = line.rstrip("\n")
+        self.seq = int(fields[0])
+        self.name = fields[1]
+        self.atmtype = fields[2]
+        self.tree = fields[3]
+        self.charge = float(fields[10])
+
+    def is_dummy(self):
+        return self.atmtype == "DU"
+
+    def __str__(self):
+        return f"{self.line[:6]}{self.name:<4}{self.line[10:]}"
+
+
+class PrepiSection():
+    """
+    A LOOP, IMPROPER or CHARGE section of the prepi file. Each entry is the list of fields of one line.
+    """
+    def __init__(self, keyword_line):
+        self.keyword_line = keyword_line
+        self.keyword = keyword_line.split()[0]
+        self.entries = []
+
+    def __str__(self):
+        if self.keyword == "CHARGE":
+            lines = [' '.join(entry) for entry in self.entries]
+        else:
+            lines = [''.join(f'{name:>5}' for name in entry) for entry in self.entries]
+        return self.keyword_line + ''.join(f"{line}\n" for line in lines)
+
+
+class Prepi():
+    """
+    The prepi file of a single residue: the header lines, the atoms, and the LOOP/IMPROPER/CHARGE sections.
+    The lines between the sections (blank lines, DONE, STOP) are kept as they are.
+    """
+    def __init__(self, lines):
+        """
+        Parses the lines of a prepi file in a single pass.
+
+        :param lines: list of strings, the lines of the prepi file.
+        """
+        self.header = []
+        self.atoms = []
+        self.items = [] # PrepiSection objects and raw lines following the atoms, in file order
+        section = None
+        for line in lines:
+            fields = line.split()
+            if not self.items and len(line) > 60 and len(fields) == 11 and fields[0].isdigit():
+                self.atoms.append(PrepiAtom(line))
+            elif not self.atoms:
+                self.header.append(line)
+            elif section is not None and fields:
+                section.entries.append(fields)
+            elif fields and fields[0] in ("LOOP", "IMPROPER", "CHARGE"):
+                section = PrepiSection(line)
+                self.items.append(section)
+            else:
+                section = None
+                self.items.append(line)
+
+    @classmethod
+    def read(cls, prepi_file):
+        """
+        Reads a prepi file.
+
+        :param prepi_file: The prepi file name.
+        """
+        with open(prepi_file, "r") as f:
+            return cls(f.readlines())
+
+    def write(self, prepi_file):
+        """
+        Writes the prepi file.
+
+        :param prepi_file: The prepi file name.
+        """
+        with open(prepi_file, "w") as f:
+            f.write(str(self))
+
+    def __str__(self):
+        return ''.join(self.header) + ''.join(f"{atom}\n" for atom in self.atoms) + ''.join(str(item) for item in self.items)
+
+    def get_section(self, keyword):
+        """
+        Returns the section of the keyword ('LOOP', 'IMPROPER' or 'CHARGE'), or None if the prepi file has no such section.
+        """
+        return next((item for item in self.items if isinstance(item, PrepiSection) and item.keyword == keyword), None)
+
+    def rename_atoms(self, convert_name, normalize_hydrogens=True):
+        """
+        Renames the atoms, the LOOP and the IMPROPER entries in one pass.
+
+        :param convert_name: dictionary, the old atom name -> the new atom name. Every non-dummy atom must be included.
+        :param normalize_hydrogens: (Optional) If True, PDB v2 hydrogen names are converted to the amber convention, e.g. 2HB -> HB2.
+        """
+        def new_name(name, line):
+            if name not in convert_name:
+                raise KeyError(f"Key {name} not found in convert_name for line: {line}")
+            name = convert_name[name]
+            return HYDROGEN_NAME_MAP.get(name, name) if normalize_hydrogens else name
+
+        for atom in self.atoms:
+            if not atom.is_dummy():
+                atom.name = new_name(atom.name, atom.line)
+        for item in self.items:
+            if isinstance(item, PrepiSection) and item.keyword in ("LOOP", "IMPROPER"):
+                for entry in item.entries:
+                    n_names = 2 if item.keyword == "LOOP" else 4
+                    entry[:] = [name if name in NEIGHBOR_ATOMS else new_name(name, ' '.join(entry)) for name in entry[:n_names]]
+
+    def add_backbone_impropers(self):
+        """
+        Adds the backbone impropers of an amino acid (CA +M C O and -M CA N H) to the IMPROPER section if they are missing.
+        """
+        improper = self.get_section("IMPROPER")
+        if improper is None:
+            return
+        names = [name for entry in improper.entries for name in entry]
+        if "+M" not in names:
+            improper.entries.append(["CA", "+M", "C", "O"])
+        if "-M" not in names:
+            improper.entries.append(["-M", "CA", "N", "H"])
+
+    def atom_charges(self):
+        """
+        Returns the (atom name, charge) of the real (non-dummy) atoms in the prepi order.
+        """
+        return [(atom.name, atom.charge) for atom in self.atoms if not atom.is_dummy()]
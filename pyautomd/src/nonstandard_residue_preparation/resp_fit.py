@@ -0,0 +1,294 @@
+import re
+try:
+    import numpy as np
+except ImportError: # numpy is optional, the resp program is used without it
+    np = None
+from .gaussian_esp_parser import BOHR
+
+HYPERBOLIC_B = 0.1 # the hyperbola stiffness b of the RESP restraint a*(sqrt(q**2 + b**2) - b)
+CONVERGENCE_TOLERANCE = 1e-6
+MAX_ITERATIONS = 100
+CRG_PRECISION = 1e-6 # the last digit of the 8F10.6 charge files
+
+
+def numpy_available():
+    """
+    Returns True if numpy can be imported, i.e. the RESP fit can run in-process.
+    """
+    return np is not None
+
+
+def read_charge_file(crg_file):
+    """
+    Reads a charge file of the resp program (8F10.6 per line).
+    """
+    charges = []
+    with open(crg_file, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            charges.extend(float(line[i:i + 10]) for i in range(0, len(line), 10) if line[i:i + 10].strip())
+    return charges
+
+
+def write_charge_file(charges, crg_file):
+    """
+    Writes the charges in the format of the resp program (8F10.6 per line), readable by 'antechamber -c rc -cf'.
+    """
+    with open(crg_file, 'w') as f:
+        for start in range(0, len(charges), 8):
+            f.write("".join(f"{charge:10.6f}" for charge in charges[start:start + 8]) + "\n")
+
+
+class Resp_input():
+    """
+    The single-molecule input file of the resp program, as written by respgen: the &cntrl options, the atoms with their
+    ivary flags (0 free, -1 frozen, n > 0 equivalent to atom n) and the group charge constraints.
+    """
+    def __init__(self, cntrl, wtmol, charge, atomic_numbers, ivary, constraints):
+        self.cntrl = cntrl
+        self.wtmol = wtmol
+        self.charge = charge
+        self.atomic_numbers = atomic_numbers
+        self.ivary = ivary
+        self.constraints = constraints # list of (charge, list of 0-based atom indices)
+
+    @classmethod
+    def read(cls, respin_file):
+        """
+        Reads a respin file.
+
+        :param respin_file: string, the respin file name.
+        """
+        with open(respin_file, 'r') as f:
+            lines = f.read().split('\n')
+        start = next(i for i, line in enumerate(lines) if line.strip().lower() == '&cntrl')
+        end = next(i for i, line in enumerate(lines) if line.strip().lower() == '&end')
+        cntrl = {}
+        for key, value in re.findall(r"(\w+)\s*=\s*([-+.\w]+)", ' '.join(lines[start + 1:end])):
+            cntrl[key.lower()] = float(value)
+        wtmol = float(lines[end + 1].split()[0])
+        charge, n_atoms = (int(field) for field in lines[end + 3].split()[:2])
+        atomic_numbers = []
+        ivary = []
+        for line in lines[end + 4:end + 4 + n_atoms]:
+            atomic_number, flag = line.split()[:2]
+            atomic_numbers.append(int(atomic_number))
+            ivary.append(int(flag))
+        constraints = []
+        i = end + 4 + n_atoms
+        while i < len(lines) and not lines[i].strip():
+            i += 1
+        # Group constraints: 'ngrp charge' then the (molecule, atom) pairs, 16I5 per line, until a blank line
+        while i < len(lines) and lines[i].strip():
+            n_group, group_charge = int(lines[i][0:5]), float(lines[i][5:].split()[0])
+            i += 1
+            pairs = []
+            while len(pairs) < 2 * n_group:
+                line = lines[i]
+                pairs.extend(int(line[k:k + 5]) for k in range(0, len(line), 5) if line[k:k + 5].strip())
+                i += 1
+            constraints.append((group_charge, [atom - 1 for atom in pairs[1::2]]))
+        return cls(cntrl, wtmol, charge, atomic_numbers, ivary, constraints)
+
+
+def esp_normal_equations(atom_coords, point_coords, potentials):
+    """
+    Returns the normal equations (A, B) of the least-squares ESP fit, A[j, k] = sum_i 1/r_ij 1/r_ik and B[j] = sum_i V_i/r_ij,
+    with the distances in bohr and the potentials in atomic units, as in the resp program.
+
+    :param atom_coords: flat sequence of the atom coordinates in Angstrom.
+    :param point_coords: flat sequence of the ESP point coordinates in Angstrom.
+    :param potentials: sequence of the potentials in atomic units.
+    """
+    atoms = np.asarray(atom_coords, dtype=float).reshape(-1, 3) / BOHR
+    points = np.asarray(point_coords, dtype=float).reshape(-1, 3) / BOHR
+    inv_r = 1.0 / np.linalg.norm(points[:, None, :] - atoms[None, :, :], axis=2)
+    return inv_r.T @ inv_r, inv_r.T @ np.asarray(potentials, dtype=float)
+
+
+class Resp_fit():
+    """
+    One stage of the hyperbolic-restrained RESP fit of a molecule, fitted to the ESP of one or several conformers.
+    The charges are the variables left after equivalencing and freezing; the total charge and the group constraints
+    are imposed with Lagrange multipliers, and the restraint is linearized and iterated to self-consistency as in the resp program.
+    """
+    def __init__(self, resp_input, esp_sets, initial_charges=None):
+        """
+        Initializes the Resp_fit class.
+
+        :param resp_input: Resp_input object.
+        :param esp_sets: list of Gaussian_esp_data objects, one per conformer, with the atoms in the order of the respin file.
+        :param initial_charges: (Optional) list, the charges of the frozen atoms (ivary -1) and the starting charges (iqopt 2), e.g. the charges of the first stage.
+        """
+        if np is None:
+            raise ImportError("numpy is required for the in-process RESP fit, install it with 'pip install pyautomd[resp]' or use the resp program.")
+        self.resp_input = resp_input
+        n_atoms = len(resp_input.atomic_numbers)
+        self.A = np.zeros((n_atoms, n_atoms))
+        self.B = np.zeros(n_atoms)
+        for esp_data in esp_sets:
+            if esp_data.n_atoms != n_atoms:
+                raise ValueError(f"The ESP has {esp_data.n_atoms} atoms but the respin file {n_atoms}.")
+            A, B = esp_normal_equations(esp_data.atom_coords, esp_data.point_coords, esp_data.potentials)
+            self.A += resp_input.wtmol * A
+            self.B += resp_input.wtmol * B
+        initial = np.zeros(n_atoms) if initial_charges is None else np.asarray(initial_charges, dtype=float)
+        # Map the atoms onto the fitted variables: q = T x + q_fixed
+        variable_of = [None] * n_atoms
+        n_variables = 0
+        for i, flag in enumerate(resp_input.ivary):
+            if flag == 0:
+                variable_of[i] = n_variables
+                n_variables += 1
+        for i, flag in enumerate(resp_input.ivary):
+            if flag > 0:
+                j = flag - 1
+                while resp_input.ivary[j] > 0 and resp_input.ivary[j] - 1 != j:
+                    j = resp_input.ivary[j] - 1
+                variable_of[i] = variable_of[j]
+        self.T = np.zeros((n_atoms, n_variables))
+        self.q_fixed = np.zeros(n_atoms)
+        for i, variable in enumerate(variable_of):
+            if variable is None:
+                self.q_fixed[i] = initial[i]
+            else:
+                self.T[i, variable] = 1.0
+        cntrl = resp_input.cntrl
+        self.qwt = cntrl.get('qwt', 0.0005) * resp_input.wtmol
+        self.restrained = np.array([variable is not None and cntrl.get('irstrnt', 1) > 0 and
+                                    not (cntrl.get('ihfree', 1) > 0 and atomic_number == 1)
+                                    for variable, atomic_number in zip(variable_of, resp_input.atomic_numbers)])
+        constraints = [(float(resp_input.charge), list(range(n_atoms)))] + list(resp_input.constraints)
+        C = np.zeros((len(constraints), n_atoms))
+        d = np.zeros(len(constraints))
+        for k, (charge, atoms) in enumerate(constraints):
+            C[k, atoms] = 1.0
+            d[k] = charge
+        Cx = C @ self.T
+        keep = np.any(Cx != 0.0, axis=1) # constraints on frozen atoms only can not be imposed
+        self.Cx = Cx[keep]
+        self.dx = (d - C @ self.q_fixed)[keep]
+        self.charges = initial * (cntrl.get('iqopt', 1) > 1)
+
+    @property
+    def n_variables(self):
+        return self.T.shape[1]
+
+    def linear_system(self, charges):
+        """
+        Returns the bordered linear system (M, rhs) of the fit, with the restraint linearized at the given charges.
+        """
+        A = self.A.copy()
+        diagonal = np.where(self.restrained, self.qwt / np.sqrt(charges ** 2 + HYPERBOLIC_B ** 2), 0.0)
+        A[np.diag_indices_from(A)] += diagonal
+        Ax = self.T.T @ A @ self.T
+        Bx = self.T.T @ (self.B - A @ self.q_fixed)
+        n, k = self.n_variables, len(self.dx)
+        M = np.zeros((n + k, n + k))
+        M[:n, :n] = Ax
+        M[:n, n:] = self.Cx.T
+        M[n:, :n] = self.Cx
+        return M, np.concatenate([Bx, self.dx])
+
+    def charges_from_solution(self, solution):
+        return self.T @ solution[:self.n_variables] + self.q_fixed
+
+    def fit(self):
+        """
+        Runs the fit. Returns the charges of all atoms.
+        """
+        return fit_batch([self])[0]
+
+
+def solve_stacked(matrices, vectors):
+    """
+    Solves a stack of linear systems of the same size in one call, falling back to least squares for singular systems.
+    """
+    M = np.stack(matrices)
+    rhs = np.stack(vectors)
+    try:
+        return np.linalg.solve(M, rhs[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.stack([np.linalg.lstsq(m, v, rcond=None)[0] for m, v in zip(M, rhs)])
+
+
+def fit_batch(fits, tolerance=CONVERGENCE_TOLERANCE, max_iterations=MAX_ITERATIONS):
+    """
+    Runs many RESP fits (molecules or conformer sets) together: at every restraint iteration the linear systems
+    of the same size are solved in one batched call.
+
+    :param fits: list of Resp_fit objects.
+    :return: list of numpy arrays, the charges of each fit.
+    """
+    active = list(range(len(fits)))
+    for _ in range(max_iterations):
+        if not active:
+            break
+        systems = {}
+        for index in active:
+            M, rhs = fits[index].linear_system(fits[index].charges)
+            systems.setdefault(M.shape[0], []).append((index, M, rhs))
+        converged = []
+        for group in systems.values():
+            solutions = solve_stacked([M for _, M, _ in group], [rhs for _, _, rhs in group])
+            for (index, _, _), solution in zip(group, solutions):
+                charges = fits[index].charges_from_solution(solution)
+                change = np.max(np.abs(charges - fits[index].charges)) if len(charges) else 0.0
+                fits[index].charges = charges
+                if change < tolerance or not fits[index].restrained.any():
+                    converged.append(index)
+        active = [index for index in active if index not in converged]
+    if active:
+        print(f"Warning: {len(active)} RESP fits did not converge in {max_iterations} iterations.")
+    return [fit.charges for fit in fits]
+
+
+def two_stage_resp(step1_respin, step2_respin, esp_sets, step1_crg, step2_crg):
+    """
+    Runs the standard two-stage RESP fit in-process and writes the charge files of both stages in the format of the resp program.
+
+    :param step1_respin: string, the respin file of the first stage (all charges free, qwt 0.0005).
+    :param step2_respin: string, the respin file of the second stage (methyl/methylene groups refitted, qwt 0.001).
+    :param esp_sets: list of Gaussian_esp_data objects, one per conformer.
+    :param step1_crg: string, the charge file of the first stage.
+    :param step2_crg: string, the charge file of the second stage.
+    :return: list, the final charges.
+    """
+    step1_charges = Resp_fit(Resp_input.read(step1_respin), esp_sets).fit()
+    write_charge_file(step1_charges, step1_crg)
+    step2_charges = Resp_fit(Resp_input.read(step2_respin), esp_sets, initial_charges=step1_charges).fit()
+    write_charge_file(step2_charges, step2_crg)
+    return [float(charge) for charge in step2_charges]
+
+
+def compare_charges(reference, charges, tolerance=CRG_PRECISION):
+    """
+    Returns the atoms whose charges differ by more than the tolerance.
+
+    :return: list of (0-based atom index, reference charge, charge).
+    """
+    if len(reference) != len(charges):
+        raise ValueError(f"{len(reference)} reference charges but {len(charges)} charges.")
+    return [(i, float(a), float(b)) for i, (a, b) in enumerate(zip(reference, charges)) if abs(a - b) > tolerance + 1e-9]
+
+
+def validate_two_stage_resp(step1_respin, step2_respin, esp_sets, step1_crg, step2_crg, tolerance=CRG_PRECISION):
+    """
+    Refits both stages in-process and compares the charges to the charge files of the resp program.
+    The second stage starts from the first-stage charges of the resp program, as 'resp -q' does, so that each stage is compared on its own.
+
+    :param step1_crg: string, the first-stage charge file of the resp program.
+    :param step2_crg: string, the second-stage charge file of the resp program.
+    :raises ValueError: if a charge differs by more than the tolerance.
+    """
+    step1_reference = read_charge_file(step1_crg)
+    step2_reference = read_charge_file(step2_crg)
+    stages = [('step 1', step1_reference, Resp_fit(Resp_input.read(step1_respin), esp_sets).fit()),
+              ('step 2', step2_reference, Resp_fit(Resp_input.read(step2_respin), esp_sets, initial_charges=step1_reference).fit())]
+    problems = []
+    for stage, reference, charges in stages:
+        for i, expected, charge in compare_charges(reference, charges, tolerance):
+            problems.append(f"{stage} atom {i + 1}: resp {expected:.6f}, native {charge:.6f}")
+    if problems:
+        raise ValueError("The in-process RESP fit differs from the resp program:\n" + "\n".join(problems))
+    print(f"RESP validation passed: both stages agree with the resp program within {tolerance:g}.")
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import fcntl
+from contextlib import contextmanager
+from .pdb_atoms import PDB_atoms
+
+# Covalent radii (Angstrom) used to perceive bonds from coordinates.
+COVALENT_RADII = {
+    'H': 0.31, 'C': 0.76, 'N': 0.71, 'O': 0.66, 'F': 0.57, 'P': 1.07, 'S': 1.05,
+    'Cl': 1.02, 'Br': 1.20, 'I': 1.39, 'B': 0.84, 'Si': 1.11, 'Se': 1.20,
+}
+CACHE_FORMAT_VERSION = 1
+
+
+def guess_element(atom_name, element_field=''):
+    """
+    Guesses the element of an atom from the PDB element column or, failing that, from the atom name.
+
+    :param atom_name: string, the PDB atom name.
+    :param element_field: string, the PDB element column (columns 77-78), may be empty.
+    """
+    element_field = element_field.strip()
+    if element_field:
+        return element_field.capitalize()
+    name = atom_name.strip().lstrip('0123456789')
+    if name[0:2] in ['CL', 'Cl', 'BR', 'Br']:
+        return name[0:2].capitalize()
+    return name[0:1].upper()
+
+
+def read_molecular_graph(pdb_file):
+    """
+    Reads the atoms of a PDB file and perceives the bonds from the interatomic distances.
+
+    :param pdb_file: string, the PDB file name.
+    :return: (atoms, bonds), atoms is a list of (resname, atom name, element), bonds is a list of index pairs.
+    """
+    pdb_atoms = PDB_atoms.read(pdb_file)
+    atoms = [(resname, name, guess_element(name, element))
+             for resname, name, element in zip(pdb_atoms.column('resname'), pdb_atoms.column('name'), pdb_atoms.column('element'))]
+    coords = [pdb_atoms.xyz(i) for i in range(len(pdb_atoms))]
+    bonds = []
+    for i in range(len(atoms)):
+        ri = COVALENT_RADII.get(atoms[i][2], 1.5)
+        xi, yi, zi = coords[i]
+        for j in range(i + 1, len(atoms)):
+            cutoff = ri + COVALENT_RADII.get(atoms[j][2], 1.5) + 0.45
+            xj, yj, zj = coords[j]
+            if (xi - xj)**2 + (yi - yj)**2 + (zi - zj)**2 < cutoff * cutoff:
+                bonds.append((i, j))
+    return atoms, bonds
+
+
+def molecule_key(pdb_file, resn, net_charge, charge_method, lig_ff, **options):
+    """
+    Computes the content-addressed cache key of a molecule.
+    The key only depends on the molecular graph (elements, bonds and atom names), not on the atom order or the coordinates.
+
+    :param pdb_file: string, the PDB file of the molecule, e.g. ligand-format.pdb.
+    :param resn: string, the residue name written into the parameter files.
+    :param net_charge: int, the net charge of the molecule.
+    :param charge_method: string, the charge method, 'bcc' or 'resp'.
+    :param lig_ff: string, the small molecule force field, e.g. 'gaff2'.
+    :param options: (Optional) additional settings that change the parameters, e.g. ifopt=True.
+    """
+    atoms, bonds = read_molecular_graph(pdb_file)
+    labels = [f"{resname}:{name}" for resname, name, _ in atoms]
+    graph = {
+        'atoms': sorted(f"{label}:{atom[2]}" for label, atom in zip(labels, atoms)),
+        'bonds': sorted('-'.join(sorted((labels[i], labels[j]))) for i, j in bonds),
+        'resn': resn,
+        'net_charge': int(net_charge),
+        'charge_method': charge_method,
+        'lig_ff': lig_ff,
+        'options': {key: options[key] for key in sorted(options)},
+        'version': CACHE_FORMAT_VERSION,
+    }
+    return hashlib.sha256(json.dumps(graph, sort_keys=True).encode()).hexdigest()
+
+
+def link_or_copy(src, dst):
+    """
+    Hard-links the file to the destination, copying it where a link is not possible (e.g. across file systems).
+    An existing destination is replaced.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
+def file_key(file_paths, **options):
+    """
+    Computes the content-addressed cache key of files, e.g. a receptor pdb, together with the settings applied to them.
+
+    :param file_paths: list, the file names, the order matters.
+    :param options: (Optional) the settings that change the cached result, e.g. cutoff=2.5.
+    """
+    digest = hashlib.sha256()
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(b'\0')
+    digest.update(json.dumps({'options': options, 'version': CACHE_FORMAT_VERSION}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class Parameter_cache:
+    """
+    A persistent content-addressed cache of parameter files (e.g. prepi and frcmod) with a size cap and LRU eviction.
+    """
+    def __init__(self, cache_path, max_size_mb=500):
+        """
+        Initializes the Parameter_cache class.
+
+        :param cache_path: string, the cache directory. Created if it does not exist.
+        :param max_size_mb: float, the size cap of the cache in MB. The least recently used entries are evicted above it.
+        """
+        self.cache_path = os.path.abspath(os.path.expanduser(cache_path))
+        self.max_size = int(float(max_size_mb) * 1024 * 1024)
+        self.entries_path = os.path.join(self.cache_path, 'entries')
+        self.index_file = os.path.join(self.cache_path, 'index.json')
+        os.makedirs(self.entries_path, exist_ok=True)
+
+    @contextmanager
+    def locked_index(self):
+        """
+        Yields the cache index while holding an exclusive lock, and writes it back atomically on exit.
+        """
+        with open(os.path.join(self.cache_path, 'index.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.index_file):
+                    with open(self.index_file, 'r') as f:
+                        index = json.load(f)
+                else:
+                    index = {'entries': {}, 'stats': {'hits': 0, 'misses': 0, 'evictions': 0}}
+                yield index
+                tmp_file = f"{self.index_file}.{os.getpid()}.tmp"
+                with open(tmp_file, 'w') as f:
+                    json.dump(index, f, indent=1)
+                os.replace(tmp_file, self.index_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def lookup(self, key, filenames, dest='.', link=False):
+        """
+        Copies the cached files of the key into the destination directory.
+
+        :param key: string, the cache key.
+        :param filenames: list, the file names expected in the cache entry.
+        :param dest: (Optional) string, the destination directory.
+        :param link: (Optional) bool, whether to hard-link the cached files instead of copying them. The linked files share
+                     their content with the cache and must not be modified in place.
+        :return: True on a cache hit, False otherwise.
+        """
+        with self.locked_index() as index:
+            entry = index['entries'].get(key)
+            entry_path = os.path.join(self.entries_path, key)
+            if entry is None or not all(os.path.isfile(os.path.join(entry_path, name)) for name in filenames):
+                index['stats']['misses'] += 1
+                return False
+            for name in filenames:
+                if link:
+                    link_or_copy(os.path.join(entry_path, name), os.path.join(dest, name))
+                else:
+                    shutil.copy(os.path.join(entry_path, name), os.path.join(dest, name))
+            entry['last_access'] = time.time()
+            index['stats']['hits'] += 1
+            return True
+
+    def entry_files(self, key):
+        """
+        Returns the file names stored under the key, None if the key is not cached.
+        """
+        with self.locked_index() as index:
+            entry = index['entries'].get(key)
+            return list(entry['files']) if entry is not None else None
+
+    def store(self, key, filenames, src='.', label=None):
+        """
+        Stores the files into the cache under the key and evicts the least recently used entries above the size cap.
+
+        :param key: string, the cache key.
+        :param filenames: list, the file names to be stored.
+        :param src: (Optional) string, the directory holding the files.
+        :param label: (Optional) string, a human readable label of the entry, e.g. the residue name.
+        """
+        tmp_path = os.path.join(self.entries_path, f".{key}.{os.getpid()}.tmp")
+        os.makedirs(tmp_path, exist_ok=True)
+        size = 0
+        for name in filenames:
+            shutil.copy(os.path.join(src, name), os.path.join(tmp_path, name))
+            size += os.path.getsize(os.path.join(tmp_path, name))
+        with self.locked_index() as index:
+            entry_path = os.path.join(self.entries_path, key)
+            if os.path.isdir(entry_path):
+                shutil.rmtree(entry_path)
+            os.rename(tmp_path, entry_path)
+            now = time.time()
+            index['entries'][key] = {'files': list(filenames), 'size': size, 'label': label, 'created': now, 'last_access': now}
+            self.evict(index, keep=key)
+
+    def evict(self, index, keep=None):
+        """
+        Removes the least recently used entries until the cache fits into the size cap.
+
+        :param index: dictionary, the locked cache index.
+        :param keep: (Optional) string, a key never to be evicted, e.g. the entry just stored.
+        """
+        entries = index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_access']):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            total -= entries[key]['size']
+            shutil.rmtree(os.path.join(self.entries_path, key), ignore_errors=True)
+            del entries[key]
+            index['stats']['evictions'] += 1
+
+    def stats(self):
+        """
+        Returns the hit/miss/eviction statistics together with the number of entries and the total size in bytes.
+        """
+        with self.locked_index() as index:
+            stats = dict(index['stats'])
+            stats['entries'] = len(index['entries'])
+            stats['size'] = sum(entry['size'] for entry in index['entries'].values())
+        return stats
+
+    def report(self):
+        """
+        Prints the cache statistics.
+        """
+        stats = self.stats()
+        requests = stats['hits'] + stats['misses']
+        hit_rate = 100.0 * stats['hits'] / requests if requests else 0.0
+        print(f"Parameter cache {self.cache_path}: {stats['entries']} entries, {stats['size'] / 1024 / 1024:.2f}/{self.max_size / 1024 / 1024:.0f} MB, "
+              f"hits {stats['hits']}, misses {stats['misses']} ({hit_rate:.1f}% hit rate), evictions {stats['evictions']}")
@@ -102,7 +102,13 @@ class InputParser:
                                 'amber': '$AMBERHOME',
                                 'gaussian': '$g03root',
                                 'amber_md': 'pmemd.cuda_SPFP',
-                                'gaussian_scr_path': '/tmp/zli/scr'
+                                'gaussian_scr_path': '/tmp/zli/scr',
+                                'max_program_cpus': None,
+                                'program_timeout': None,
+                                'gaussian_timeout': None,
+                                'gaussian_stall_timeout': None,
+                                'gaussian_total_mem': None,
+                                'ifgaussian_restart': False,
                             },
                             'MD_input_parameters': {
                                 'restraint_lig': '',
@@ -115,6 +121,15 @@ class InputParser:
                                 'equil_nstlim': 50000,
                                 'prod_nstlim': 1000000,
                                 'prod_steps': 4,
+                                'ifhmr': False,
+                                'ifnetcdf': False,
+                                'ifcompact_traj': False,
+                                'compact_stride': 1,
+                                'compact_precision': None,
+                                'ifadaptive_equil': False,
+                                'equil_chunk_nstlim': 5000,
+                                'equil_min_nstlim': 10000,
+                                'equil_max_nstlim': 100000,
                             },
                             'Preparation_option': {
                                 'ligand_pdb': 'mol.pdb',
@@ -125,10 +140,13 @@ class InputParser:
                                 'ifonly_protein_prepare': False,
                                 'ifcomplex_prepare': True,
                                 'charge_model': 'bcc',
+                                'ligand_extra_formats': None,
+                                'resp_engine': 'resp',
                                 'boxtype': 'solvateoct',
                                 'com_boxsize': 10.0,
                                 'lig_boxsize': 20.0,
                                 'sbond_file': None,
+                                'ifauto_disulfide': True,
                                 'tleap_file': None,
                                 'ifoptimization_ligand': False,
                                 'iffull_auto': True,
@@ -142,6 +160,19 @@ class InputParser:
                                 'nonstandard_aminoacid_charge': 0,
                                 'ifoptimization_nonstandard_aminoacid': False,
                             },
+                            'Batch_option': {
+                                'ifbatch_ligand_prepare': False,
+                                'ligand_library': 'ligands',
+                                'batch_workers': 4,
+                                'batch_output_dir': 'batch',
+                            },
+                            'Cache_option': {
+                                'ifparm_cache': False,
+                                'cache_path': '~/.pyautomd',
+                                'parm_cache_size': 500,
+                                'ifrec_cache': False,
+                                'rec_cache_size': 2000,
+                            },
         }
 
 
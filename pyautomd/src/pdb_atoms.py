@@ -0,0 +1,174 @@
+import array
+
+# Fixed-width text columns of the ATOM/HETATM records, 0-based [start, end) offsets
+TEXT_COLUMNS = {
+    'name': (12, 16),
+    'altloc': (16, 17),
+    'resname': (17, 21),
+    'chain': (21, 22),
+    'icode': (26, 27),
+    'element': (76, 78),
+    'formal_charge': (78, 80),
+}
+ATOM_RECORDS = (b'ATOM', b'HETATM')
+WRITE_CHUNK = 65536 # lines formatted per write call
+
+
+def _to_int(field, default):
+    try:
+        return int(field)
+    except ValueError:
+        return default
+
+
+def _to_float(field, default):
+    try:
+        return float(field)
+    except ValueError:
+        return default
+
+
+class PDB_atoms():
+    """
+    The atoms of a PDB file in columnar form: the numeric columns (serial, residue number, coordinates, occupancy,
+    B-factor, partial charge) are typed arrays and the text columns are fixed-width byte strings, one slot per atom,
+    so that large solvated systems are held without a Python object per atom.
+    The coordinates are interleaved x/y/z.
+    """
+    def __init__(self):
+        self.hetatm = array.array('b')
+        self.serial = array.array('l')
+        self.resseq = array.array('l')
+        self.coords = array.array('d')
+        self.occupancy = array.array('d')
+        self.bfactor = array.array('d')
+        self.charges = array.array('d')
+        self.text = {column: bytearray() for column in TEXT_COLUMNS}
+
+    @classmethod
+    def read(cls, pdb_file, residue_names=None):
+        """
+        Reads the ATOM and HETATM records of a PDB file in one pass.
+
+        :param pdb_file: string, the PDB file name.
+        :param residue_names: (Optional) iterable of strings, only the atoms of these residues are kept.
+        :return: PDB_atoms object.
+        """
+        atoms = cls()
+        if residue_names is not None:
+            residue_names = {resname.strip().encode() for resname in residue_names}
+        with open(pdb_file, 'rb') as f:
+            for line in f:
+                if not line.startswith(ATOM_RECORDS):
+                    continue
+                if residue_names is not None and line[17:21].strip() not in residue_names:
+                    continue
+                atoms.append_line(line)
+        return atoms
+
+    def append_line(self, line):
+        """
+        Appends the atom of an ATOM/HETATM record (bytes).
+        """
+        line = line.rstrip(b'\r\n').ljust(80)
+        for column, (start, end) in TEXT_COLUMNS.items():
+            self.text[column] += line[start:end]
+        self.hetatm.append(line.startswith(b'HETATM'))
+        self.serial.append(_to_int(line[6:11], len(self.serial) + 1))
+        # Residue numbers above 9999 overflow into the insertion code column
+        self.resseq.append(_to_int(line[22:27] if line[26:27].isdigit() else line[22:26], 0))
+        self.coords.extend((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+        self.occupancy.append(_to_float(line[54:60], 1.0))
+        self.bfactor.append(_to_float(line[60:66], 0.0))
+        self.charges.append(0.0)
+
+    def __len__(self):
+        return len(self.serial)
+
+    def get(self, column, i):
+        """
+        Returns the stripped value of a text column of atom i.
+        """
+        start, end = TEXT_COLUMNS[column]
+        width = end - start
+        return self.text[column][i * width:(i + 1) * width].decode().strip()
+
+    def set(self, column, i, value):
+        """
+        Sets the value of a text column of atom i.
+        """
+        start, end = TEXT_COLUMNS[column]
+        width = end - start
+        if len(value) > width:
+            raise ValueError(f"'{value}' is longer than the {width} characters of the PDB {column} column.")
+        self.text[column][i * width:(i + 1) * width] = value.ljust(width).encode()
+
+    def column(self, column):
+        """
+        Returns the stripped values of a text column as a list of strings.
+        """
+        start, end = TEXT_COLUMNS[column]
+        width = end - start
+        data = self.text[column]
+        return [data[k:k + width].decode().strip() for k in range(0, len(data), width)]
+
+    def xyz(self, i):
+        return self.coords[3 * i], self.coords[3 * i + 1], self.coords[3 * i + 2]
+
+    def select(self, indices):
+        """
+        Returns a new PDB_atoms object with the given atoms, in the given order.
+        """
+        atoms = PDB_atoms()
+        for i in indices:
+            for column, (start, end) in TEXT_COLUMNS.items():
+                width = end - start
+                atoms.text[column] += self.text[column][i * width:(i + 1) * width]
+            atoms.hetatm.append(self.hetatm[i])
+            atoms.serial.append(self.serial[i])
+            atoms.resseq.append(self.resseq[i])
+            atoms.coords.extend(self.coords[3 * i:3 * i + 3])
+            atoms.occupancy.append(self.occupancy[i])
+            atoms.bfactor.append(self.bfactor[i])
+            atoms.charges.append(self.charges[i])
+        return atoms
+
+    def format_line(self, i, serial, with_charges=False):
+        """
+        Formats the record of atom i.
+
+        :param serial: int, the atom serial number written.
+        :param with_charges: (Optional) bool, write the partial charge after the coordinates (columns 55-64) instead of
+                             the occupancy, B-factor and element, as in the ligand pdb read by tleap.
+        """
+        name = self.get('name', i)
+        resname = self.get('resname', i)
+        x, y, z = self.xyz(i)
+        if with_charges:
+            return "ATOM  %5d  %-3s%4s%6d%12.3f%8.3f%8.3f%10.6f\n" % (serial % 100000, name, resname, self.resseq[i] % 10000, x, y, z, self.charges[i])
+        record = 'HETATM' if self.hetatm[i] else 'ATOM  '
+        name_field = name if len(name) == 4 else f" {name:<3s}"
+        resname_field = f"{resname:>3s} " if len(resname) <= 3 else resname
+        line = (f"{record}{serial % 100000:5d} {name_field}{self.get('altloc', i):1s}{resname_field}{self.get('chain', i):1s}"
+                f"{self.resseq[i] % 10000:4d}{self.get('icode', i):1s}   {x:8.3f}{y:8.3f}{z:8.3f}{self.occupancy[i]:6.2f}{self.bfactor[i]:6.2f}")
+        element, formal_charge = self.get('element', i), self.get('formal_charge', i)
+        if element or formal_charge:
+            line += f"          {element:>2s}{formal_charge:2s}"
+        return line + "\n"
+
+    def write(self, pdb_file, mode='w', renumber=False, with_charges=False, ter=False):
+        """
+        Writes the atoms as a fixed-width PDB file.
+
+        :param pdb_file: string, the output PDB file name.
+        :param mode: (Optional) string, 'w' to overwrite or 'a' to append.
+        :param renumber: (Optional) bool, number the atoms from 1 instead of writing the serial column.
+        :param with_charges: (Optional) bool, see format_line.
+        :param ter: (Optional) bool, end the atoms with a TER record.
+        """
+        with open(pdb_file, mode) as f:
+            for start in range(0, len(self), WRITE_CHUNK):
+                f.writelines(self.format_line(i, i + 1 if renumber else self.serial[i], with_charges)
+                             for i in range(start, min(start + WRITE_CHUNK, len(self))))
+            if ter:
+                f.write("TER\n")
@@ -0,0 +1,207 @@
+import re
+import mmap
+
+FORMAT_PATTERN = re.compile(rb"%FORMAT\((\d+)([aAiIeEfF])(\d+)(?:\.(\d+))?")
+# The POINTERS entries used here
+NATOM = 0
+NRES = 11
+WATER_NAMES = {'WAT', 'HOH', 'TIP3', 'TP3', 'SOL', 'T3P', 'T4P', 'TIP4', 'OPC', 'SPC'}
+# Monovalent counter ions added by addions, structural ions (ZN, MG, CA...) stay in the receptor
+ION_NAMES = {'Na+', 'Cl-', 'K+', 'Li+', 'Rb+', 'Cs+', 'F-', 'Br-', 'I-', 'NA', 'CL', 'K'}
+
+
+def compress_ranges(numbers):
+    """
+    Compresses sorted residue/atom numbers into an Amber mask range list, e.g. [1, 2, 3, 7] -> '1-3,7'.
+    """
+    ranges = []
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ','.join(f"{start}-{end}" if end > start else f"{start}" for start, end in ranges)
+
+
+class Prmtop_reader():
+    """
+    A lazy reader of Amber prmtop files. The file is memory-mapped, the %FLAG sections are indexed on the first access,
+    and a section is only parsed when it is requested, then kept.
+    """
+    def __init__(self, prmtop_file):
+        """
+        Initializes the Prmtop_reader class.
+
+        :param prmtop_file: string, the prmtop file name.
+        """
+        self.prmtop_file = prmtop_file
+        self.file = open(prmtop_file, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.sections = None # flag -> (format line offset, data start, data end)
+        self.flag_starts = {} # flag -> offset of the %FLAG line
+        self.cache = {}
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def index_sections(self):
+        self.sections = {}
+        mm = self.mm
+        pos = mm.find(b"%FLAG")
+        while pos >= 0:
+            line_end = mm.find(b"\n", pos)
+            flag = mm[pos + 5:line_end].strip().decode()
+            format_start = line_end + 1
+            data_start = mm.find(b"\n", format_start) + 1
+            next_flag = mm.find(b"\n%FLAG", data_start - 1)
+            data_end = next_flag + 1 if next_flag >= 0 else len(mm)
+            self.sections[flag] = (format_start, data_start, data_end)
+            self.flag_starts[flag] = pos
+            pos = next_flag + 1 if next_flag >= 0 else -1
+
+    def has_section(self, flag):
+        if self.sections is None:
+            self.index_sections()
+        return flag in self.sections
+
+    def section_format(self, flag):
+        """
+        Returns the %FORMAT of a section: (values per line, kind 'a'/'i'/'e'/'f', width, decimals).
+        """
+        if not self.has_section(flag):
+            raise ValueError(f"{self.prmtop_file} has no %FLAG {flag} section.")
+        match = FORMAT_PATTERN.match(self.mm, self.sections[flag][0])
+        if match is None:
+            raise ValueError(f"Unsupported %FORMAT of the %FLAG {flag} section in {self.prmtop_file}.")
+        return int(match.group(1)), match.group(2).decode().lower(), int(match.group(3)), int(match.group(4) or 0)
+
+    def section(self, flag):
+        """
+        Returns the values of a %FLAG section: a list of strings, ints or floats according to its %FORMAT.
+        """
+        if flag in self.cache:
+            return self.cache[flag]
+        if not self.has_section(flag):
+            raise ValueError(f"{self.prmtop_file} has no %FLAG {flag} section.")
+        _, kind, width, _ = self.section_format(flag)
+        _, data_start, data_end = self.sections[flag]
+        values = []
+        for line in self.mm[data_start:data_end].split(b"\n"):
+            line = line.rstrip(b"\r")
+            if kind == 'a':
+                values.extend(line[k:k + width].decode().strip() for k in range(0, len(line), width))
+            elif kind == 'i':
+                values.extend(int(line[k:k + width]) for k in range(0, len(line), width) if line[k:k + width].strip())
+            else:
+                values.extend(float(line[k:k + width]) for k in range(0, len(line), width) if line[k:k + width].strip())
+        self.cache[flag] = values
+        return values
+
+    def format_section(self, flag, values):
+        """
+        Formats the values of a section with its %FORMAT, as tleap writes them.
+
+        :return: bytes, the data lines of the section.
+        """
+        per_line, kind, width, decimals = self.section_format(flag)
+        if kind == 'a':
+            items = [f"{value:<{width}s}"[:width] for value in values]
+        elif kind == 'i':
+            items = [f"{value:{width}d}" for value in values]
+        elif kind == 'e':
+            items = [f"{value:{width}.{decimals}E}" for value in values]
+        else:
+            items = [f"{value:{width}.{decimals}f}" for value in values]
+        lines = [''.join(items[k:k + per_line]) for k in range(0, len(items), per_line)] or ['']
+        return ''.join(f"{line}\n" for line in lines).encode()
+
+    def write(self, output_file, replacements, remove=()):
+        """
+        Writes the prmtop with the values of some sections replaced, all other bytes are copied unchanged.
+
+        :param output_file: string, the output prmtop file, must differ from the input.
+        :param replacements: dictionary, flag -> list of values, written with the %FORMAT of the section.
+        :param remove: (Optional) iterable of strings, the sections to be left out, e.g. the box sections.
+        """
+        if self.sections is None:
+            self.index_sections()
+        for flag in replacements:
+            if flag not in self.sections:
+                raise ValueError(f"{self.prmtop_file} has no %FLAG {flag} section.")
+        changed = set(replacements) | {flag for flag in remove if flag in self.sections}
+        position = 0
+        with open(output_file, 'wb') as out:
+            for flag in sorted(changed, key=lambda flag: self.sections[flag][1]):
+                _, data_start, data_end = self.sections[flag]
+                if flag in replacements:
+                    out.write(self.mm[position:data_start])
+                    out.write(self.format_section(flag, replacements[flag]))
+                else:
+                    out.write(self.mm[position:self.flag_starts[flag]])
+                position = data_end
+            out.write(self.mm[position:])
+
+    @property
+    def n_atoms(self):
+        return self.section('POINTERS')[NATOM]
+
+    @property
+    def n_residues(self):
+        return self.section('POINTERS')[NRES]
+
+    def residue_labels(self):
+        return self.section('RESIDUE_LABEL')
+
+    def residue_atom_ranges(self):
+        """
+        Returns the 1-based (first atom, last atom) of every residue.
+        """
+        pointers = self.section('RESIDUE_POINTER')
+        return [(first, (pointers[k + 1] - 1) if k + 1 < len(pointers) else self.n_atoms) for k, first in enumerate(pointers)]
+
+    def classify_residues(self, lig_resname=None):
+        """
+        Sorts the residues into ligand, water, ion and receptor (everything else).
+
+        :param lig_resname: (Optional) string, the ligand residue name.
+        :return: dictionary, kind -> list of 1-based residue numbers.
+        """
+        kinds = {'receptor': [], 'ligand': [], 'ion': [], 'water': []}
+        for number, label in enumerate(self.residue_labels(), 1):
+            if lig_resname is not None and label == lig_resname:
+                kinds['ligand'].append(number)
+            elif label in WATER_NAMES:
+                kinds['water'].append(number)
+            elif label in ION_NAMES:
+                kinds['ion'].append(number)
+            else:
+                kinds['receptor'].append(number)
+        return kinds
+
+    def atom_ranges(self, residues):
+        """
+        Returns the 1-based atom numbers of the residues, merged into (first, last) ranges.
+        """
+        residue_ranges = self.residue_atom_ranges()
+        ranges = []
+        for number in residues:
+            first, last = residue_ranges[number - 1]
+            if ranges and first == ranges[-1][1] + 1:
+                ranges[-1][1] = last
+            else:
+                ranges.append([first, last])
+        return [tuple(atom_range) for atom_range in ranges]
+
+    def restraint_masks(self, lig_resname):
+        """
+        Returns the residue ranges of the receptor and of the ligand as Amber mask strings, e.g. ('1-250', '251').
+        """
+        kinds = self.classify_residues(lig_resname)
+        return compress_ranges(kinds['receptor']), compress_ranges(kinds['ligand'])
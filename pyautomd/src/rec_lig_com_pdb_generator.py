@@ -1,14 +1,153 @@
+import os
+import errno
 from .nonstandard_residue_preparation.formate_lig_pdb import gen_ligpdb_by_prepi_formated_pdb
+from .mmcif_reader import is_mmcif, cif_to_pdb
+from .pdb_atoms import PDB_atoms
+from .disulfide_detector import Disulfide_detector
+from .spatial_index import find_clashes, residues_within
+
+COPY_BLOCK = 1 << 24 # bytes per kernel copy call
+# Errors of copy_file_range/sendfile meaning the copy is not supported for these files, other errors (e.g. ENOSPC) are raised
+COPY_FALLBACK_ERRNOS = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF)
+
+
+def copy_file_block(src_fd, dst_fd, offset, count):
+    """
+    Copies count bytes of the source file from offset to the current position of the destination file inside the kernel,
+    with os.copy_file_range or os.sendfile, falling back to read/write where neither is supported.
+
+    :param src_fd: int, the file descriptor of the source file.
+    :param dst_fd: int, the file descriptor of the destination file.
+    :raises ValueError: if the source file ends before offset + count, e.g. it changed since it was scanned.
+    """
+    end = offset + count
+    while offset < end:
+        size = min(COPY_BLOCK, end - offset)
+        copied = 0
+        try:
+            if hasattr(os, 'copy_file_range'):
+                copied = os.copy_file_range(src_fd, dst_fd, size, offset)
+            else:
+                copied = os.sendfile(dst_fd, src_fd, offset, size)
+        except OSError as error:
+            if error.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+            copied = 0
+        if copied <= 0:
+            os.lseek(src_fd, offset, os.SEEK_SET)
+            data = os.read(src_fd, size)
+            if not data:
+                raise ValueError(f"The source file ends at byte {offset}, {end - offset} bytes before the end of the copied range.")
+            copied = os.write(dst_fd, data)
+        offset += copied
+
 
 class PDB_simple_processor:
-    def __init__(self, prepi_file, ligand_format_pdb, receptor_pdb):
+    def __init__(self, prepi_file, ligand_format_pdb, receptor_pdb, auto_disulfide=False, disulfide_cache_path=None, receptor_split=None):
+        """
+        Scans the receptor once, recording the offset of the first crystal water and the byte ranges free of CONECT and blank lines.
+        The output files are then assembled from these ranges by kernel-side copies, the receptor is never held in memory.
+
+        :param prepi_file: string or Prepi, the ligand prepi file name or an already parsed Prepi object.
+        :param ligand_format_pdb: string, the formatted ligand pdb file, e.g. ligand-format.pdb.
+        :param receptor_pdb: string, the receptor pdb file, or an mmCIF/PDBx file (.cif, .mmcif), converted to {rec}_from_cif.pdb first.
+        :param auto_disulfide: (Optional) bool, whether to detect the disulfide bonds, rename the bonded cysteines to CYX ({rec}_cyx.pdb)
+                               and write the tleap bond commands to {rec}_sbond.lst (self.sbond_file).
+        :param disulfide_cache_path: (Optional) string, the directory caching the detected disulfide bonds. None to disable the cache.
+        :param receptor_split: (Optional) dictionary, the receptor split of an earlier run (see split()), e.g. from the receptor cache.
+                               The conversion, the disulfide detection and the scan are skipped.
+        """
         self.prepi_file = prepi_file
         self.ligand_format_pdb = ligand_format_pdb
         self.receptor_pdb = receptor_pdb
         self.rec_name_u = receptor_pdb.split(".")[0]
-        with open(self.receptor_pdb, "r") as file:
-            lines = file.readlines()
-        self.watline = next((i for i, line in enumerate(lines, 1) if ("HOH" in line or "WAT" in line) and ("HETATM" in line or "ATOM" in line)), None)
+        if receptor_split is not None:
+            self.receptor_pdb = receptor_split['receptor_pdb']
+            self.sbond_file = receptor_split['sbond_file']
+            self.watline = receptor_split['watline']
+            self.water_offset = receptor_split['water_offset']
+            self.clean_ranges = [tuple(clean_range) for clean_range in receptor_split['clean_ranges']]
+            self.receptor_size = receptor_split['receptor_size']
+            self.rec_size = receptor_split['rec_size']
+            return
+        if is_mmcif(receptor_pdb):
+            self.receptor_pdb = f"{self.rec_name_u}_from_cif.pdb"
+            cif_to_pdb(receptor_pdb, self.receptor_pdb)
+        self.sbond_file = None
+        if auto_disulfide:
+            self.prepare_disulfides(disulfide_cache_path)
+        self.watline = None # the line number of the first crystal water atom
+        self.water_offset = None # the byte offset of the first crystal water atom
+        self.clean_ranges = [] # (start, end) byte ranges without CONECT and blank lines
+        offset = 0
+        range_start = 0
+        with open(self.receptor_pdb, "rb") as file:
+            for i, line in enumerate(file, 1):
+                if self.watline is None and (b"HOH" in line or b"WAT" in line) and (b"HETATM" in line or b"ATOM" in line):
+                    self.watline = i
+                    self.water_offset = offset
+                    # Split the ranges at the water so that the receptor part can be copied on its own
+                    if range_start < offset:
+                        self.clean_ranges.append((range_start, offset))
+                    range_start = offset
+                if line.startswith(b"CONECT") or not line.strip():
+                    if range_start < offset:
+                        self.clean_ranges.append((range_start, offset))
+                    range_start = offset + len(line)
+                offset += len(line)
+        if range_start < offset:
+            self.clean_ranges.append((range_start, offset))
+        self.receptor_size = offset
+        self.rec_size = self.water_offset if self.water_offset is not None else self.receptor_size
+
+    def split(self):
+        """
+        Returns the receptor split: the processed receptor file, the disulfide bond file and the byte ranges of the receptor and the crystal waters.
+        """
+        return {'receptor_pdb': self.receptor_pdb, 'sbond_file': self.sbond_file, 'watline': self.watline, 'water_offset': self.water_offset,
+                'clean_ranges': self.clean_ranges, 'receptor_size': self.receptor_size, 'rec_size': self.rec_size}
+
+    def prepare_disulfides(self, cache_path=None):
+        """
+        Detects the disulfide bonds of the receptor and switches to the receptor with the bonded cysteines renamed to CYX.
+        """
+        detector = Disulfide_detector(self.receptor_pdb, cache_path=cache_path)
+        detector.detect()
+        detector.report()
+        if not detector.disulfides:
+            return
+        cyx_pdb = f"{self.rec_name_u}_cyx.pdb"
+        if detector.write_cyx_receptor(cyx_pdb):
+            print(f"Bonded cysteines renamed to CYX in {cyx_pdb}")
+            self.receptor_pdb = cyx_pdb
+        self.sbond_file = f"{self.rec_name_u}_sbond.lst"
+        detector.write_sbond_file(self.sbond_file)
+
+    def copy_receptor_ranges(self, dst_fd, ranges):
+        src_fd = os.open(self.receptor_pdb, os.O_RDONLY)
+        try:
+            for start, end in ranges:
+                copy_file_block(src_fd, dst_fd, start, end - start)
+        finally:
+            os.close(src_fd)
+
+    def write_pdb(self, pdb_name, parts):
+        """
+        Writes a pdb file from parts, each either a list of receptor byte ranges or bytes.
+        """
+        dst_fd = os.open(pdb_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            for part in parts:
+                if isinstance(part, bytes):
+                    os.write(dst_fd, part)
+                else:
+                    self.copy_receptor_ranges(dst_fd, part)
+        finally:
+            os.close(dst_fd)
+
+    def read_lig_pdb(self):
+        with open("lig.pdb", "rb") as file:
+            return file.read()
 
     def generate_lig_pdb(self):
         print("Generating lig.pdb")
@@ -18,38 +157,56 @@ class PDB_simple_processor:
 
     def generate_rec_pdb(self):
         print("Generating rec.pdb")
-        with open(self.receptor_pdb, "r") as file:
-            lines = file.readlines()
-        if self.watline:
-            with open("rec.pdb", "w") as file:
-                file.writelines(lines[:self.watline - 1])
-        else:
-            with open("rec.pdb", "w") as file:
-                file.writelines(lines)
+        self.write_pdb("rec.pdb", [[(0, self.rec_size)]])
 
     def generate_rec_lig_pdb(self):
         print("Generating rec-lig.pdb")
-        with open("rec-lig.pdb", "w") as outfile:
-            with open("rec.pdb", "r") as infile:
-                outfile.write(infile.read())
-            with open("lig.pdb", "r") as infile:
-                outfile.write(infile.read())
+        self.write_pdb("rec-lig.pdb", [[(0, self.rec_size)], self.read_lig_pdb()])
 
     def generate_combined_pdb(self):
+        """
+        Generates {rec}_MOL.pdb: the receptor, the ligand and the crystal waters, without CONECT and blank lines.
+        """
         combined_pdb_name = f"{self.rec_name_u}_MOL.pdb"
         print(f"Generating {combined_pdb_name}")
-        with open(combined_pdb_name, "w") as outfile:
-            with open("rec.pdb", "r") as infile:
-                outfile.write(infile.read())
-            with open("lig.pdb", "r") as infile:
-                outfile.write(infile.read())
-            with open(self.receptor_pdb, "r") as infile:
-                if self.watline:
-                    outfile.writelines(infile.readlines()[self.watline:])
-
-        # Removing lines starting with 'CONECT' and empty lines
-        with open(combined_pdb_name, "r") as file:
-            lines = file.readlines()
-        with open(combined_pdb_name, "w") as file:
-            file.writelines(line for line in lines if not line.startswith("CONECT") and line.strip())
+        lig_lines = self.read_lig_pdb().splitlines(keepends=True)
+        lig_pdb = b"".join(line for line in lig_lines if not line.startswith(b"CONECT") and line.strip())
+        rec_ranges = [(start, end) for start, end in self.clean_ranges if end <= self.rec_size]
+        water_ranges = [(start, end) for start, end in self.clean_ranges if start >= self.rec_size]
+        self.write_pdb(combined_pdb_name, [rec_ranges, lig_pdb, water_ranges])
+
+    def check_contacts(self, clash_distance=2.0, pocket_radius=5.0, pocket_file="pocket_residues.txt"):
+        """
+        Checks lig.pdb against rec.pdb before tleap: warns about steric clashes and writes the receptor residues within pocket_radius of the ligand.
+
+        :param clash_distance: (Optional) float, heavy atoms closer than this distance in Angstrom are reported as clashes.
+        :param pocket_radius: (Optional) float, the radius of the pocket residues in Angstrom.
+        :param pocket_file: (Optional) string, the output file of the pocket residues.
+        :return: list of the clashes, (ligand atom index, receptor atom index, distance).
+        """
+        lig_atoms = PDB_atoms.read("lig.pdb")
+        rec_atoms = PDB_atoms.read("rec.pdb")
+        clashes = find_clashes(lig_atoms, rec_atoms, clash_distance)
+        if clashes:
+            print(f"Warning: {len(clashes)} steric clashes between the ligand and the receptor:")
+            for i, j, distance in clashes[:20]:
+                print(f"  {lig_atoms.get('resname', i)}@{lig_atoms.get('name', i)} - {rec_atoms.get('resname', j)}{rec_atoms.resseq[j]}@{rec_atoms.get('name', j)}: {distance:.2f} A")
+        pocket = residues_within(lig_atoms, rec_atoms, pocket_radius)
+        with open(pocket_file, "w") as file:
+            file.write("chain\tresseq\tresname\n")
+            for chain, resseq, resname in pocket:
+                file.write(f"{chain}\t{resseq}\t{resname}\n")
+        print(f"{len(pocket)} receptor residues within {pocket_radius} A of the ligand, written to {pocket_file}")
+        return clashes
+
+    def generate_all(self, rec_pdb=True):
+        """
+        Generates lig.pdb, rec.pdb, rec-lig.pdb and {rec}_MOL.pdb.
 
+        :param rec_pdb: (Optional) bool, whether to generate rec.pdb, False when it is taken from the receptor cache.
+        """
+        self.generate_lig_pdb()
+        if rec_pdb:
+            self.generate_rec_pdb()
+        self.generate_rec_lig_pdb()
+        self.generate_combined_pdb()
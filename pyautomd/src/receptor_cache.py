@@ -0,0 +1,79 @@
+import os
+import json
+from .parameter_cache import Parameter_cache, file_key
+from .mmcif_reader import is_mmcif
+from .disulfide_detector import DISULFIDE_VERSION
+
+RECEPTOR_SPLIT_FILE = 'receptor_split.json'
+REC_FILES = ['rec.pdb', 'rec.prmtop', 'rec.prmcrd']
+REC_CACHE_SIZE = 2000 # MB
+
+
+class Receptor_cache():
+    """
+    Caches the ligand-independent receptor artifacts of the complex preparation: the processed receptor (mmCIF conversion, CYX renaming)
+    with its split into the receptor and the crystal waters, rec.pdb, and rec.prmtop/rec.prmcrd built by tleap.
+    The key is computed from the receptor content, the force fields and the external parameters, so that a ligand series
+    against one receptor prepares the receptor only once. The cached files are hard-linked into the working directory.
+    """
+    def __init__(self, cache_path, receptor_pdb, forcefields, external_amberparms, external_amberprep, external_directory,
+                 sbond_file=None, auto_disulfide=True, max_size_mb=REC_CACHE_SIZE):
+        """
+        Initializes the Receptor_cache class.
+
+        :param cache_path: string, the cache directory.
+        :param receptor_pdb: string, the receptor pdb or mmCIF file.
+        :param forcefields: list, the force fields sourced by tleap.
+        :param external_amberparms: list, the external frcmod files.
+        :param external_amberprep: list, the external prepi files.
+        :param external_directory: string, the directory of the external parameter files, their content is part of the key.
+        :param sbond_file: (Optional) string, the user supplied disulfide bond file.
+        :param auto_disulfide: (Optional) bool, whether the disulfide bonds are detected automatically.
+        :param max_size_mb: (Optional) float, the size cap of the cache in MB.
+        """
+        self.cache = Parameter_cache(cache_path, max_size_mb)
+        self.receptor_pdb = receptor_pdb
+        external = list(external_amberparms) + list(external_amberprep)
+        key_files = [receptor_pdb] + ([sbond_file] if sbond_file is not None else [])
+        key_files += [os.path.join(external_directory, name) for name in external if os.path.isfile(os.path.join(external_directory, name))]
+        self.key = file_key(key_files, receptor=os.path.basename(receptor_pdb), forcefields=list(forcefields), external=external,
+                            sbond_file=sbond_file is not None, auto_disulfide=bool(auto_disulfide),
+                            disulfide_version=DISULFIDE_VERSION)
+
+    def lookup(self):
+        """
+        Links the cached receptor artifacts into the working directory.
+
+        :return: dictionary, the receptor split for PDB_simple_processor, None on a cache miss.
+        """
+        files = self.cache.entry_files(self.key)
+        if not self.cache.lookup(self.key, files or [RECEPTOR_SPLIT_FILE], link=True):
+            return None
+        with open(RECEPTOR_SPLIT_FILE, 'r') as f:
+            split = json.load(f)
+        print(f"Receptor artifacts of {self.receptor_pdb} found in the cache (key {self.key[:12]}): {' '.join(files)}")
+        return split
+
+    def store(self, split):
+        """
+        Stores the receptor artifacts of the working directory, once tleap has built rec.prmtop.
+
+        :param split: dictionary, the receptor split, PDB_simple_processor.split().
+        :return: bool, False if an artifact is missing and nothing was stored.
+        """
+        files = [RECEPTOR_SPLIT_FILE] + REC_FILES
+        if split['receptor_pdb'] != self.receptor_pdb:
+            files.append(split['receptor_pdb'])
+        if is_mmcif(self.receptor_pdb) and os.path.isfile(f"{self.receptor_pdb.split('.')[0]}_from_cif.resmap"):
+            files.append(f"{self.receptor_pdb.split('.')[0]}_from_cif.resmap")
+        if split['sbond_file'] is not None:
+            files.append(split['sbond_file'])
+        missing = [name for name in files[1:] if not os.path.isfile(name) or os.path.getsize(name) == 0]
+        if missing:
+            print(f"Receptor artifacts not cached, missing {' '.join(missing)}")
+            return False
+        with open(RECEPTOR_SPLIT_FILE, 'w') as f:
+            json.dump(split, f, indent=1)
+        self.cache.store(self.key, files, label=os.path.basename(self.receptor_pdb))
+        print(f"Receptor artifacts of {self.receptor_pdb} stored in the cache (key {self.key[:12]}).")
+        return True
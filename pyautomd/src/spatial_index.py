@@ -0,0 +1,109 @@
+import math
+
+
+def is_hydrogen(name, element=''):
+    """
+    Returns True if the atom is a hydrogen, from the PDB element column or, failing that, from the atom name.
+    """
+    if element:
+        return element.upper() in ('H', 'D')
+    return name.lstrip('0123456789')[0:1] in ('H', 'D')
+
+
+class Cell_list():
+    """
+    A cell-list spatial index over flat x/y/z coordinates: the space is cut into cubic cells and every atom is stored in its cell,
+    so that the atoms within a radius of a point are found by visiting the neighbouring cells only.
+    Building the index and querying all atoms of a second structure scale linearly with the number of atoms.
+    """
+    def __init__(self, coords, cell_size):
+        """
+        Initializes the Cell_list class.
+
+        :param coords: flat sequence of coordinates, x/y/z interleaved, e.g. PDB_atoms.coords.
+        :param cell_size: float, the edge of the cells in Angstrom, best close to the typical query radius.
+        """
+        self.coords = coords
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        for i in range(len(coords) // 3):
+            self.cells.setdefault(self.cell_of(coords[3 * i], coords[3 * i + 1], coords[3 * i + 2]), []).append(i)
+
+    def cell_of(self, x, y, z):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size), math.floor(z / self.cell_size))
+
+    def query(self, x, y, z, radius):
+        """
+        Returns the atoms within radius of the point.
+
+        :return: list of (atom index, distance).
+        """
+        coords = self.coords
+        radius_sq = radius * radius
+        span = max(1, math.ceil(radius / self.cell_size))
+        cx, cy, cz = self.cell_of(x, y, z)
+        found = []
+        for ix in range(cx - span, cx + span + 1):
+            for iy in range(cy - span, cy + span + 1):
+                for iz in range(cz - span, cz + span + 1):
+                    for j in self.cells.get((ix, iy, iz), ()):
+                        d_sq = (coords[3 * j] - x) ** 2 + (coords[3 * j + 1] - y) ** 2 + (coords[3 * j + 2] - z) ** 2
+                        if d_sq <= radius_sq:
+                            found.append((j, math.sqrt(d_sq)))
+        return found
+
+    def pairs_within(self, coords, radius):
+        """
+        Returns the pairs of atoms of a second set of coordinates and of the index closer than radius.
+
+        :param coords: flat sequence of coordinates of the second set, x/y/z interleaved.
+        :return: list of (index in coords, index in the cell list, distance).
+        """
+        pairs = []
+        for i in range(len(coords) // 3):
+            for j, distance in self.query(coords[3 * i], coords[3 * i + 1], coords[3 * i + 2], radius):
+                pairs.append((i, j, distance))
+        return pairs
+
+
+def contact_list(lig_atoms, rec_atoms, cutoff=4.0):
+    """
+    Returns the ligand-receptor contacts.
+
+    :param lig_atoms: PDB_atoms object, the ligand.
+    :param rec_atoms: PDB_atoms object, the receptor.
+    :param cutoff: (Optional) float, the contact distance in Angstrom.
+    :return: list of (ligand atom index, receptor atom index, distance), sorted by distance.
+    """
+    index = Cell_list(rec_atoms.coords, cutoff)
+    return sorted(index.pairs_within(lig_atoms.coords, cutoff), key=lambda pair: pair[2])
+
+
+def find_clashes(lig_atoms, rec_atoms, clash_distance=2.0, hydrogen_clash_distance=1.2):
+    """
+    Returns the steric clashes between the ligand and the receptor: heavy atoms closer than clash_distance,
+    or pairs involving a hydrogen closer than hydrogen_clash_distance.
+
+    :return: list of (ligand atom index, receptor atom index, distance), sorted by distance.
+    """
+    lig_hydrogens = [is_hydrogen(name, element) for name, element in zip(lig_atoms.column('name'), lig_atoms.column('element'))]
+    rec_hydrogens = [is_hydrogen(name, element) for name, element in zip(rec_atoms.column('name'), rec_atoms.column('element'))]
+    clashes = []
+    for i, j, distance in contact_list(lig_atoms, rec_atoms, clash_distance):
+        if distance < (hydrogen_clash_distance if lig_hydrogens[i] or rec_hydrogens[j] else clash_distance):
+            clashes.append((i, j, distance))
+    return clashes
+
+
+def residues_within(lig_atoms, rec_atoms, radius=5.0):
+    """
+    Returns the receptor residues with at least one atom within radius of the ligand.
+
+    :return: list of (chain, residue number, residue name), in the order of the receptor.
+    """
+    chains = rec_atoms.column('chain')
+    resnames = rec_atoms.column('resname')
+    residues = {}
+    for _, j, _ in sorted(contact_list(lig_atoms, rec_atoms, radius), key=lambda pair: pair[1]):
+        residues[(chains[j], rec_atoms.resseq[j], resnames[j])] = None
+    return list(residues)
@@ -1,12 +1,52 @@
 import os
-import subprocess
+import re
 import shutil
 from .executable_checker import Executable_checker
+from .external_program_runner import get_runner
+from .parameter_cache import link_or_copy
 
 # TODO: add the copy operator to the class to copy the externel parameters files.
 
+UNIT_START_PATTERN = re.compile(r"^\s*([\w\-]+)\s*=\s*loadpdb\s", re.IGNORECASE)
+SAVEAMBERPARM_PATTERN = re.compile(r"^\s*saveamberparm\s+\S+\s+(\S+)\s+(\S+)", re.IGNORECASE)
+
+
+def split_tleap_units(lines):
+    """
+    Splits a tleap script into the shared preamble (force fields and parameters) and the independent build units,
+    a unit starting at a 'x = loadpdb' line and ending before the next one. The final quit is dropped.
+
+    :param lines: list of strings, the lines of the tleap script.
+    :return: (preamble lines, list of (unit name, unit lines)).
+    """
+    preamble = []
+    units = []
+    for line in lines:
+        match = UNIT_START_PATTERN.match(line)
+        if match:
+            units.append((match.group(1), [line]))
+        elif line.strip().lower() == 'quit':
+            continue
+        elif units:
+            units[-1][1].append(line)
+        else:
+            preamble.append(line)
+    return preamble, units
+
+
+def unit_sbond_lines(sbond_lines, unit):
+    """
+    Returns the bond commands of an sbond file, written for the solvated complex unit 'model', for another build unit.
+    The receptor comes first in every unit, so the residue numbers are the same.
+
+    :param sbond_lines: string, the content of the sbond file.
+    :param unit: string, the name of the build unit.
+    """
+    return re.sub(r"(?<![\w\-])model\.", f"{unit}.", sbond_lines)
+
 class Tleap_runner:
-    def __init__(self, automd_home, forcefields, external_amberparms, external_amberprep, rec_name_u, lig_name, boxtype, com_boxsize, lig_boxsize, sbond_file):
+    def __init__(self, automd_home, forcefields, external_amberparms, external_amberprep, rec_name_u, lig_name, boxtype, com_boxsize, lig_boxsize, sbond_file, lig_boxtype=None,
+                 com_pdb=None, lig_wat_pdb=None):
         self.automd_home = automd_home
         self.forcefields = forcefields # "leaprc.protein.ff14SB leaprc.water.tip3p leaprc.gaff leaprc.lipid17".split()
         self.external_amberparms = external_amberparms # "zn-mg.frcmod TPO.frcmod SO4.frcmod".split()
@@ -16,13 +56,16 @@ class Tleap_runner:
         self.boxtype = boxtype # "solvateoct" [solvatebox|solvateoct]
         self.com_boxsize = com_boxsize
         self.lig_boxsize = lig_boxsize
+        self.lig_boxtype = lig_boxtype or boxtype # the box of the solvated ligand, default: the box of the complex
         self.sbond_file = sbond_file # "sbond.lst_bypdb_preparer"
+        self.com_pdb = com_pdb or f"{rec_name_u}_MOL.pdb" # the solute of the solvated complex, e.g. rotated by the box optimizer
+        self.lig_wat_pdb = lig_wat_pdb or "lig.pdb" # the solute of the solvated ligand
         self.use_programs = ["tleap"]
         self.check_programs()
         self.copy_external_parameters()
 
     def copy_external_parameters(self):
-        """Copies external parameter and prep files to the current directory."""
+        """Links (or copies) external parameter and prep files to the current directory."""
         source_directory = os.path.join(self.automd_home, "src", "external_parameters")
 
         # Combine parameter and prep files into a single list
@@ -32,7 +75,7 @@ class Tleap_runner:
         for file in all_external_files:
             source_path = os.path.join(source_directory, file)
             if os.path.isfile(source_path):
-                shutil.copy(source_path, '.')
+                link_or_copy(source_path, os.path.basename(file))
             else:
                 print(f"Warning: File {file} not found in {source_directory}")
 
@@ -47,19 +90,65 @@ class Tleap_runner:
             else:
                 print(f"{program} is available in the system PATH and executable.")
 
-    def run_tleap(self, auto):
+    def run_tleap(self, auto, skip_units=()):
+        """
+        :param auto: bool, whether to generate tleap.txt from the template. The generated script is run as concurrent build units,
+                     a user supplied tleap.txt is run as it is.
+        :param skip_units: (Optional) iterable of strings, the units not to be built, e.g. 'rec' when its files are taken from a cache.
+        """
         if not auto:
             self.run_tleap_direct()
         else:
             self.generate_tleap_file()
-            self.run_tleap_direct()
+            self.run_tleap_units(skip_units)
+
+    def run_tleap_units(self, skip_units=()):
+        """
+        Runs the independent build units of tleap.txt (the solvated complex, rec-lig, rec, lig_wat and lig) as concurrent tleap processes
+        sharing the preamble of tleap.txt. Each unit writes tleap-{unit}.in and tleap-{unit}.log, the logs are joined into tleap.log.
+        The units run in the same directory, so each unit switches the leap log to tleap-{unit}.leaplog before anything else,
+        instead of appending to the shared leap.log.
+        """
+        print("Running tleap build units in parallel, please wait...")
+        with open("tleap.txt", "r") as file:
+            preamble, units = split_tleap_units(file.readlines())
+        units = [(name, lines) for name, lines in units if name not in skip_units]
+        calls = []
+        expected = {}
+        for name, lines in units:
+            with open(f"tleap-{name}.in", "w") as file:
+                file.writelines([f"logFile tleap-{name}.leaplog\n"] + preamble + lines + ["quit\n"])
+            calls.append((["tleap", "-f", f"tleap-{name}.in"], {'name': 'tleap', 'stdout': f"tleap-{name}.log"}))
+            expected[name] = [match.group(1) for match in map(SAVEAMBERPARM_PATTERN.match, lines) if match]
+        records = get_runner().run_many(calls)
+        failed = []
+        with open("tleap.log", "w") as log:
+            for (name, _), record in zip(units, records):
+                log.write(f"# ===== tleap unit {name} =====\n")
+                if os.path.isfile(f"tleap-{name}.log"):
+                    with open(f"tleap-{name}.log", "r") as unit_log:
+                        shutil.copyfileobj(unit_log, log)
+                missing = [prmtop for prmtop in expected[name] if not os.path.isfile(prmtop) or os.path.getsize(prmtop) == 0]
+                if not record.success or missing:
+                    failed.append(name)
+                    print(f"tleap unit {name} failed: {record}" + (f", missing {' '.join(missing)}" if missing else '') + f", see tleap-{name}.log")
+        # The topologies of every unit are outputs of the stage, a failed unit stops it as a missing {rec}.prmtop does
+        if os.path.isfile(f"{self.rec_name_u}.prmtop") and os.path.getsize(f"{self.rec_name_u}.prmtop") > 0 and not failed:
+            print("tleap success")
+        else:
+            if failed:
+                print(f"tleap units {' '.join(failed)} failed")
+            print("tleap error")
+            exit(0)
 
     def run_tleap_direct(self):
         print("Running tleap, please wait...")
         # Check if tleap.txt exists
         if os.path.isfile("tleap.txt"):
             # Run tleap if the file exists
-            subprocess.run(["tleap", "-f", "tleap.txt"], stdout=open("tleap.log", "w"))
+            record = get_runner().run(["tleap", "-f", "tleap.txt"], stdout="tleap.log")
+            if not record.success:
+                print(f"An error occurred while running tleap: {record}")
             # Check if output file exists and is not empty
             if os.path.isfile(f"{self.rec_name_u}.prmtop"):
                 print("tleap success")
@@ -88,23 +177,28 @@ class Tleap_runner:
         # Replace placeholders in template and append to tleap.txt
         with open(os.path.join(self.automd_home, 'src', 'template_files', 'tleap.template'), "r") as template_file, open("tleap.txt", "a") as file:
             for line in template_file:
+                line = line.replace("_COM_PDB_", self.com_pdb).replace("_LIG_WAT_PDB_", self.lig_wat_pdb)
                 line = line.replace("_rec_name_u_", self.rec_name_u).replace("_rec_name_l_", self.rec_name_u)
+                line = line.replace("_LIG_BOXTYPE_", self.lig_boxtype).replace("_LIG_BOXSIZE_", str(self.lig_boxsize))
                 line = line.replace("_BOXTYPE_", self.boxtype).replace("_COM_BOXSIZE_", str(self.com_boxsize))
-                line = line.replace("_BOXTYPE_", self.boxtype).replace("_LIG_BOXSIZE_", str(self.lig_boxsize))
                 file.write(line)
 
 
         if self.sbond_file is not None:
             with open(self.sbond_file, "r") as file:
                 sbond_line = file.read()
-        # Placeholder replacement for sbonds
+        # Placeholder replacement for sbonds, in the solvated complex and in the rec-lig and rec units
         with open("tleap.txt", "r") as file:
             lines = file.readlines()
         with open("tleap.txt", "w") as file:
+            unit = None
             for line in lines:
+                match = UNIT_START_PATTERN.match(line)
+                if match:
+                    unit = match.group(1)
                 if "_SBOND_LINE_" in line:
                     if self.sbond_file is not None:
-                        file.write(sbond_line)
+                        file.write(unit_sbond_lines(sbond_line, unit))
                     else:
                         file.write("\n")
                 else:
@@ -0,0 +1,380 @@
+import os
+import sys
+import gzip
+import json
+import zlib
+import array
+import struct
+from optparse import OptionParser
+from .prmtop_reader import Prmtop_reader
+from .netcdf_reader import Netcdf_reader, STREAMING
+
+# POINTERS entries changed by stripping
+NATOM, NBONH, MBONA, NTHETH, MTHETA, NPHIH, MPHIA, NNB, NRES, NBONA, NTHETA, NPHIA, IFBOX, NMXRS = 0, 2, 3, 4, 5, 6, 7, 10, 11, 12, 13, 14, 27, 28
+PER_ATOM_SECTIONS = ('ATOM_NAME', 'CHARGE', 'ATOMIC_NUMBER', 'MASS', 'ATOM_TYPE_INDEX', 'NUMBER_EXCLUDED_ATOMS', 'AMBER_ATOM_TYPE',
+                     'TREE_CHAIN_CLASSIFICATION', 'JOIN_ARRAY', 'IROTAT', 'RADII', 'SCREEN', 'POLARIZABILITY')
+PER_RESIDUE_SECTIONS = ('RESIDUE_LABEL', 'RESIDUE_NUMBER', 'RESIDUE_CHAINID', 'RESIDUE_ICODE')
+# section -> (entry length, number of atom indices per entry)
+TERM_SECTIONS = {'BONDS_INC_HYDROGEN': (3, 2), 'BONDS_WITHOUT_HYDROGEN': (3, 2), 'ANGLES_INC_HYDROGEN': (4, 3), 'ANGLES_WITHOUT_HYDROGEN': (4, 3),
+                 'DIHEDRALS_INC_HYDROGEN': (5, 4), 'DIHEDRALS_WITHOUT_HYDROGEN': (5, 4)}
+BOX_SECTIONS = ('SOLVENT_POINTERS', 'ATOMS_PER_MOLECULE', 'BOX_DIMENSIONS', 'CAP_INFO', 'CAP_INFO2')
+ZQT_MAGIC = b'PYAMDZQ1'
+
+
+def kept_residues(prmtop, keep_ions=False):
+    """
+    Returns the 1-based numbers of the residues kept by the compaction: everything but the waters and, unless keep_ions, the counter ions.
+    """
+    kinds = prmtop.classify_residues()
+    stripped = set(kinds['water']) | (set() if keep_ions else set(kinds['ion']))
+    return [number for number in range(1, prmtop.n_residues + 1) if number not in stripped]
+
+
+def strip_prmtop(prmtop, residues, output_file):
+    """
+    Writes the topology of the kept residues without the periodic box: the per-atom and per-residue sections are subset,
+    the bonded terms and the excluded atoms are renumbered. The force field parameter tables are copied unchanged.
+
+    :param prmtop: Prmtop_reader object, the solvated topology.
+    :param residues: list, the 1-based numbers of the kept residues.
+    :param output_file: string, the stripped prmtop file.
+    """
+    atom_ranges = prmtop.atom_ranges(residues)
+    kept = [atom for first, last in atom_ranges for atom in range(first - 1, last)]
+    new_index = array.array('l', [-1]) * prmtop.n_atoms
+    for new, old in enumerate(kept):
+        new_index[old] = new
+    replacements = {}
+    for flag in PER_ATOM_SECTIONS:
+        if prmtop.has_section(flag):
+            values = prmtop.section(flag)
+            replacements[flag] = [values[old] for old in kept]
+    residue_ranges = prmtop.residue_atom_ranges()
+    for flag in PER_RESIDUE_SECTIONS:
+        if prmtop.has_section(flag):
+            values = prmtop.section(flag)
+            replacements[flag] = [values[number - 1] for number in residues]
+    pointers = []
+    for number in residues:
+        pointers.append(new_index[residue_ranges[number - 1][0] - 1] + 1)
+    replacements['RESIDUE_POINTER'] = pointers
+    for flag, (length, n_indices) in TERM_SECTIONS.items():
+        values = prmtop.section(flag)
+        terms = []
+        for k in range(0, len(values), length):
+            entry = values[k:k + length]
+            # The atoms are coordinate indices 3 * (atom - 1), the sign of the 3rd and 4th dihedral atom carries a flag
+            atoms = [new_index[abs(index) // 3] for index in entry[:n_indices]]
+            if min(atoms) < 0:
+                continue
+            terms.extend((3 * atom if index >= 0 else -3 * atom) for atom, index in zip(atoms, entry[:n_indices]))
+            terms.append(entry[n_indices])
+        replacements[flag] = terms
+    if prmtop.has_section('CMAP_INDEX'):
+        values = prmtop.section('CMAP_INDEX')
+        cmaps = []
+        for k in range(0, len(values), 6):
+            atoms = [new_index[index - 1] for index in values[k:k + 5]]
+            if min(atoms) >= 0:
+                cmaps.extend([atom + 1 for atom in atoms] + [values[k + 5]])
+        replacements['CMAP_INDEX'] = cmaps
+        if prmtop.has_section('CMAP_COUNT'):
+            replacements['CMAP_COUNT'] = [len(cmaps) // 6] + prmtop.section('CMAP_COUNT')[1:]
+    counts = prmtop.section('NUMBER_EXCLUDED_ATOMS')
+    excluded = prmtop.section('EXCLUDED_ATOMS_LIST')
+    new_excluded = []
+    new_counts = []
+    position = 0
+    starts = []
+    for count in counts:
+        starts.append(position)
+        position += count
+    for old in kept:
+        atoms = [new_index[index - 1] + 1 for index in excluded[starts[old]:starts[old] + counts[old]] if index > 0 and new_index[index - 1] >= 0]
+        atoms = atoms or [0] # an atom without exclusions lists a single 0
+        new_excluded.extend(atoms)
+        new_counts.append(len(atoms))
+    replacements['NUMBER_EXCLUDED_ATOMS'] = new_counts
+    replacements['EXCLUDED_ATOMS_LIST'] = new_excluded
+    old_pointers = prmtop.section('POINTERS')
+    new_pointers = list(old_pointers)
+    new_pointers[NATOM] = len(kept)
+    new_pointers[NBONH] = len(replacements['BONDS_INC_HYDROGEN']) // 3
+    new_pointers[MBONA] = len(replacements['BONDS_WITHOUT_HYDROGEN']) // 3
+    new_pointers[NTHETH] = len(replacements['ANGLES_INC_HYDROGEN']) // 4
+    new_pointers[MTHETA] = len(replacements['ANGLES_WITHOUT_HYDROGEN']) // 4
+    new_pointers[NPHIH] = len(replacements['DIHEDRALS_INC_HYDROGEN']) // 5
+    new_pointers[MPHIA] = len(replacements['DIHEDRALS_WITHOUT_HYDROGEN']) // 5
+    # NBONA, NTHETA and NPHIA also count the constraint terms
+    new_pointers[NBONA] = new_pointers[MBONA] + old_pointers[NBONA] - old_pointers[MBONA]
+    new_pointers[NTHETA] = new_pointers[MTHETA] + old_pointers[NTHETA] - old_pointers[MTHETA]
+    new_pointers[NPHIA] = new_pointers[MPHIA] + old_pointers[NPHIA] - old_pointers[MPHIA]
+    new_pointers[NNB] = len(new_excluded)
+    new_pointers[NRES] = len(residues)
+    new_pointers[IFBOX] = 0
+    new_pointers[NMXRS] = max((residue_ranges[number - 1][1] - residue_ranges[number - 1][0] + 1 for number in residues), default=0)
+    replacements['POINTERS'] = new_pointers
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    prmtop.write(tmp_file, replacements, remove=BOX_SECTIONS)
+    os.replace(tmp_file, output_file)
+    return atom_ranges
+
+
+def iter_mdcrd_frames(mdcrd_file, n_atoms, has_box):
+    """
+    Yields (frame, time, coordinates) of an ASCII trajectory (10F8.3, optionally gzipped), one frame in memory at a time.
+    The time is not stored in the format, the frame number is returned instead.
+    """
+    opener = gzip.open if mdcrd_file.endswith('.gz') else open
+    n_values = 3 * n_atoms
+    n_lines = (n_values + 9) // 10
+    with opener(mdcrd_file, 'rt') as f:
+        f.readline() # title
+        frame = 0
+        while True:
+            lines = [f.readline() for _ in range(n_lines)]
+            if not lines[-1]:
+                return
+            coords = array.array('d', (float(line[k:k + 8]) for line in lines for k in range(0, len(line.rstrip('\r\n')), 8)))
+            if len(coords) != n_values:
+                raise ValueError(f"{mdcrd_file}: frame {frame} has {len(coords)} values instead of {n_values}.")
+            if has_box:
+                f.readline()
+            yield frame, float(frame), coords
+            frame += 1
+
+
+def iter_netcdf_frames(nc_file):
+    with Netcdf_reader(nc_file) as nc:
+        has_time = 'time' in nc.variables
+        for frame, coords in nc.iter_frames('coordinates'):
+            yield frame, (nc.read('time', frame)[0] if has_time else float(frame)), coords
+
+
+def nc_name(name):
+    data = name.encode()
+    return struct.pack('>i', len(data)) + data + b'\0' * ((-len(data)) % 4)
+
+
+def nc_text_attribute(name, text):
+    data = text.encode()
+    return nc_name(name) + struct.pack('>ii', 2, len(data)) + data + b'\0' * ((-len(data)) % 4)
+
+
+class Amber_netcdf_writer():
+    """
+    Writes an Amber NetCDF trajectory (NetCDF-3 classic, float coordinates), streaming the frames.
+    The number of frames in the header is only set when the file is closed, until then it reads as streaming.
+    """
+    def __init__(self, nc_file, n_atoms, title=''):
+        self.nc_file = nc_file
+        self.n_atoms = n_atoms
+        self.n_frames = 0
+        self.file = open(nc_file, 'wb')
+        header = self.header(0, 0)
+        spatial_begin = len(header)
+        time_begin = spatial_begin + 4
+        self.file.write(self.header(spatial_begin, time_begin) + b'xyz\0')
+
+    def header(self, spatial_begin, time_begin):
+        header = b'CDF\x01' + struct.pack('>I', STREAMING)
+        header += struct.pack('>ii', 10, 3) + nc_name('frame') + struct.pack('>i', 0) + nc_name('spatial') + struct.pack('>i', 3) \
+                  + nc_name('atom') + struct.pack('>i', self.n_atoms)
+        header += struct.pack('>ii', 12, 4) + nc_text_attribute('Conventions', 'AMBER') + nc_text_attribute('ConventionVersion', '1.0') \
+                  + nc_text_attribute('program', 'pyautomd') + nc_text_attribute('title', 'stripped trajectory')
+        header += struct.pack('>ii', 11, 3)
+        header += nc_name('spatial') + struct.pack('>ii', 1, 1) + struct.pack('>ii', 0, 0) + struct.pack('>iII', 2, 4, spatial_begin)
+        header += nc_name('time') + struct.pack('>ii', 1, 0) + struct.pack('>ii', 12, 1) + nc_text_attribute('units', 'picosecond') \
+                  + struct.pack('>iII', 5, 4, time_begin)
+        header += nc_name('coordinates') + struct.pack('>iiii', 3, 0, 2, 1) + struct.pack('>ii', 12, 1) + nc_text_attribute('units', 'angstrom') \
+                  + struct.pack('>iII', 5, 12 * self.n_atoms, time_begin + 4)
+        return header
+
+    def write_frame(self, time, coords):
+        values = array.array('f', coords)
+        if sys.byteorder == 'little':
+            values.byteswap()
+        self.file.write(struct.pack('>f', time) + values.tobytes())
+        self.n_frames += 1
+
+    def close(self):
+        self.file.seek(4)
+        self.file.write(struct.pack('>I', self.n_frames))
+        self.file.close()
+
+
+class Zqt_writer():
+    """
+    Writes a quantized and compressed trajectory (.zqt): the coordinates are rounded to multiples of the precision, stored as integers,
+    delta-encoded between the frames of a chunk and zlib-compressed chunk by chunk.
+    Layout: magic, header length (uint32), JSON header, then per chunk: frame count, compressed size (uint32), the times (float64)
+    and the compressed int32 values.
+    """
+    def __init__(self, zqt_file, n_atoms, precision, chunk_frames=100, source=''):
+        self.zqt_file = zqt_file
+        self.n_atoms = n_atoms
+        self.precision = float(precision)
+        self.chunk_frames = chunk_frames
+        self.times = []
+        self.values = array.array('i')
+        self.previous = None
+        self.file = open(zqt_file, 'wb')
+        header = json.dumps({'n_atoms': n_atoms, 'precision': self.precision, 'chunk_frames': chunk_frames, 'source': source}).encode()
+        self.file.write(ZQT_MAGIC + struct.pack('>I', len(header)) + header)
+
+    def write_frame(self, time, coords):
+        scale = 1.0 / self.precision
+        quantized = array.array('i', (int(round(value * scale)) for value in coords))
+        if self.previous is None:
+            self.values.extend(quantized)
+        else:
+            self.values.extend(array.array('i', (a - b for a, b in zip(quantized, self.previous))))
+        self.previous = quantized
+        self.times.append(time)
+        if len(self.times) >= self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        if not self.times:
+            return
+        values = self.values
+        if sys.byteorder == 'little':
+            values.byteswap()
+        compressed = zlib.compress(values.tobytes(), 6)
+        self.file.write(struct.pack('>II', len(self.times), len(compressed)) + struct.pack(f">{len(self.times)}d", *self.times) + compressed)
+        self.times = []
+        self.values = array.array('i')
+        self.previous = None # every chunk starts with absolute values
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def iter_zqt_frames(zqt_file):
+    """
+    Yields (time, coordinates) of a .zqt trajectory, one chunk in memory at a time.
+    """
+    with open(zqt_file, 'rb') as f:
+        if f.read(len(ZQT_MAGIC)) != ZQT_MAGIC:
+            raise ValueError(f"{zqt_file} is not a zqt trajectory.")
+        header = json.loads(f.read(struct.unpack('>I', f.read(4))[0]))
+        n_values = 3 * header['n_atoms']
+        while True:
+            chunk_head = f.read(8)
+            if len(chunk_head) < 8:
+                return
+            n_frames, size = struct.unpack('>II', chunk_head)
+            times = struct.unpack(f">{n_frames}d", f.read(8 * n_frames))
+            values = array.array('i')
+            values.frombytes(zlib.decompress(f.read(size)))
+            if sys.byteorder == 'little':
+                values.byteswap()
+            current = None
+            for k, time in enumerate(times):
+                frame = values[k * n_values:(k + 1) * n_values]
+                current = frame if current is None else array.array('i', (a + b for a, b in zip(current, frame)))
+                yield time, array.array('d', (value * header['precision'] for value in current))
+
+
+class Trajectory_compactor():
+    """
+    Compacts production trajectories for analysis: the frames are streamed one at a time, the waters and counter ions are removed
+    using the residue ranges of the prmtop, a stride is applied, and the kept atoms are written as an Amber NetCDF trajectory
+    or, with a precision, as quantized zlib-compressed chunks. A matching stripped topology is written as well.
+    """
+    def __init__(self, prmtop_file, stride=1, precision=None, chunk_frames=100, keep_ions=False):
+        """
+        Initializes the Trajectory_compactor class.
+
+        :param prmtop_file: string, the solvated topology of the trajectories.
+        :param stride: (Optional) int, every stride-th frame is kept.
+        :param precision: (Optional) float, the quantization step in Angstrom, e.g. 0.01. None for float NetCDF output.
+        :param chunk_frames: (Optional) int, the frames per compressed chunk.
+        :param keep_ions: (Optional) bool, whether to keep the counter ions.
+        """
+        self.prmtop_file = prmtop_file
+        self.stride = max(1, int(stride))
+        self.precision = precision
+        self.chunk_frames = chunk_frames
+        with Prmtop_reader(prmtop_file) as prmtop:
+            self.n_atoms = prmtop.n_atoms
+            self.has_box = prmtop.section('POINTERS')[IFBOX] > 0
+            self.residues = kept_residues(prmtop, keep_ions)
+            self.atom_ranges = prmtop.atom_ranges(self.residues)
+        self.n_kept = sum(last - first + 1 for first, last in self.atom_ranges)
+
+    def write_topology(self, output_file):
+        with Prmtop_reader(self.prmtop_file) as prmtop:
+            strip_prmtop(prmtop, self.residues, output_file)
+        print(f"Stripped topology written to {output_file}: {self.n_kept} of {self.n_atoms} atoms")
+
+    def strip(self, coords):
+        kept = array.array(coords.typecode)
+        for first, last in self.atom_ranges:
+            kept.extend(coords[3 * (first - 1):3 * last])
+        return kept
+
+    def compact(self, trajectory, output_file):
+        """
+        Streams the trajectory (NetCDF, or ASCII mdcrd, optionally gzipped) into the compact output file.
+
+        :return: int, the number of written frames.
+        """
+        if trajectory.endswith('.nc'):
+            frames = iter_netcdf_frames(trajectory)
+        else:
+            frames = iter_mdcrd_frames(trajectory, self.n_atoms, self.has_box)
+        tmp_file = f"{output_file}.{os.getpid()}.tmp"
+        if self.precision:
+            writer = Zqt_writer(tmp_file, self.n_kept, self.precision, self.chunk_frames, source=os.path.basename(trajectory))
+        else:
+            writer = Amber_netcdf_writer(tmp_file, self.n_kept)
+        written = 0
+        try:
+            for frame, time, coords in frames:
+                if len(coords) != 3 * self.n_atoms:
+                    raise ValueError(f"{trajectory} has {len(coords) // 3} atoms, {self.prmtop_file} has {self.n_atoms}.")
+                if frame % self.stride:
+                    continue
+                writer.write_frame(time, self.strip(coords))
+                written += 1
+        finally:
+            writer.close()
+        os.replace(tmp_file, output_file)
+        in_size = os.path.getsize(trajectory)
+        out_size = os.path.getsize(output_file)
+        print(f"{trajectory} -> {output_file}: {written} frames of {self.n_kept} atoms, {in_size / 1048576:.1f} MB -> {out_size / 1048576:.1f} MB")
+        return written
+
+
+def main():
+    parser = OptionParser(usage="%prog -p solvated.prmtop -y trajectory [-o output] [options]\n"
+                                "Strips the waters and counter ions of a trajectory frame by frame, applies a stride, and writes a compact trajectory and topology.")
+    parser.add_option('-p', '--prmtop', dest='prmtop', help="The solvated topology of the trajectory.")
+    parser.add_option('-y', '--trajectory', dest='trajectory', help="The trajectory, NetCDF (.nc) or ASCII (.mdcrd, .mdcrd.gz).")
+    parser.add_option('-o', '--output', dest='output', default=None,
+                      help="The compact trajectory. Default: <trajectory>-strip.nc, or -strip.zqt with --precision")
+    parser.add_option('-s', '--strip-prmtop', dest='strip_prmtop', default=None,
+                      help="The stripped topology, written if it does not exist yet. Default: <prmtop>-strip.prmtop")
+    parser.add_option('--stride', dest='stride', type='int', default=1, help="Keep every n-th frame. Default: 1")
+    parser.add_option('--precision', dest='precision', type='float', default=None,
+                      help="Quantize the coordinates to this step in Angstrom and compress them in chunks (.zqt). Default: float NetCDF")
+    parser.add_option('--chunk', dest='chunk', type='int', default=100, help="Frames per compressed chunk. Default: 100")
+    parser.add_option('--keep-ions', dest='keep_ions', action='store_true', default=False, help="Keep the counter ions.")
+    options, _ = parser.parse_args()
+    if not options.prmtop or not options.trajectory:
+        parser.error("the prmtop and the trajectory are required")
+    base = options.trajectory
+    for ext in ('.gz', '.nc', '.mdcrd'):
+        base = base[:-len(ext)] if base.endswith(ext) else base
+    output = options.output or f"{base}-strip.{'zqt' if options.precision else 'nc'}"
+    strip_prmtop_file = options.strip_prmtop or f"{os.path.splitext(options.prmtop)[0]}-strip.prmtop"
+    compactor = Trajectory_compactor(options.prmtop, options.stride, options.precision, options.chunk, options.keep_ions)
+    if not os.path.isfile(strip_prmtop_file):
+        compactor.write_topology(strip_prmtop_file)
+    compactor.compact(options.trajectory, output)
+
+
+if __name__ == '__main__':
+    main()
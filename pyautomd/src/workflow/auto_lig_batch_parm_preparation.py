@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import shutil
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import auto_lig_parm_preparation
+from ..external_program_runner import get_runner, configure_runner
+from ..nonstandard_residue_preparation import gaussian_scheduler
+
+
+def read_ligand_library(ligand_library, lig_resname, lig_net_charge):
+    """
+    Reads the ligands of a library.
+
+    :param ligand_library: string, a directory of ligand pdb files, or a manifest file with one 'ligand_pdb [resname] [net_charge]' per line.
+    :param lig_resname: string, the default ligand residue name.
+    :param lig_net_charge: int, the default net charge of the ligands.
+    :return: list of (name, ligand pdb path, residue name, net charge).
+    """
+    ligands = []
+    if os.path.isdir(ligand_library):
+        for filename in sorted(os.listdir(ligand_library)):
+            if filename.lower().endswith('.pdb'):
+                ligands.append((os.path.join(ligand_library, filename), lig_resname, lig_net_charge))
+    elif os.path.isfile(ligand_library):
+        manifest_dir = os.path.dirname(os.path.abspath(ligand_library))
+        with open(ligand_library, 'r') as f:
+            for line in f:
+                fields = line.split('#')[0].split()
+                if not fields:
+                    continue
+                pdb = fields[0] if os.path.isabs(fields[0]) else os.path.join(manifest_dir, fields[0])
+                resname = fields[1] if len(fields) > 1 else lig_resname
+                net_charge = int(fields[2]) if len(fields) > 2 else lig_net_charge
+                ligands.append((pdb, resname, net_charge))
+    else:
+        raise FileNotFoundError(f"Ligand library {ligand_library} not found.")
+
+    # Give every ligand a unique working directory name
+    jobs = []
+    used_names = set()
+    for pdb, resname, net_charge in ligands:
+        name = os.path.splitext(os.path.basename(pdb))[0]
+        unique_name = name
+        i = 1
+        while unique_name in used_names:
+            unique_name = f"{name}_{i}"
+            i += 1
+        used_names.add(unique_name)
+        jobs.append((unique_name, os.path.abspath(pdb), resname, net_charge))
+    return jobs
+
+
+def run_one_ligand(name, ligand_pdb, workdir, lig_resname, lig_net_charge, kwargs, gaussian_stage='all'):
+    """
+    Runs the ligand parameters preparation of one ligand in its own working directory.
+    The output of the pipeline and of the external programs is appended to pyautomd.log in the working directory.
+
+    :param gaussian_stage: (Optional) string, the stage of auto_lig_parm_preparation.main, 'all', 'prepare' or 'finish'.
+    :return: dictionary, the name, status, elapsed time and message of the ligand, and the gaussian job of the 'prepare' stage.
+    """
+    start = time.time()
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if gaussian_stage != 'finish':
+        shutil.copy(ligand_pdb, os.path.basename(ligand_pdb))
+    status, message, gaussian_job = 'failed', '', None
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = (os.dup(1), os.dup(2))
+    with open('pyautomd.log', 'w' if gaussian_stage != 'finish' else 'a') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            gaussian_job = auto_lig_parm_preparation.main(input_lig_pdb=os.path.basename(ligand_pdb), lig_resname=lig_resname, lig_net_charge=lig_net_charge,
+                                                          gaussian_stage=gaussian_stage, **kwargs)
+            if os.path.exists(f"{lig_resname}.prepi") and os.path.exists(f"{lig_resname}.frcmod"):
+                status = 'success'
+            elif gaussian_job is not None:
+                status = 'gaussian'
+            else:
+                message = 'prepi or frcmod file not generated'
+        except SystemExit as e:
+            message = f"pipeline exited ({e.code})"
+        except Exception as e:
+            traceback.print_exc()
+            message = f"{type(e).__name__}: {e}"
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
+    return {'name': name, 'status': status, 'elapsed': time.time() - start, 'message': message, 'workdir': workdir, 'gaussian_job': gaussian_job}
+
+
+def worker_pool(batch_workers):
+    """
+    Returns the pool of worker processes. The CPU budget of the shared runner is split between the workers,
+    so that the programs of all ligands together stay within the budget of the node.
+    The number of workers is limited to the CPU budget, every worker gets at least one CPU.
+    """
+    runner = get_runner()
+    batch_workers = max(1, min(int(batch_workers), runner.max_cpus))
+    worker_cpus = max(1, runner.max_cpus // batch_workers)
+    return ProcessPoolExecutor(max_workers=batch_workers, initializer=configure_runner, initargs=(worker_cpus, runner.timeouts))
+
+
+def run_ligands(jobs, batch_output_dir, batch_workers, kwargs, gaussian_stage='all'):
+    """
+    Runs one stage of the ligand parameters preparation for the ligands on a pool of worker processes.
+
+    :param jobs: list of (name, ligand pdb path, residue name, net charge).
+    :return: dictionary, ligand name -> the result of run_one_ligand.
+    """
+    results = {}
+    with worker_pool(batch_workers) as executor:
+        futures = [executor.submit(run_one_ligand, name, pdb, os.path.join(batch_output_dir, name), resname, net_charge, kwargs, gaussian_stage)
+                   for name, pdb, resname, net_charge in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['name']] = result
+            if result['status'] != 'gaussian':
+                print(f"[{len(results)}/{len(jobs)}] {result['name']}: {result['status']} ({result['elapsed']:.1f} s) {result['message']}")
+    return results
+
+
+def main(forcefield_needed, ligand_library, lig_resname, charge_model='bcc', lig_net_charge=0, gaussian_scr_path=None, gaussian_excute=None, ligifopt=False,
+            batch_workers=4, batch_output_dir='batch', parm_cache_path=None, parm_cache_size=500, extra_formats=None, gaussian_total_mem=None, gaussian_restart=False, resp_engine='resp',
+            ):
+    """
+    The workflow of the ligand parameters preparation for a whole ligand library.
+    Each ligand runs the auto_lig_parm_preparation workflow in its own working directory, and the ligands are distributed over a pool of worker processes.
+    With the resp charge model the workflow runs in three stages: the gaussian inputs of all ligands are prepared by the pool,
+    then all gaussian jobs are packed onto the cores and memory of the node by the Gaussian_job_scheduler, then the pool generates the parameters.
+
+    :param forcefield_needed: dictioanry, the forcefield needed for the system.
+    :param ligand_library: string, a directory of ligand pdb files, or a manifest file with one 'ligand_pdb [resname] [net_charge]' per line.
+    :param lig_resname: string, the default ligand residue name.
+    :param charge_model: string, the charge model, 'bcc' or 'resp'.
+    :param lig_net_charge: int, the default net charge of the ligands.
+    :param gaussian_scr_path: string, the path of the gaussian scratch.
+    :param gaussian_excute: string, the excute file of the gaussian.
+    :param ligifopt: bool, whether to optimize the ligand structure.
+    :param batch_workers: int, the number of worker processes.
+    :param batch_output_dir: string, the directory holding the working directories of the ligands.
+    :param parm_cache_path: string, the directory of the parameter cache. None to disable the cache.
+    :param parm_cache_size: float, the size cap of the parameter cache in MB.
+    :param extra_formats: list, additional output formats of the ligand parameters, 'mol2' and/or 'lib'.
+    :param gaussian_total_mem: int, the memory in MB available to the gaussian jobs. None for 80% of the physical memory.
+    :param gaussian_restart: bool, whether to resume failed or interrupted gaussian runs from their checkpoint files.
+    :param resp_engine: string, the RESP fitting engine, 'resp' (the resp program), 'native' (in-process, requires numpy) or 'validate' (both, compared).
+    """
+    jobs = read_ligand_library(ligand_library, lig_resname, lig_net_charge)
+    if not jobs:
+        print(f"No ligand found in {ligand_library}.")
+        sys.exit()
+    batch_output_dir = os.path.abspath(batch_output_dir)
+    os.makedirs(batch_output_dir, exist_ok=True)
+    if gaussian_scr_path is not None:
+        gaussian_scr_path = os.path.abspath(gaussian_scr_path)
+    if parm_cache_path is not None:
+        parm_cache_path = os.path.abspath(parm_cache_path)
+    kwargs = {
+        'forcefield_needed': forcefield_needed,
+        'charge_model': charge_model,
+        'gaussian_scr_path': gaussian_scr_path,
+        'gaussian_excute': gaussian_excute,
+        'ligifopt': ligifopt,
+        'parm_cache_path': parm_cache_path,
+        'parm_cache_size': parm_cache_size,
+        'extra_formats': extra_formats,
+        'resp_engine': resp_engine,
+    }
+    print(f"Preparing the parameters of {len(jobs)} ligands with {batch_workers} worker processes, please wait...")
+    start = time.time()
+    if charge_model != 'resp':
+        results = run_ligands(jobs, batch_output_dir, batch_workers, kwargs)
+    else:
+        results = run_ligands(jobs, batch_output_dir, batch_workers, kwargs, gaussian_stage='prepare')
+        scheduler = gaussian_scheduler.Gaussian_job_scheduler(total_mem_mb=gaussian_total_mem, restart=gaussian_restart)
+        queued = {}
+        for name, result in results.items():
+            if result['status'] == 'gaussian':
+                gaussian_job = result['gaussian_job']
+                queued[name] = scheduler.add_job(gaussian_job['input_file'], gaussian_excute, gaussian_job['chk_file'], gaussian_job['workdir'])
+        scheduler.run()
+        for name, job in queued.items():
+            if not job.success:
+                results[name].update(status='failed', message='gaussian job failed')
+        finish_jobs = [job for job in jobs if job[0] in queued and queued[job[0]].success]
+        for name, result in run_ligands(finish_jobs, batch_output_dir, batch_workers, kwargs, gaussian_stage='finish').items():
+            result['elapsed'] += results[name]['elapsed']
+            results[name] = result
+    results = list(results.values())
+    elapsed = time.time() - start
+
+    n_success = sum(1 for result in results if result['status'] == 'success')
+    throughput = len(results) / elapsed * 3600 if elapsed > 0 else 0.0
+    summary_file = os.path.join(batch_output_dir, 'batch_summary.txt')
+    with open(summary_file, 'w') as f:
+        f.write("name\tstatus\telapsed_s\tworkdir\tmessage\n")
+        for result in sorted(results, key=lambda r: r['name']):
+            f.write(f"{result['name']}\t{result['status']}\t{result['elapsed']:.1f}\t{result['workdir']}\t{result['message']}\n")
+        f.write(f"# {n_success}/{len(results)} succeeded in {elapsed:.1f} s, {throughput:.1f} ligands/hour\n")
+    print(f"Batch finished: {n_success}/{len(results)} ligands succeeded in {elapsed:.1f} s ({throughput:.1f} ligands/hour).")
+    print(f"Per-ligand report written to {summary_file}")
+    return results
@@ -2,10 +2,13 @@ import os
 import sys
 from ..nonstandard_residue_preparation import antechamber_relate_module
 from ..nonstandard_residue_preparation import gaussian_relate_module
+from ..nonstandard_residue_preparation import gaussian_scheduler
 from ..nonstandard_residue_preparation import formate_lig_pdb
+from ..parameter_cache import Parameter_cache, molecule_key
 
 
 def main(forcefield_needed, input_lig_pdb, lig_resname, charge_model='bcc', lig_net_charge=0, gaussian_scr_path=None, gaussian_excute=None, ligifopt=False,
+            parm_cache_path=None, parm_cache_size=500, extra_formats=None, gaussian_total_mem=None, gaussian_restart=False, resp_engine='resp', gaussian_stage='all',
             ):
     """
     The workflow of the solvated receptor-ligand system preparation for amber MD simulation.
@@ -18,30 +21,51 @@ def main(forcefield_needed, input_lig_pdb, lig_resname, charge_model='bcc', lig_
     :param gaussian_scr_path: string, the path of the gaussian scratch.
     :param gaussian_excute: string, the excute file of the gaussian.
     :param ligifopt: bool, whether to optimize the ligand structure.
+    :param parm_cache_path: string, the directory of the parameter cache. None to disable the cache.
+    :param parm_cache_size: float, the size cap of the parameter cache in MB.
+    :param extra_formats: list, additional output formats of the ligand parameters, 'mol2' and/or 'lib'.
+    :param gaussian_total_mem: int, the memory in MB available to the gaussian jobs. None for 80% of the physical memory.
+    :param gaussian_restart: bool, whether to resume failed or interrupted gaussian runs from their checkpoint files.
+    :param resp_engine: string, the RESP fitting engine, 'resp' (the resp program), 'native' (in-process, requires numpy) or 'validate' (both, compared).
+    :param gaussian_stage: string, 'all' to run the whole workflow, 'prepare' to stop after writing the gaussian input and return the gaussian job as a dictionary,
+                           'finish' to continue after the gaussian job of a 'prepare' call has been run (used to schedule the gaussian jobs of a ligand library together).
     """
     protein_ff = forcefield_needed['protein_ff']
     # Generate the ligand parameters
     small_molecule_ff = forcefield_needed['small_molecule_ff']
-    formate_lig_pdb.format_lig_pdb(input_lig_pdb, lig_resname)# Generate the ligand-format.pdb
-    ifcheck_gaussian_excute = True if charge_model == 'resp' else False
-    gen_gaussian = gaussian_relate_module.Format_pdb_gen_gaussian('ligand-format.pdb', 1, lig_resname, lig_net_charge, protein_ff, gaussian_scr_path, gaussian_excute, ifcheck_gaussian_excute)# Generate the MOL_qm_gaussian.pdb
+    extra_formats = list(extra_formats) if extra_formats else []
+    parm_files = [f"{lig_resname}.prepi", f"{lig_resname}.frcmod"] + [f"{lig_resname}.{extra_format}" for extra_format in extra_formats]
+    if gaussian_stage != 'finish':
+        formate_lig_pdb.format_lig_pdb(input_lig_pdb, lig_resname)# Generate the ligand-format.pdb
+    if parm_cache_path is not None:
+        parm_cache = Parameter_cache(parm_cache_path, parm_cache_size)
+        cache_key = molecule_key('ligand-format.pdb', lig_resname, lig_net_charge, charge_model, small_molecule_ff.split('.')[-1], ifopt=bool(ligifopt))
+        if gaussian_stage != 'finish' and parm_cache.lookup(cache_key, parm_files):
+            print(f"Ligand parameters found in the parameter cache (key {cache_key[:12]}).")
+            parm_cache.report()
+            return
     gaussian_lig_pdb = f"{lig_resname}_qm_gaussian.pdb"
-    if charge_model == 'resp':
-        gen_gaussian.create_gaussian_com(ifopt=ligifopt)# Generate the gaussian input file
-        gaussian_input_name = gen_gaussian.gaussian_input_name
-        chk_file = gen_gaussian.chk_file
-        run_gaussian = gaussian_relate_module.Gaussian_run(gaussian_input_name, gaussian_excute, chk_file)
-        run_gaussian.run_gaussian()# Run the gaussian
-        gaussian_out = f"{lig_resname}_qm.log"
-    elif charge_model == 'bcc':
-        gaussian_lig_pdb = f"{lig_resname}_qm_gaussian.pdb"
-        gaussian_out = f"{lig_resname}_qm.log"    
-    prepi_generator = antechamber_relate_module.PrepiGenerator(gaussian_lig_pdb, lig_resname, lig_net_charge, charge_model, small_molecule_ff.split('.')[-1], gaussian_out)
+    gaussian_out = f"{lig_resname}_qm.log"
+    if gaussian_stage != 'finish':
+        ifcheck_gaussian_excute = True if charge_model == 'resp' else False
+        gen_gaussian = gaussian_relate_module.Format_pdb_gen_gaussian('ligand-format.pdb', 1, lig_resname, lig_net_charge, protein_ff, gaussian_scr_path, gaussian_excute, ifcheck_gaussian_excute)# Generate the MOL_qm_gaussian.pdb
+        if charge_model == 'resp':
+            gen_gaussian.create_gaussian_com(ifopt=ligifopt)# Generate the gaussian input file
+            gaussian_job = {'input_file': gen_gaussian.gaussian_input_name, 'chk_file': gen_gaussian.chk_file, 'workdir': os.getcwd()}
+            if gaussian_stage == 'prepare':
+                return gaussian_job
+            scheduler = gaussian_scheduler.Gaussian_job_scheduler(total_mem_mb=gaussian_total_mem, restart=gaussian_restart)
+            scheduler.add_job(gen_gaussian.gaussian_input_name, gaussian_excute, gen_gaussian.chk_file)
+            if not scheduler.run():# Run the gaussian
+                sys.exit()
+    prepi_generator = antechamber_relate_module.PrepiGenerator(gaussian_lig_pdb, lig_resname, lig_net_charge, charge_model, small_molecule_ff.split('.')[-1], gaussian_out, extra_formats, resp_engine)
     prepi_generator.gen_small_molecule_prepi() 
     if os.path.exists(f"{lig_resname}.prepi"):
         if os.path.exists(f"{lig_resname}.frcmod"):
             print("Ligand parameters successfully generated.")
+            if parm_cache_path is not None and all(os.path.exists(parm_file) for parm_file in parm_files):
+                parm_cache.store(cache_key, parm_files, label=lig_resname)
+                parm_cache.report()
     else:
         print("Ligand parameters generation failed.")
         sys.exit()
-  
\ No newline at end of file
@@ -2,9 +2,12 @@ import os
 import sys
 from ..nonstandard_residue_preparation import antechamber_relate_module
 from ..nonstandard_residue_preparation import gaussian_relate_module
+from ..nonstandard_residue_preparation import gaussian_scheduler
+from ..parameter_cache import Parameter_cache, molecule_key
 
 
 def main(protein_ff, input_aminoacids_pdb, resname, residx, charge_model='resp', net_charge=0, gaussian_scr_path='/tmp/zli/scr', gaussian_excute='g03', ifopt=False,
+            parm_cache_path=None, parm_cache_size=500, gaussian_total_mem=None, gaussian_restart=False, resp_engine='resp',
             ):
     """
     The workflow of the solvated receptor-ligand system preparation for amber MD simulation.
@@ -18,19 +21,32 @@ def main(protein_ff, input_aminoacids_pdb, resname, residx, charge_model='resp',
     :param gaussian_scr_path: string, the path of the gaussian scratch.
     :param gaussian_excute: string, the excute file of the gaussian.
     :param ifopt: bool, whether to optimize the nonstandard amino acid structure.
+    :param parm_cache_path: string, the directory of the parameter cache. None to disable the cache.
+    :param parm_cache_size: float, the size cap of the parameter cache in MB.
+    :param gaussian_total_mem: int, the memory in MB available to the gaussian job. None for 80% of the physical memory.
+    :param gaussian_restart: bool, whether to resume failed or interrupted gaussian runs from their checkpoint files.
+    :param resp_engine: string, the RESP fitting engine, 'resp' (the resp program), 'native' (in-process, requires numpy) or 'validate' (both, compared).
     """
     gen_gaussian = gaussian_relate_module.Format_pdb_gen_gaussian(input_aminoacids_pdb, residx, resname, net_charge, protein_ff, gaussian_scr_path)# Generate the MOL_qm_gaussian.pdb
     gaussian_lig_pdb = f"{resname}_qm_gaussian.pdb"
+    parm_files = [f"{resname}.prepi", f"{resname}.frcmod"]
+    if parm_cache_path is not None:
+        parm_cache = Parameter_cache(parm_cache_path, parm_cache_size)
+        cache_key = molecule_key(gaussian_lig_pdb, resname, net_charge, charge_model, protein_ff, ifopt=bool(ifopt), nonstandard_aminoacid=True)
+        if parm_cache.lookup(cache_key, parm_files):
+            print(f"Non-standard amino acid parameters found in the parameter cache (key {cache_key[:12]}).")
+            parm_cache.report()
+            return
     if charge_model == 'resp':
         gen_gaussian.create_gaussian_com(ifopt=ifopt)# Generate the gaussian input file
-        gaussian_input_name = gen_gaussian.gaussian_input_name
-        chk_file = gen_gaussian.chk_file
-        run_gaussian = gaussian_relate_module.Gaussian_run(gaussian_input_name, gaussian_excute, chk_file)
-        run_gaussian.run_gaussian()# Run the gaussian
+        scheduler = gaussian_scheduler.Gaussian_job_scheduler(total_mem_mb=gaussian_total_mem, restart=gaussian_restart)
+        scheduler.add_job(gen_gaussian.gaussian_input_name, gaussian_excute, gen_gaussian.chk_file)
+        if not scheduler.run():# Run the gaussian
+            sys.exit()
         gaussian_out = f"{resname}_qm.log"
     elif charge_model == 'bcc':
         raise ValueError("The charge model 'bcc' is not supported for nonstandard amino acid so far.")
-    prepi_generator = antechamber_relate_module.PrepiGenerator(gaussian_lig_pdb, resname, net_charge, charge_model, None, gaussian_out)
+    prepi_generator = antechamber_relate_module.PrepiGenerator(gaussian_lig_pdb, resname, net_charge, charge_model, None, gaussian_out, resp_engine=resp_engine)
     if prepi_generator.has_nme_or_ace_cap() > 0:
         prepi_generator.gen_nonstandard_amino_acid_prepi()
     else:
@@ -39,6 +55,9 @@ def main(protein_ff, input_aminoacids_pdb, resname, residx, charge_model='resp',
     if os.path.exists(f"{resname}.prepi"):
         if os.path.exists(f"{resname}.frcmod"):
             print("Non-standard amino acid parameters successfully generated.")
+            if parm_cache_path is not None:
+                parm_cache.store(cache_key, parm_files, label=resname)
+                parm_cache.report()
     else:
         print("Non-standard amino acid parameters generation failed.")
         sys.exit()
@@ -1,19 +1,22 @@
 import os
-import sys
 from ..tleap_relate_module import Tleap_runner
 from ..md_input_generator import MD_input_prep
 from ..rec_lig_com_pdb_generator import PDB_simple_processor
-from ..nonstandard_residue_preparation import antechamber_relate_module
-from ..nonstandard_residue_preparation import gaussian_relate_module
-from ..nonstandard_residue_preparation import formate_lig_pdb
+from ..box_optimizer import choose_boxtype
+from ..receptor_cache import Receptor_cache
+from . import auto_lig_parm_preparation
 
 
 def main(automd_home, forcefield_needed, amber_md, external_amberparms, external_amberprep, boxtype, com_boxsize, lig_boxsize,
             input_lig_pdb, lig_resname, charge_model='bcc', iffull_auto=True, prod_steps=4, cutoff = 10.0,
             final_temp=300.0, heat_nstlim=1000, density_nstlim=1000, equil_nstlim=10000, prod_nstlim=10000,
             restraint_lig=None, restraint_rec=None, restraint_add=None,
-            receptor_pdb='protein.pdb', sbond_file=None, 
+            receptor_pdb='protein.pdb', sbond_file=None, auto_disulfide=True, disulfide_cache_path=None,
             lig_net_charge=0, gaussian_scr_path=None, gaussian_excute=None, ligifopt=False,
+            parm_cache_path=None, parm_cache_size=500, extra_formats=None, gaussian_total_mem=None, gaussian_restart=False, resp_engine='resp',
+            rec_cache_path=None, rec_cache_size=2000, hmr=False, netcdf=False,
+            compact_traj=False, compact_stride=1, compact_precision=None,
+            adaptive_equil=False, equil_chunk_nstlim=5000, equil_min_nstlim=10000, equil_max_nstlim=100000,
             ):
     """
     The workflow of the solvated receptor-ligand system preparation for amber MD simulation.
@@ -23,7 +26,7 @@ def main(automd_home, forcefield_needed, amber_md, external_amberparms, external
     :param amber_md: string, the path of the amber MD package. like: pmemd.cuda
     :param external_amberparms: string, the path of the external amber frcmod files.
     :param external_amberprep: string, the path of the external amber prepi files.
-    :param boxtype: string, the type of the box, 'solvateoct' or 'solvatebox'.
+    :param boxtype: string, the type of the box, 'solvateoct', 'solvatebox' or 'auto' for the one with the fewest waters (only with iffull_auto).
     :param com_boxsize: float, the distance between the solute and the edge of the complex box.
     :param lig_boxsize: float, the distance between the solute and the edge of the ligand box.
     :param input_lig_pdb: string, the input ligand pdb file.
@@ -40,48 +43,67 @@ def main(automd_home, forcefield_needed, amber_md, external_amberparms, external
     :param restraint_lig: string, the ligand residue number. used for the restraint ligand.
     :param restraint_rec: string, the receptor residue number range. used for the restraint receptor.
     :param restraint_add: string, the additional residue number range. used for the restraint additional residue.
-    :param receptor_pdb: string, the receptor pdb file.
+    :param receptor_pdb: string, the receptor pdb file, or an mmCIF/PDBx file (.cif, .mmcif) for receptors beyond the PDB format limits.
     :param sbond_file: string, the disulfide bond file.
+    :param auto_disulfide: bool, whether to detect the disulfide bonds from the SG-SG distances when no sbond_file is given.
+    :param disulfide_cache_path: string, the directory caching the detected disulfide bonds per receptor. None to disable the cache.
     :param lig_net_charge: int, the net charge of the ligand.
     :param gaussian_scr_path: string, the path of the gaussian scratch.
     :param gaussian_excute: string, the excute file of the gaussian.
     :param ligifopt: bool, whether to optimize the ligand structure.
+    :param parm_cache_path: string, the directory of the parameter cache. None to disable the cache.
+    :param parm_cache_size: float, the size cap of the parameter cache in MB.
+    :param extra_formats: list, additional output formats of the ligand parameters, 'mol2' and/or 'lib'.
+    :param gaussian_total_mem: int, the memory in MB available to the gaussian job. None for 80% of the physical memory.
+    :param gaussian_restart: bool, whether to resume failed or interrupted gaussian runs from their checkpoint files.
+    :param resp_engine: string, the RESP fitting engine, 'resp' (the resp program), 'native' (in-process, requires numpy) or 'validate' (both, compared).
+    :param rec_cache_path: string, the directory caching the receptor artifacts (rec.pdb, rec.prmtop, the crystal-water split). None to disable the cache.
+    :param rec_cache_size: float, the size cap of the receptor cache in MB.
+    :param hmr: bool, whether to repartition the hydrogen masses of the solvated topologies and run the MD with the 4 fs time step.
+    :param netcdf: bool, whether to write NetCDF trajectories and restarts instead of ASCII files compressed by gzip.
+    :param compact_traj: bool, whether to strip the waters and ions of every production segment in the background of the next one.
+    :param compact_stride: int, the stride of the compacted trajectories.
+    :param compact_precision: float, the quantization step of the compacted coordinates in Angstrom. None for float NetCDF.
+    :param adaptive_equil: bool, whether to run density and equil in chunks until their density, volume, temperature and potential energy plateau.
+    :param equil_chunk_nstlim: int, the MD steps of a chunk of an adaptive stage.
+    :param equil_min_nstlim: int, the minimum MD steps of an adaptive stage.
+    :param equil_max_nstlim: int, the maximum MD steps of an adaptive stage.
     """
-    protein_ff = forcefield_needed['protein_ff']
     rec_name_u = receptor_pdb.split('.')[0]
     # Generate the ligand parameters
-    small_molecule_ff = forcefield_needed['small_molecule_ff']
-    formate_lig_pdb.format_lig_pdb(input_lig_pdb, lig_resname)# Generate the ligand-format.pdb
-    ifcheck_gaussian_excute = True if charge_model == 'resp' else False
-    gen_gaussian = gaussian_relate_module.Format_pdb_gen_gaussian('ligand-format.pdb', 1, lig_resname, lig_net_charge, protein_ff, gaussian_scr_path, gaussian_excute, ifcheck_gaussian_excute)# Generate the MOL_qm_gaussian.pdb
-    gaussian_lig_pdb = f"{lig_resname}_qm_gaussian.pdb"
-    if charge_model == 'resp':
-        gen_gaussian.create_gaussian_com(ifopt=ligifopt)# Generate the gaussian input file
-        gaussian_input_name = gen_gaussian.gaussian_input_name
-        chk_file = gen_gaussian.chk_file
-        run_gaussian = gaussian_relate_module.Gaussian_run(gaussian_input_name, gaussian_excute, chk_file)
-        run_gaussian.run_gaussian()# Run the gaussian
-        gaussian_out = f"{lig_resname}_qm.log"
-    elif charge_model == 'bcc':
-        gaussian_lig_pdb = f"{lig_resname}_qm_gaussian.pdb"
-        gaussian_out = f"{lig_resname}_qm.log"    
-    prepi_generator = antechamber_relate_module.PrepiGenerator(gaussian_lig_pdb, lig_resname, lig_net_charge, charge_model, small_molecule_ff.split('.')[-1], gaussian_out)
-    prepi_generator.gen_small_molecule_prepi() 
-    if os.path.exists(f"{lig_resname}.prepi"):
-        if os.path.exists(f"{lig_resname}.frcmod"):
-            print("Ligand parameters successfully generated.")
-    else:
-        print("Ligand parameters generation failed.")
-        sys.exit()
+    auto_lig_parm_preparation.main(forcefield_needed, input_lig_pdb, lig_resname, charge_model, lig_net_charge, gaussian_scr_path, gaussian_excute, ligifopt,
+                                    parm_cache_path=parm_cache_path, parm_cache_size=parm_cache_size, extra_formats=extra_formats,
+                                    gaussian_total_mem=gaussian_total_mem, gaussian_restart=gaussian_restart, resp_engine=resp_engine)
+    # Reuse the receptor artifacts of an earlier ligand against the same receptor
+    receptor_cache = None
+    receptor_split = None
+    if rec_cache_path is not None and iffull_auto:
+        receptor_cache = Receptor_cache(rec_cache_path, receptor_pdb, list(forcefield_needed.values()), external_amberparms, external_amberprep,
+                                        os.path.join(automd_home, "src", "external_parameters"), sbond_file, auto_disulfide, rec_cache_size)
+        receptor_split = receptor_cache.lookup()
     # Generate the ligand, receptor, receptor-ligand complex pdb file
-    pdb_processor = PDB_simple_processor(f"{lig_resname}.prepi", "ligand-format.pdb", receptor_pdb)
-    pdb_processor.generate_lig_pdb() # generate lig.pdb
-    pdb_processor.generate_rec_pdb() # generate rec.pdb
-    pdb_processor.generate_rec_lig_pdb() # generate rec-lig.pdb
-    pdb_processor.generate_combined_pdb() # generate protein_MOL.pdb
+    pdb_processor = PDB_simple_processor(f"{lig_resname}.prepi", "ligand-format.pdb", receptor_pdb,
+                                         auto_disulfide=auto_disulfide and sbond_file is None, disulfide_cache_path=disulfide_cache_path,
+                                         receptor_split=receptor_split)
+    if pdb_processor.sbond_file is not None:
+        sbond_file = pdb_processor.sbond_file
+    pdb_processor.generate_all(rec_pdb=receptor_split is None) # generate lig.pdb, rec.pdb, rec-lig.pdb and protein_MOL.pdb
+    pdb_processor.check_contacts() # report steric clashes and the pocket residues before tleap
+    # Estimate the waters of each box type, choose the box and orient the solute
+    # Only for the generated tleap.txt, and the rotated solute is only used by the solvated units
+    lig_boxtype, lig_wat_pdb, com_pdb = boxtype, "lig.pdb", f"{rec_name_u}_MOL.pdb"
+    if iffull_auto:
+        lig_boxtype, lig_wat_pdb = choose_boxtype("lig.pdb", lig_boxsize, boxtype)
+        boxtype, com_pdb = choose_boxtype(com_pdb, com_boxsize, boxtype)
     # Generate the tleap input file and run tleap
-    tleap_runner = Tleap_runner(automd_home, list(forcefield_needed.values()), external_amberparms, external_amberprep,  rec_name_u, lig_resname, boxtype, com_boxsize, lig_boxsize, sbond_file)
-    tleap_runner.run_tleap(iffull_auto)
+    tleap_runner = Tleap_runner(automd_home, list(forcefield_needed.values()), external_amberparms, external_amberprep,  rec_name_u, lig_resname, boxtype, com_boxsize, lig_boxsize, sbond_file,
+                                 lig_boxtype=lig_boxtype, com_pdb=com_pdb, lig_wat_pdb=lig_wat_pdb)
+    tleap_runner.run_tleap(iffull_auto, skip_units=('rec',) if receptor_split is not None else ())
+    if receptor_cache is not None and receptor_split is None:
+        receptor_cache.store(pdb_processor.split())
     # Generate the MD input file
-    md_input_generator = MD_input_prep(automd_home, amber_md, rec_name_u, lig_resname, prod_steps, cutoff, final_temp, heat_nstlim, density_nstlim, equil_nstlim, prod_nstlim, restraint_lig, restraint_rec, restraint_add)
+    md_input_generator = MD_input_prep(automd_home, amber_md, rec_name_u, lig_resname, prod_steps, cutoff, final_temp, heat_nstlim, density_nstlim, equil_nstlim, prod_nstlim, restraint_lig, restraint_rec, restraint_add,
+                                       hmr=hmr, netcdf=netcdf, compact_traj=compact_traj, compact_stride=compact_stride,
+                                       compact_precision=compact_precision, adaptive_equil=adaptive_equil, equil_chunk_nstlim=equil_chunk_nstlim,
+                                       equil_min_nstlim=equil_min_nstlim, equil_max_nstlim=equil_max_nstlim)
     md_input_generator.run()
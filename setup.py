@@ -45,6 +45,9 @@ def setup_func(scm=None):
         ],
         keywords='Pyautomd',
         install_requires=install_requires,
+        extras_require={
+            'resp': ['numpy'],
+        },
         entry_points={
             'console_scripts': [
             'pyautomd = pyautomd.pyautomd:main'
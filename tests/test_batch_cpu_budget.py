@@ -0,0 +1,21 @@
+from pyautomd.src.external_program_runner import configure_runner, get_runner
+from pyautomd.src.workflow.auto_lig_batch_parm_preparation import worker_pool
+
+
+def worker_budget(_):
+    runner = get_runner()
+    return runner.max_cpus, tuple(sorted(runner.timeouts.items()))
+
+
+def test_worker_pool_splits_the_cpu_budget():
+    saved = get_runner()
+    try:
+        configure_runner(8, {'default': 60})
+        with worker_pool(3) as executor:
+            assert set(executor.map(worker_budget, range(6))) == {(2, (("default", 60),))}
+        configure_runner(2)
+        with worker_pool(4) as executor:
+            assert executor._max_workers == 2
+            assert set(executor.map(worker_budget, range(4))) == {(1, ())}
+    finally:
+        configure_runner(saved.max_cpus, saved.timeouts)
@@ -0,0 +1,52 @@
+import os
+import shutil
+import pytest
+from pyautomd.src.box_optimizer import Box_optimizer, choose_boxtype
+from pyautomd.src.pdb_atoms import PDB_atoms
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', 'example', 'rec_lig_solvated_preparation')
+
+
+def write_rod(pdb_file, n_atoms=40):
+    """
+    A long diagonal chain of carbon atoms, the case where the rotated rectangular box is smaller than the octahedron.
+    """
+    with open(pdb_file, 'w') as f:
+        for i in range(n_atoms):
+            x, y, z = 1.5 * i * 0.577, 1.5 * i * 0.577 + 0.3 * (i % 2), 1.5 * i * 0.577
+            f.write(f"ATOM  {i + 1:5d}  C   ROD A   1    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           C\n")
+        f.write("END\n")
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('boxtype', ['solvatebox', 'solvateoct'])
+def test_explicit_boxtype_keeps_the_solute(tmp_path, boxtype):
+    pdb_file = str(tmp_path / 'rod.pdb')
+    write_rod(pdb_file)
+    original = read_bytes(pdb_file)
+    assert choose_boxtype(pdb_file, 10.0, boxtype) == (boxtype, pdb_file)
+    assert read_bytes(pdb_file) == original
+    assert os.listdir(tmp_path) == ['rod.pdb']
+
+
+def test_auto_writes_the_rotated_solute_separately(tmp_path):
+    pdb_file = str(tmp_path / 'rod.pdb')
+    write_rod(pdb_file)
+    original = read_bytes(pdb_file)
+    boxtype, solute_pdb = choose_boxtype(pdb_file, 10.0, 'auto')
+    assert (boxtype, solute_pdb) == ('solvatebox', str(tmp_path / 'rod_oriented.pdb'))
+    assert read_bytes(pdb_file) == original
+    rotated = Box_optimizer(solute_pdb, 10.0)
+    assert rotated.estimates['solvatebox_unrotated']['volume'] == pytest.approx(rotated.estimates['solvatebox']['volume'], rel=1e-3)
+    assert len(PDB_atoms.read(solute_pdb)) == len(PDB_atoms.read(pdb_file))
+
+
+def test_auto_octahedron_of_the_example_complex(tmp_path):
+    pdb_file = str(tmp_path / 'protein_MOL.pdb')
+    shutil.copy(os.path.join(EXAMPLE, 'protein_MOL.pdb'), pdb_file)
+    assert choose_boxtype(pdb_file, 10.0, 'auto') == ('solvateoct', pdb_file)
+    assert read_bytes(pdb_file) == read_bytes(os.path.join(EXAMPLE, 'protein_MOL.pdb'))
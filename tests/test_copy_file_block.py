@@ -0,0 +1,55 @@
+import os
+import errno
+import pytest
+from pyautomd.src import rec_lig_com_pdb_generator
+from pyautomd.src.rec_lig_com_pdb_generator import copy_file_block
+
+DATA = b"".join(f"ATOM  {k:5d}\n".encode() for k in range(1000))
+
+
+def copy(tmp_path, offset, count):
+    src_file, dst_file = tmp_path / 'src.pdb', tmp_path / 'dst.pdb'
+    src_file.write_bytes(DATA)
+    src_fd = os.open(src_file, os.O_RDONLY)
+    dst_fd = os.open(dst_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    try:
+        copy_file_block(src_fd, dst_fd, offset, count)
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+    return dst_file.read_bytes()
+
+
+def failing_copy(code):
+    def copy_call(*args):
+        raise OSError(code, os.strerror(code))
+    return copy_call
+
+
+def kernel_copy_name():
+    return 'copy_file_range' if hasattr(os, 'copy_file_range') else 'sendfile'
+
+
+def test_copy_range(tmp_path):
+    assert copy(tmp_path, 120, 3000) == DATA[120:3120]
+
+
+@pytest.mark.parametrize('code', [errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF])
+def test_read_write_fallback(tmp_path, monkeypatch, code):
+    monkeypatch.setattr(rec_lig_com_pdb_generator.os, kernel_copy_name(), failing_copy(code))
+    assert copy(tmp_path, 120, 3000) == DATA[120:3120]
+
+
+def test_destination_errors_are_raised(tmp_path, monkeypatch):
+    monkeypatch.setattr(rec_lig_com_pdb_generator.os, kernel_copy_name(), failing_copy(errno.ENOSPC))
+    with pytest.raises(OSError) as error:
+        copy(tmp_path, 0, 100)
+    assert error.value.errno == errno.ENOSPC
+
+
+@pytest.mark.parametrize('fallback', [False, True])
+def test_short_source_is_an_error(tmp_path, monkeypatch, fallback):
+    if fallback:
+        monkeypatch.setattr(rec_lig_com_pdb_generator.os, kernel_copy_name(), failing_copy(errno.EXDEV))
+    with pytest.raises(ValueError, match="ends at byte"):
+        copy(tmp_path, len(DATA) - 10, 100)
@@ -0,0 +1,51 @@
+import os
+import stat
+from pyautomd.src.disulfide_detector import Disulfide_detector
+from pyautomd.src.tleap_relate_module import Tleap_runner, split_tleap_units
+
+AUTOMD_HOME = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pyautomd')
+# (name, altloc, residue name, residue number, x, y, z): two cysteines bonded through the first location of the SG of CYS 1
+ATOMS = [("CA", " ", "CYS", 1, -1.5, 0.0, 0.0), ("SG", "A", "CYS", 1, 0.0, 0.0, 0.0), ("SG", "B", "CYS", 1, -0.6, 0.8, 0.0),
+         ("HG", " ", "CYS", 1, -0.3, -1.2, 0.0), ("CA", " ", "ALA", 2, 0.0, 6.0, 0.0),
+         ("CA", " ", "CYS", 3, 3.5, 0.0, 0.0), ("SG", " ", "CYS", 3, 2.05, 0.0, 0.0), ("HG", " ", "CYS", 3, 2.3, -1.2, 0.0)]
+
+
+def write_receptor(pdb_file):
+    with open(pdb_file, "w") as f:
+        for serial, (name, altloc, resname, resseq, x, y, z) in enumerate(ATOMS, 1):
+            f.write(f"ATOM  {serial:5d}  {name:<3s}{altloc}{resname} A{resseq:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00\n")
+        f.write("END\n")
+
+
+def test_detection_ignores_alternate_locations(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_receptor("protein.pdb")
+    detector = Disulfide_detector("protein.pdb")
+    bonds = detector.detect()
+    assert [(bond['residue1']['index'], bond['residue2']['index']) for bond in bonds] == [(1, 3)]
+    assert bonds[0]['distance'] == 2.05
+    assert detector.write_cyx_receptor("protein_cyx.pdb")
+    with open("protein_cyx.pdb") as f:
+        atoms = [(line[12:16].strip(), line[17:20]) for line in f if line.startswith("ATOM")]
+    assert atoms == [("CA", "CYX"), ("SG", "CYX"), ("SG", "CYX"), ("CA", "ALA"), ("CA", "CYX"), ("SG", "CYX")]
+    detector.write_sbond_file("protein_sbond.lst")
+    with open("protein_sbond.lst") as f:
+        assert f.read() == "bond model.1.SG model.3.SG\n"
+
+
+def test_bonds_in_every_receptor_unit(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'tleap').write_text("#!/bin/sh\n")
+    (bin_dir / 'tleap').chmod(stat.S_IRWXU)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.chdir(tmp_path)
+    with open("protein_sbond.lst", "w") as f:
+        f.write("bond model.1.SG model.3.SG\n")
+    Tleap_runner(AUTOMD_HOME, ['leaprc.protein.ff14SB'], [], [], 'protein', 'MOL', 'solvateoct', 10.0, 12.0, "protein_sbond.lst").generate_tleap_file()
+    with open("tleap.txt") as f:
+        units = dict(split_tleap_units(f.readlines())[1])
+    for name in ['model', 'rec-lig', 'rec']:
+        assert [line for line in units[name] if line.startswith("bond")] == [f"bond {name}.1.SG {name}.3.SG\n"]
+    for name in ['lig_wat', 'lig']:
+        assert not any(line.startswith("bond") for line in units[name])
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+from pyautomd.src.equilibration_monitor import Plateau_detector, decide, iter_mdout_records, CONVERGED, CONTINUE
+
+PACKAGE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def write_mdout(path, densities, temperature=300.0):
+    """
+    Writes an mdout with one energy record per density, followed by the averages that must not be read as a record.
+    """
+    with open(path, 'w') as f:
+        for k, density in enumerate(densities, 1):
+            f.write(f" NSTEP = {500 * k:8d}   TIME(PS) = {k:10.3f}  TEMP(K) = {temperature:9.2f}  PRESS =    -5.3\n")
+            f.write(f" Etot   =    -80000.0000  EKtot   =     20000.0000  EPtot      =    -100000.0000\n")
+            f.write(f" VOLUME     =    250000.0000\n")
+            f.write(f"                                                    Density    =         {density:.4f}\n")
+            f.write(" ------------------------------------------------------------------------------\n\n")
+        f.write("      A V E R A G E S   O V E R       5 S T E P S\n\n")
+        f.write(f" NSTEP = {500 * len(densities):8d}   TIME(PS) = 0.000  TEMP(K) =   0.00  PRESS =     0.0\n")
+        f.write("                                                    Density    =         0.0000\n")
+    return str(path)
+
+
+def chunks(tmp_path, series):
+    return [write_mdout(tmp_path / f"equil_{n}.out", densities) for n, densities in enumerate(series, 1)]
+
+
+def test_records_stop_at_the_averages(tmp_path):
+    records = list(iter_mdout_records(write_mdout(tmp_path / 'equil.out', [1.01, 1.02])))
+    assert [record['Density'] for record in records] == [1.01, 1.02]
+    assert records[0]['TEMP(K)'] == 300.0 and records[0]['EPtot'] == -100000.0 and records[0]['VOLUME'] == 250000.0
+
+
+def test_drifting_series_continues(tmp_path):
+    mdout_files = chunks(tmp_path, [[0.90 + 0.01 * k for k in range(5)], [0.95 + 0.01 * k for k in range(5)]])
+    stop, decision, details = decide(mdout_files, min_chunks=1, max_chunks=10)
+    assert (stop, decision) == (False, "continue, not converged")
+    density = next(detail for detail in details if detail[0] == 'Density')
+    assert density[3] > density[4]
+
+
+def test_flat_series_stops_once_the_minimum_is_reached(tmp_path):
+    mdout_files = chunks(tmp_path, [[1.0] * 5] * 3)
+    assert decide(mdout_files[:2], min_chunks=3, max_chunks=10)[:2] == (False, "continue, minimum length not reached")
+    assert decide(mdout_files, min_chunks=3, max_chunks=10)[:2] == (True, "converged")
+
+
+def test_maximum_length_stops_without_a_plateau(tmp_path):
+    mdout_files = chunks(tmp_path, [[0.90 + 0.01 * (5 * n + k) for k in range(5)] for n in range(3)])
+    assert decide(mdout_files[:2], min_chunks=1, max_chunks=3)[:2] == (False, "continue, not converged")
+    assert decide(mdout_files, min_chunks=1, max_chunks=3)[:2] == (True, "maximum length reached without a plateau")
+
+
+def test_too_few_records_do_not_converge(tmp_path):
+    detector = Plateau_detector()
+    detector.read(chunks(tmp_path, [[1.0] * 5]))
+    converged, details = detector.check()
+    assert not converged and all(detail[3] is None for detail in details)
+
+
+def test_command_line_exit_codes(tmp_path):
+    flat = chunks(tmp_path, [[1.0] * 5] * 2)
+    log = tmp_path / 'equilibration.log'
+    command = [sys.executable, '-m', 'pyautomd.src.equilibration_monitor', '--stage', 'equil', '--log', str(log)]
+    assert subprocess.run(command + flat, capture_output=True, cwd=PACKAGE_ROOT).returncode == CONVERGED
+    assert subprocess.run(command + ['--min-chunks', '3'] + flat, capture_output=True, cwd=PACKAGE_ROOT).returncode == CONTINUE
+    assert subprocess.run(command + ['--tolerance', 'Density=0.001', str(tmp_path / 'missing.out')], capture_output=True, cwd=PACKAGE_ROOT).returncode == CONTINUE
+    with open(log) as f:
+        decisions = [line.split('-> ')[1].strip() for line in f]
+    assert decisions[:2] == ["converged", "continue, minimum length not reached"] and decisions[2].startswith("continue, ")
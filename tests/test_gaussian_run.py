@@ -0,0 +1,31 @@
+import os
+import stat
+from pyautomd.src.external_program_runner import configure_runner, get_runner
+from pyautomd.src.nonstandard_residue_preparation.gaussian_relate_module import Gaussian_run
+
+# Starts writing the log only after a while, as Gaussian does, then terminates normally
+FAKE_GAUSSIAN = """#!/bin/sh
+sleep 0.5
+log=${1%.com}.log
+echo " Entering Gaussian System" > $log
+echo " Normal termination of Gaussian 16" >> $log
+"""
+
+
+def test_log_of_a_failed_run_is_not_read_by_the_new_run(tmp_path, monkeypatch):
+    (tmp_path / 'g16').write_text(FAKE_GAUSSIAN)
+    (tmp_path / 'g16').chmod(stat.S_IRWXU)
+    monkeypatch.chdir(tmp_path)
+    with open('MOL.com', 'w') as f:
+        f.write('# PM3MM sp\n')
+    with open('MOL.log', 'w') as f:
+        f.write(' Error termination via Lnk1e in l502.exe\n')
+    saved = get_runner()
+    try:
+        configure_runner(1)
+        Gaussian_run('MOL.com', str(tmp_path / 'g16'), 'MOL.chk').run_gaussian()
+        assert get_runner().records[-1].killed_reason is None
+    finally:
+        configure_runner(saved.max_cpus, saved.timeouts)
+    with open('MOL.log') as f:
+        assert f.read().endswith(" Normal termination of Gaussian 16\n")
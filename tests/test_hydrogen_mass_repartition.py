@@ -0,0 +1,53 @@
+import os
+import shutil
+import pytest
+from pyautomd.src.hydrogen_mass_repartition import repartition_hydrogen_masses, HMR_HYDROGEN_MASS
+from pyautomd.src.prmtop_reader import Prmtop_reader
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example', 'rec_lig_solvated_preparation')
+WATER_HYDROGEN_MASS = 1.008
+
+
+def read_sections(prmtop_file):
+    """
+    Returns the raw bytes of every %FLAG section, its format line and data included.
+    """
+    with open(prmtop_file, 'rb') as f:
+        blocks = f.read().split(b'%FLAG')
+    return {block.split(None, 1)[0].decode(): block for block in blocks[1:]}
+
+
+def read_masses(prmtop_file):
+    with Prmtop_reader(prmtop_file) as prmtop:
+        water_atoms = set()
+        for first, last in prmtop.atom_ranges(prmtop.classify_residues()['water']):
+            water_atoms.update(range(first - 1, last))
+        return list(prmtop.section('MASS')), list(prmtop.section('ATOMIC_NUMBER')), water_atoms
+
+
+def test_repartition_example_topology(tmp_path):
+    prmtop_file = str(tmp_path / 'protein.prmtop')
+    shutil.copy(os.path.join(EXAMPLE, 'protein.prmtop'), prmtop_file)
+    masses, atomic_numbers, water_atoms = read_masses(prmtop_file)
+    n_solute_hydrogens = sum(1 for j, number in enumerate(atomic_numbers) if number == 1 and j not in water_atoms)
+
+    assert repartition_hydrogen_masses(prmtop_file) == n_solute_hydrogens > 0
+    new_masses, _, _ = read_masses(prmtop_file)
+    assert sum(new_masses) == pytest.approx(sum(masses), abs=1e-4)
+    for j, number in enumerate(atomic_numbers):
+        if number != 1:
+            continue
+        expected = WATER_HYDROGEN_MASS if j in water_atoms else HMR_HYDROGEN_MASS
+        assert new_masses[j] == pytest.approx(expected, abs=1e-6), j + 1
+    assert water_atoms and all(new_masses[j] == masses[j] for j in water_atoms)
+
+    original, repartitioned = read_sections(os.path.join(EXAMPLE, 'protein.prmtop')), read_sections(prmtop_file)
+    assert list(repartitioned) == list(original)
+    assert [flag for flag in original if repartitioned[flag] != original[flag]] == ['MASS']
+
+    # The hydrogens are already heavy, a second call changes nothing
+    with open(prmtop_file, 'rb') as f:
+        content = f.read()
+    assert repartition_hydrogen_masses(prmtop_file) == 0
+    with open(prmtop_file, 'rb') as f:
+        assert f.read() == content
@@ -0,0 +1,126 @@
+import os
+import shutil
+import subprocess
+from pyautomd.src.md_input_generator import MD_input_prep
+from pyautomd.src.prmtop_reader import Prmtop_reader
+
+AUTOMD_HOME = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pyautomd')
+EXAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example', 'rec_lig_solvated_preparation')
+
+
+def md_input_prep(**options):
+    settings = dict(prod_steps=2, cutoff=10.0, final_temp=300, heat_nstlim=50000, density_nstlim=50000, equil_nstlim=50000, prod_nstlim=50000,
+                    restraint_lig='', restraint_rec='', restraint_add='')
+    settings.update(options)
+    return MD_input_prep(AUTOMD_HOME, 'pmemd.cuda', 'protein', 'MOL', **settings)
+
+
+def test_restraint_masks_of_example_topology():
+    # Residues 1-127 are the receptor, 128 the ligand, 129 the Cl- counter ion, then the waters
+    with Prmtop_reader(os.path.join(EXAMPLE, 'protein.prmtop')) as prmtop:
+        assert prmtop.restraint_masks('MOL') == ('1-127', '128')
+        kinds = prmtop.classify_residues('MOL')
+    assert kinds['ion'] == [129] and kinds['water'][0] == 130
+
+
+def test_restraint_parameters_from_topology(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(os.path.join(EXAMPLE, 'protein.prmtop'), 'protein.prmtop')
+    prep = md_input_prep()
+    prep.set_restraint_parameters()
+    assert (prep.restraint_rec, prep.restraint_lig) == ('1-127', '128')
+    # Masks given in the input are kept
+    prep = md_input_prep(restraint_rec='1-100', restraint_lig='')
+    prep.set_restraint_parameters()
+    assert (prep.restraint_rec, prep.restraint_lig) == ('1-100', '128')
+
+
+# Stands in for pmemd: records the stage, fails the stage named by FAIL_STAGE, and otherwise writes the restart, the trajectory
+# and an output with energy records and the final wall time line. With DRIFT set, the density of record k of chunk n of an adaptive stage is 1.nk
+FAKE_PMEMD = """#!/bin/bash
+while [ $# -gt 0 ]; do
+    case $1 in -o) out=$2;; -r) rst=$2;; -x) traj=$2;; esac
+    shift
+done
+stage=${out%.out}
+echo $stage >> calls.log
+[ "$stage" = "$FAIL_STAGE" ] && exit 1
+for k in 1 2 3 4 5; do
+    density=1.0
+    [ -n "$DRIFT" ] && density=1.${stage##*_}$k
+    echo " NSTEP = $k   TIME(PS) = $k.000  TEMP(K) = 300.00  PRESS = 0.0"
+    echo " EPtot = -1000.0000"
+    echo " VOLUME = 1000.0000"
+    echo " Density = $density"
+done > $out
+echo "     Total wall time:           1    seconds" >> $out
+echo restart > $rst
+[ -n "$traj" ] && echo frames > $traj
+exit 0
+"""
+EQUILIBRATION_STAGES = ['min1', 'min2', 'min3', 'min4', 'heat', 'density', 'equil']
+
+
+def write_submit(tmp_path, monkeypatch, **options):
+    monkeypatch.chdir(tmp_path)
+    pmemd = tmp_path / 'pmemd'
+    pmemd.write_text(FAKE_PMEMD)
+    pmemd.chmod(0o755)
+    prep = md_input_prep(restraint_rec='1-127', restraint_lig='128', **options)
+    prep.exec_prog = str(pmemd)
+    prep.generate_submit_pbs()
+    assert subprocess.run(['bash', '-n', 'submit.pbs']).returncode == 0
+    return prep
+
+
+def submit(fail_stage=None, drift=False):
+    """
+    Runs submit.pbs and returns its exit code and the stages the stand-in pmemd was called for.
+    """
+    if os.path.exists('calls.log'):
+        os.remove('calls.log')
+    env = dict(os.environ, FAIL_STAGE=fail_stage or '', DRIFT='1' if drift else '')
+    returncode = subprocess.run(['bash', 'submit.pbs'], env=env, stdout=subprocess.DEVNULL).returncode
+    if not os.path.exists('calls.log'):
+        return returncode, []
+    with open('calls.log') as f:
+        return returncode, f.read().split()
+
+
+def test_submit_resumes_after_a_failed_stage(tmp_path, monkeypatch):
+    write_submit(tmp_path, monkeypatch, prod_steps=2)
+    assert submit(fail_stage='density') == (1, ['min1', 'min2', 'min3', 'min4', 'heat', 'density'])
+    assert submit() == (0, ['density', 'equil', 'prod1', 'prod2'])
+    assert os.path.exists('protein-prod2.mdcrd.gz') and os.path.exists('protein-heat.mdcrd.gz')
+    assert submit() == (0, [])
+
+
+def test_submit_runs_only_the_added_production_segments(tmp_path, monkeypatch):
+    prep = write_submit(tmp_path, monkeypatch, prod_steps=2)
+    assert submit() == (0, EQUILIBRATION_STAGES + ['prod1', 'prod2'])
+    prep.prod_steps = 4
+    prep.generate_submit_pbs()
+    assert submit() == (0, ['prod3', 'prod4'])
+
+
+def test_adaptive_stage_stops_at_the_plateau(tmp_path, monkeypatch):
+    # Chunks of 5000 steps, at least 10000 and at most 20000 steps: 2 to 4 chunks
+    write_submit(tmp_path, monkeypatch, prod_steps=1, adaptive_equil=True, equil_chunk_nstlim=5000, equil_min_nstlim=10000, equil_max_nstlim=20000)
+    returncode, calls = submit()
+    assert returncode == 0
+    assert calls == ['min1', 'min2', 'min3', 'min4', 'heat', 'density_1', 'density_2', 'equil_1', 'equil_2', 'prod1']
+    with open('density.out') as f:
+        assert f.read().count("Total wall time") == 2
+    assert os.path.getsize('density.rst') > 0
+    with open('equilibration.log') as f:
+        assert [line.split('-> ')[1].strip() for line in f] == ['continue, minimum length not reached', 'converged'] * 2
+    assert submit() == (0, [])
+
+
+def test_adaptive_stage_stops_at_the_maximum_length(tmp_path, monkeypatch):
+    write_submit(tmp_path, monkeypatch, prod_steps=1, adaptive_equil=True, equil_chunk_nstlim=5000, equil_min_nstlim=10000, equil_max_nstlim=20000)
+    returncode, calls = submit(drift=True)
+    assert returncode == 0
+    assert calls[5:] == [f'density_{n}' for n in range(1, 5)] + [f'equil_{n}' for n in range(1, 5)] + ['prod1']
+    with open('equilibration.log') as f:
+        assert f.readlines()[3].rstrip().endswith('-> maximum length reached without a plateau')
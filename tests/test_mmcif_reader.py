@@ -0,0 +1,44 @@
+from pyautomd.src.mmcif_reader import CHAIN_IDS, assign_chain_id, cif_to_pdb
+from pyautomd.src.pdb_atoms import PDB_atoms
+
+HEADER = """data_test
+loop_
+_atom_site.group_PDB
+_atom_site.id
+_atom_site.type_symbol
+_atom_site.label_atom_id
+_atom_site.label_comp_id
+_atom_site.auth_asym_id
+_atom_site.auth_seq_id
+_atom_site.Cartn_x
+_atom_site.Cartn_y
+_atom_site.Cartn_z
+_atom_site.occupancy
+_atom_site.B_iso_or_equiv
+_atom_site.pdbx_PDB_model_num
+"""
+
+
+def write_cif(cif_file, chains):
+    with open(cif_file, 'w') as f:
+        f.write(HEADER)
+        for k, chain in enumerate(chains, 1):
+            f.write(f"ATOM {k} C CA GLY {chain} 1 {k:.3f} 0.000 0.000 1.00 0.00 1\n")
+        f.write("#\n")
+
+
+def test_chain_ids_are_distinct(tmp_path):
+    cif_file, pdb_file = str(tmp_path / 'rec.cif'), str(tmp_path / 'rec.pdb')
+    write_cif(cif_file, ['AA', 'A', 'B', 'BB'])
+    assert cif_to_pdb(cif_file, pdb_file) == (4, 4)
+    assert PDB_atoms.read(pdb_file).column('chain') == ['C', 'A', 'B', 'D']
+    with open(str(tmp_path / 'rec.resmap')) as f:
+        assert [line.split('\t')[2] for line in f][1:] == ['AA', 'A', 'B', 'BB']
+
+
+def test_chain_ids_run_out(capsys):
+    chain_ids = {}
+    ids = [assign_chain_id(f"X{k}", chain_ids) for k in range(len(CHAIN_IDS) + 2)]
+    assert ids[:len(CHAIN_IDS)] == list(CHAIN_IDS)
+    assert ids[len(CHAIN_IDS):] == list(CHAIN_IDS[:2])
+    assert "Warning" in capsys.readouterr().out
@@ -0,0 +1,129 @@
+import os
+import struct
+import subprocess
+import sys
+import pytest
+from pyautomd.src.netcdf_reader import Netcdf_reader, STREAMING
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+N_ATOMS = 5
+N_FRAMES = 4
+
+
+def name_bytes(name):
+    data = name.encode()
+    return struct.pack('>i', len(data)) + data + b'\0' * ((-len(data)) % 4)
+
+
+def text_attribute(name, text):
+    data = text.encode()
+    return name_bytes(name) + struct.pack('>ii', 2, len(data)) + data + b'\0' * ((-len(data)) % 4)
+
+
+def frame_coords(frame):
+    return [frame + 0.25 * k for k in range(3 * N_ATOMS)]
+
+
+def build_nc(conventions='AMBER', numrecs=N_FRAMES, frames=N_FRAMES, version=1, record=True):
+    """
+    Builds an Amber NetCDF-3 file by hand, following the classic format specification: a trajectory with the record variables
+    time and coordinates, or a restart with a fixed coordinates variable.
+    """
+    offset_format = '>Q' if version == 2 else '>I'
+    dimensions = [('frame', 0), ('spatial', 3), ('atom', N_ATOMS)] if record else [('spatial', 3), ('atom', N_ATOMS)]
+    dim_id = {name: k for k, (name, _) in enumerate(dimensions)}
+    if record:
+        # (name, dims, nc_type, vsize)
+        variables = [('spatial', ['spatial'], 2, 4), ('time', ['frame'], 5, 4), ('coordinates', ['frame', 'atom', 'spatial'], 5, 12 * N_ATOMS)]
+    else:
+        variables = [('spatial', ['spatial'], 2, 4), ('time', [], 6, 8), ('coordinates', ['atom', 'spatial'], 6, 24 * N_ATOMS)]
+
+    def header(begins):
+        data = b'CDF' + bytes([version]) + struct.pack('>I', numrecs)
+        data += struct.pack('>ii', 10, len(dimensions)) + b''.join(name_bytes(name) + struct.pack('>i', length) for name, length in dimensions)
+        data += struct.pack('>ii', 12, 2) + text_attribute('Conventions', conventions) + text_attribute('ConventionVersion', '1.0')
+        data += struct.pack('>ii', 11, len(variables))
+        for (name, dims, nc_type, vsize), begin in zip(variables, begins):
+            data += name_bytes(name) + struct.pack('>i', len(dims)) + b''.join(struct.pack('>i', dim_id[dim]) for dim in dims)
+            data += struct.pack('>ii', 0, 0) + struct.pack('>iI', nc_type, vsize) + struct.pack(offset_format, begin)
+        return data
+
+    size = len(header([0] * len(variables)))
+    begins, position = [], size
+    for name, dims, _, vsize in variables: # the fixed variables first, then the records
+        if not (dims and dims[0] == 'frame'):
+            begins.append(position)
+            position += vsize
+        else:
+            begins.append(None)
+    for k, (name, dims, _, vsize) in enumerate(variables):
+        if begins[k] is None:
+            begins[k] = position
+            position += vsize
+    data = header(begins) + b'xyz\0'
+    if record:
+        for frame in range(frames):
+            data += struct.pack('>f', 10.0 * frame) + struct.pack(f'>{3 * N_ATOMS}f', *frame_coords(frame))
+    else:
+        data += struct.pack('>d', 5.0) + struct.pack(f'>{3 * N_ATOMS}d', *frame_coords(0))
+    return data
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_trajectory(tmp_path, version):
+    nc_file = tmp_path / 'traj.nc'
+    nc_file.write_bytes(build_nc(version=version))
+    with Netcdf_reader(str(nc_file)) as nc:
+        assert (nc.n_frames, nc.n_atoms, nc.attributes['Conventions']) == (N_FRAMES, N_ATOMS, 'AMBER')
+        assert nc.read('spatial') == 'xyz'
+        assert list(nc.read('coordinates', 2)) == frame_coords(2)
+        assert [frame for frame, _ in nc.iter_frames(stride=2)] == [0, 2]
+        assert [list(values) for _, values in nc.iter_frames('time')] == [[0.0], [10.0], [20.0], [30.0]]
+        assert nc.check(N_ATOMS) == []
+        assert nc.check(N_ATOMS + 1) == [f"{N_ATOMS} atoms instead of {N_ATOMS + 1}"]
+        with pytest.raises(ValueError):
+            nc.read('coordinates', N_FRAMES)
+
+
+def test_truncated_and_streaming_trajectories(tmp_path):
+    data = build_nc()
+    truncated = tmp_path / 'truncated.nc'
+    truncated.write_bytes(data[:-30])
+    with Netcdf_reader(str(truncated)) as nc:
+        assert nc.n_frames == N_FRAMES - 1
+        assert nc.check() == [f"only {N_FRAMES - 1} of {N_FRAMES} frames are complete"]
+    streaming = tmp_path / 'streaming.nc'
+    streaming.write_bytes(build_nc(numrecs=STREAMING)[:-30])
+    with Netcdf_reader(str(streaming)) as nc:
+        assert nc.n_frames == N_FRAMES - 1
+        assert nc.check() == []
+
+
+def test_restart(tmp_path):
+    nc_file = tmp_path / 'equil.ncrst'
+    nc_file.write_bytes(build_nc('AMBERRESTART', numrecs=0, record=False))
+    with Netcdf_reader(str(nc_file)) as nc:
+        assert nc.record_dimension is None and nc.n_frames == 0
+        assert list(nc.read('coordinates')) == frame_coords(0)
+        assert list(nc.read('time')) == [5.0]
+        assert nc.check(N_ATOMS) == []
+    nc_file.write_bytes(build_nc('AMBERRESTART', numrecs=0, record=False)[:-8])
+    with Netcdf_reader(str(nc_file)) as nc:
+        assert nc.check(N_ATOMS) == ["the file is truncated"]
+
+
+def test_not_netcdf3(tmp_path):
+    nc_file = tmp_path / 'hdf5.nc'
+    nc_file.write_bytes(b'\x89HDF\r\n\x1a\n' + b'\0' * 64)
+    with pytest.raises(ValueError, match="not a NetCDF-3 file"):
+        Netcdf_reader(str(nc_file))
+
+
+def test_command_line_exit_codes(tmp_path):
+    good, bad = tmp_path / 'good.nc', tmp_path / 'bad.nc'
+    good.write_bytes(build_nc())
+    bad.write_bytes(build_nc()[:-30])
+    command = [sys.executable, '-m', 'pyautomd.src.netcdf_reader', '-n', str(N_ATOMS)]
+    assert subprocess.run(command + [str(good)], cwd=REPO, capture_output=True).returncode == 0
+    result = subprocess.run(command + [str(good), str(bad)], cwd=REPO, capture_output=True, text=True)
+    assert result.returncode == 1 and "frames are complete" in result.stdout
@@ -0,0 +1,41 @@
+from pyautomd.src.nonstandard_residue_preparation.antechamber_relate_module import PrepiGenerator
+from pyautomd.src.nonstandard_residue_preparation.prepi_model import Prepi
+
+PREPI = """    0    0    2
+
+This is a remark line
+molecule.res
+MOL   INT  0
+CORRECT     OMIT DU   BEG
+  0.0000
+   1  DUMM  DU    M    0  -1  -2     0.000      .0        .0      .00000
+   2  DUMM  DU    M    1   0  -1     1.449      .0        .0      .00000
+   3  DUMM  DU    M    2   1   0     1.523   111.21       .0      .00000
+   4  CX1   c3    M    3   2   1     1.540   111.208  -180.000 -0.176900
+   5  HX1   hc    E    4   3   2     1.090   109.500    60.000  0.060000
+   6  HX10  hc    E    4   3   2     1.090   109.500   180.000  0.058450
+
+LOOP
+  CX1  HX10
+
+DONE
+STOP
+"""
+# (pdb name, ac name) in the same order in both files
+NAMES = [("C1", "CX1"), ("H1", "HX1"), ("H10", "HX10")]
+
+
+def test_keep_atominfo_prepi_to_pdb_four_character_names(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    generator = PrepiGenerator.__new__(PrepiGenerator) # the external programs are not needed for the renaming
+    generator.pdb, generator.resn, generator.prefix = "MOL.pdb", "MOL", "MOLtmp"
+    with open("MOL.pdb", "w") as pdb_file, open("MOLtmp.ac", "w") as ac_file:
+        for k, (pdb_name, ac_name) in enumerate(NAMES, 1):
+            pdb_file.write(f"ATOM  {k:5d} {pdb_name:<4s} MOL     1    {0.0:8.3f}{0.0:8.3f}{0.0:8.3f}  1.00  0.00\n")
+            ac_file.write(f"ATOM{k:7d}  {ac_name:<4s}MOL{1:5d}{0.0:12.3f}{0.0:8.3f}{0.0:8.3f}{0.0:10.6f}{ac_name[0].lower():>10s}\n")
+    with open("MOLtmp.prepi", "w") as prepi_file:
+        prepi_file.write(PREPI)
+    generator.keep_atominfo_prepi_to_pdb()
+    prepi = Prepi.read("MOL.prepi")
+    assert [atom.name for atom in prepi.atoms if not atom.is_dummy()] == ["C1", "H1", "H10"]
+    assert prepi.get_section("LOOP").entries == [["C1", "H10"]]
@@ -0,0 +1,138 @@
+import os
+import shutil
+import subprocess
+import pytest
+
+np = pytest.importorskip("numpy")
+from pyautomd.src.nonstandard_residue_preparation import resp_fit
+from pyautomd.src.nonstandard_residue_preparation.gaussian_esp_parser import Gaussian_esp_data, BOHR
+
+# Ethanol: C1 H2 H3 H4 C5 H6 H7 O8 H9
+ATOMIC_NUMBERS = [6, 1, 1, 1, 6, 1, 1, 8, 1]
+COORDS = [[0.000, 0.000, 0.000], [-0.363, 1.028, 0.000], [-0.363, -0.514, 0.890], [-0.363, -0.514, -0.890],
+          [1.540, 0.000, 0.000], [1.903, -0.514, 0.890], [1.903, -0.514, -0.890], [2.017, 1.348, 0.000], [2.977, 1.348, 0.000]]
+TRUE_CHARGES = [-0.20, 0.07, 0.07, 0.07, 0.15, 0.02, 0.02, -0.62, 0.42]
+# Stage 1: the methyl hydrogens equivalenced, the hydroxyl group constrained to its true charge
+STEP1_IVARY = [0, 0, 2, 2, 0, 0, 6, 0, 0]
+# Stage 2: the methyl and methylene groups refitted with equivalenced hydrogens, the other atoms frozen
+STEP2_IVARY = [0, 0, 2, 2, 0, 0, 6, -1, -1]
+GROUP = (-0.20, [8, 9])
+RESP_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "resp")
+# The commands giving the reference charges ethanol.step1.crg and ethanol.step2.crg from the inputs in RESP_DATA
+RESP_COMMANDS = ["resp -O -i ethanol.step1.respin -o ethanol.step1.respout -e ethanol.esp -t ethanol.step1.crg",
+                 "resp -O -i ethanol.step2.respin -o ethanol.step2.respout -e ethanol.esp -q ethanol.step1.crg -t ethanol.step2.crg"]
+
+
+def respin_text(ivary, qwt, iqopt, constraints=()):
+    lines = ["Resp charges for organic molecule", "", " &cntrl", "", " nmol = 1,", " ihfree = 1,", " ioutopt = 1,",
+             f" iqopt = {iqopt},", f" qwt = {qwt:.5f},", "", " &end", "    1.0", "Resp charges for organic molecule",
+             f"{0:5d}{len(ivary):5d}"]
+    lines += [f"{atomic_number:5d}{flag:5d}" for atomic_number, flag in zip(ATOMIC_NUMBERS, ivary)]
+    lines.append("")
+    for charge, atoms in constraints:
+        lines.append(f"{len(atoms):5d}{charge:10.5f}")
+        lines.append(''.join(f"{1:5d}{atom:5d}" for atom in atoms))
+    lines += ["", ""]
+    return "\n".join(lines) + "\n"
+
+
+def shell_points(coords, radius_scales=(1.4, 1.6, 1.8, 2.0), vdw=1.7, n=60):
+    """
+    Merz-Kollman-like ESP points on spheres around the atoms, outside the inner shell of every atom.
+    """
+    k = np.arange(n) + 0.5
+    phi = np.arccos(1 - 2 * k / n)
+    theta = np.pi * (1 + 5 ** 0.5) * k
+    sphere = np.stack([np.cos(theta) * np.sin(phi), np.sin(theta) * np.sin(phi), np.cos(phi)], axis=1)
+    atoms = np.asarray(coords)
+    points = np.concatenate([atom + scale * vdw * sphere for scale in radius_scales for atom in atoms])
+    distances = np.linalg.norm(points[:, None, :] - atoms[None, :, :], axis=2)
+    return points[distances.min(axis=1) >= radius_scales[0] * vdw - 1e-6]
+
+
+def make_esp(charges, noise=0.0):
+    """
+    The ESP of point charges, rounded to the E16.7 fields of the resp ESP file so that both engines read the same numbers.
+    """
+    rng = np.random.default_rng(7)
+    rounded = lambda values: np.array([float(f"{value:16.7E}") for value in np.ravel(values)])
+    atoms = rounded(np.asarray(COORDS) / BOHR).reshape(-1, 3)
+    points = rounded(shell_points(COORDS) / BOHR).reshape(-1, 3)
+    inv_r = 1.0 / np.linalg.norm(points[:, None, :] - atoms[None, :, :], axis=2)
+    potentials = rounded(inv_r @ np.asarray(charges) + noise * rng.standard_normal(len(points)))
+    return Gaussian_esp_data(ATOMIC_NUMBERS, (atoms * BOHR).ravel(), (points * BOHR).ravel(), potentials)
+
+
+@pytest.fixture
+def resp_inputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open("step1.respin", "w") as f:
+        f.write(respin_text(STEP1_IVARY, 0.0005, 1, [GROUP]))
+    with open("step2.respin", "w") as f:
+        f.write(respin_text(STEP2_IVARY, 0.001, 2))
+    esp_data = make_esp(TRUE_CHARGES, noise=2e-4)
+    esp_data.write_esp("mol.esp")
+    return esp_data
+
+
+def test_read_respin(resp_inputs):
+    resp_input = resp_fit.Resp_input.read("step1.respin")
+    assert resp_input.ivary == STEP1_IVARY
+    assert resp_input.atomic_numbers == ATOMIC_NUMBERS
+    assert resp_input.constraints == [(GROUP[0], [7, 8])]
+    assert resp_input.cntrl['qwt'] == pytest.approx(0.0005)
+
+
+def test_unrestrained_fit_recovers_charges(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open("fit.respin", "w") as f:
+        f.write(respin_text(STEP1_IVARY, 0.0, 1, [GROUP]))
+    charges = resp_fit.Resp_fit(resp_fit.Resp_input.read("fit.respin"), [make_esp(TRUE_CHARGES)]).fit()
+    assert np.allclose(charges, TRUE_CHARGES, atol=1e-5)
+
+
+def test_two_stage_constraints(resp_inputs):
+    charges = resp_fit.two_stage_resp("step1.respin", "step2.respin", [resp_inputs], "step1.crg", "step2.crg")
+    step1 = resp_fit.read_charge_file("step1.crg")
+    step2 = resp_fit.read_charge_file("step2.crg")
+    assert step2 == pytest.approx(charges, abs=resp_fit.CRG_PRECISION)
+    assert sum(step1) == pytest.approx(0.0, abs=1e-5) and sum(step2) == pytest.approx(0.0, abs=1e-5)
+    assert step1[7] + step1[8] == pytest.approx(GROUP[0], abs=2e-6) # group constraint
+    assert step1[2] == step1[1] == step1[3] and step1[6] == step1[5] # equivalencing
+    assert step2[2] == step2[1] == step2[3] and step2[6] == step2[5]
+    assert step2[7:] == step1[7:] # frozen atoms keep the first-stage charges
+    with open("step1.crg") as f:
+        assert [len(line.rstrip("\n")) for line in f] == [80, 10]
+
+
+def test_validation_detects_differences(resp_inputs):
+    resp_fit.two_stage_resp("step1.respin", "step2.respin", [resp_inputs], "step1.crg", "step2.crg")
+    resp_fit.validate_two_stage_resp("step1.respin", "step2.respin", [resp_inputs], "step1.crg", "step2.crg")
+    charges = resp_fit.read_charge_file("step2.crg")
+    charges[0] += 1e-5
+    resp_fit.write_charge_file(charges, "step2.crg")
+    with pytest.raises(ValueError, match="step 2 atom 1"):
+        resp_fit.validate_two_stage_resp("step1.respin", "step2.respin", [resp_inputs], "step1.crg", "step2.crg")
+
+
+def test_committed_resp_inputs_are_current(resp_inputs):
+    # The reference charges of the resp program are only valid for these exact inputs
+    for name, committed in [("step1.respin", "ethanol.step1.respin"), ("step2.respin", "ethanol.step2.respin"), ("mol.esp", "ethanol.esp")]:
+        with open(name, "rb") as generated, open(os.path.join(RESP_DATA, committed), "rb") as reference:
+            assert generated.read() == reference.read(), committed
+
+
+@pytest.mark.skipif(not all(os.path.exists(os.path.join(RESP_DATA, f"ethanol.{step}.crg")) for step in ["step1", "step2"]),
+                    reason=f"the reference charges of the resp program are not in {RESP_DATA}, see RESP_COMMANDS")
+def test_native_fit_matches_resp_reference(resp_inputs):
+    resp_fit.validate_two_stage_resp("step1.respin", "step2.respin", [resp_inputs],
+                                     os.path.join(RESP_DATA, "ethanol.step1.crg"), os.path.join(RESP_DATA, "ethanol.step2.crg"))
+
+
+@pytest.mark.skipif(shutil.which("resp") is None, reason="the resp program of AmberTools is not installed")
+def test_native_fit_matches_resp_program(resp_inputs):
+    for name in ["ethanol.step1.respin", "ethanol.step2.respin", "ethanol.esp"]:
+        shutil.copy(os.path.join(RESP_DATA, name), name)
+    for command in RESP_COMMANDS:
+        subprocess.run(command.split(), check=True)
+    resp_fit.validate_two_stage_resp("ethanol.step1.respin", "ethanol.step2.respin", [resp_inputs], "ethanol.step1.crg", "ethanol.step2.crg")
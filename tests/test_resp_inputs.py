@@ -0,0 +1,55 @@
+import os
+import stat
+from pyautomd.src.nonstandard_residue_preparation.antechamber_relate_module import PrepiGenerator
+from pyautomd.src.nonstandard_residue_preparation.gaussian_esp_parser import Gaussian_esp_data
+from pyautomd.src.nonstandard_residue_preparation.resp_fit import Resp_input
+
+# Writes a respgen output of a three-atom molecule to the file given with -o, with the blank lines respgen ends it with
+FAKE_RESPGEN = """#!/bin/sh
+while [ $# -gt 0 ]; do [ "$1" = "-o" ] && out=$2; shift; done
+printf 'Resp charges for organic molecule\\n\\n &cntrl\\n\\n nmol = 1,\\n ihfree = 1,\\n ioutopt = 1,\\n\\n &end\\n    1.0\\nResp charges for organic molecule\\n    1    3\\n    8    0\\n    1    0\\n    1    2\\n\\n\\n\\n' > $out
+"""
+
+
+def write_inputs(tmp_path, monkeypatch, constraints=None):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'respgen').write_text(FAKE_RESPGEN)
+    (bin_dir / 'respgen').chmod(stat.S_IRWXU)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.chdir(tmp_path)
+    with open("MOL.log", "w") as f:
+        f.write("")
+    os.utime("MOL.log", (0, 0)) # older than the ESP binary file, which is read instead of the log
+    Gaussian_esp_data([8, 1, 1], [0.0] * 9, [2.0, 0.0, 0.0], [0.01]).write_binary("MOL.espbin")
+    generator = PrepiGenerator.__new__(PrepiGenerator) # only respgen is needed for the respin files
+    generator.gau, generator.prefix, generator.netcharge = "MOL.log", "MOLtmp", "-1"
+    generator.write_resp_inputs(constraints_file=constraints)
+    return generator
+
+
+def check_ending(respin_file):
+    # The molecule section and the group constraints are followed by the blank line that ends the constraints
+    with open(respin_file) as f:
+        text = f.read()
+    assert text.endswith("\n\n\n") and not text.endswith("\n\n\n\n")
+
+
+def test_small_molecule_respin_is_terminated(tmp_path, monkeypatch):
+    write_inputs(tmp_path, monkeypatch)
+    for step in ["step1", "step2"]:
+        check_ending(f"MOLtmp.{step}.respin")
+        resp_input = Resp_input.read(f"MOLtmp.{step}.respin")
+        assert resp_input.charge == -1
+        assert resp_input.atomic_numbers == [8, 1, 1] and resp_input.ivary == [0, 0, 2]
+        assert resp_input.constraints == []
+    assert os.path.exists("MOLtmp.esp")
+
+
+def test_constraints_precede_the_blank_lines(tmp_path, monkeypatch):
+    with open(tmp_path / "constraints", "w") as f:
+        f.write(f"{1:5d}{0.27190:10.5f}\n{1:5d}{2:5d}\n{1:5d}{-0.56790:10.5f}\n{1:5d}{1:5d}\n")
+    write_inputs(tmp_path, monkeypatch, constraints="constraints")
+    for step in ["step1", "step2"]:
+        check_ending(f"MOLtmp.{step}.respin")
+        assert Resp_input.read(f"MOLtmp.{step}.respin").constraints == [(0.2719, [1]), (-0.5679, [0])]
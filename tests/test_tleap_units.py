@@ -0,0 +1,60 @@
+import os
+import stat
+import pytest
+from pyautomd.src.external_program_runner import configure_runner, get_runner
+from pyautomd.src.tleap_relate_module import Tleap_runner, split_tleap_units
+
+AUTOMD_HOME = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pyautomd')
+# Writes the files of the saveamberparm lines and the leap log named by the logFile command
+FAKE_TLEAP = """#!/bin/sh
+log=$(awk '/^logFile/ {print $2; exit}' "$2")
+echo "log of $2" > "${log:-leap.log}"
+grep -i "^saveamberparm" "$2" | while read a b c d; do echo x > $c; echo x > $d; done
+"""
+
+
+def test_units_write_their_own_leap_log(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'tleap').write_text(FAKE_TLEAP)
+    (bin_dir / 'tleap').chmod(stat.S_IRWXU)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.chdir(tmp_path)
+    saved = get_runner()
+    try:
+        configure_runner(4)
+        runner = Tleap_runner(AUTOMD_HOME, ['leaprc.protein.ff14SB'], [], [], 'protein', 'MOL', 'solvateoct', 10.0, 12.0, None)
+        runner.generate_tleap_file()
+        runner.run_tleap_units()
+    finally:
+        configure_runner(saved.max_cpus, saved.timeouts)
+    with open('tleap.txt') as f:
+        names = [name for name, _ in split_tleap_units(f.readlines())[1]]
+    assert names == ['model', 'rec-lig', 'rec', 'lig_wat', 'lig']
+    for name in names:
+        with open(f"tleap-{name}.in") as f:
+            assert f.readline() == f"logFile tleap-{name}.leaplog\n"
+        with open(f"tleap-{name}.leaplog") as f:
+            assert f.read() == f"log of tleap-{name}.in\n"
+    assert not os.path.exists('leap.log')
+
+
+def test_failed_unit_stops_the_preparation(tmp_path, monkeypatch, capsys):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    # The rec unit writes no topology
+    (bin_dir / 'tleap').write_text(FAKE_TLEAP.replace('do echo', 'do [ "$b" = rec ] && continue; echo'))
+    (bin_dir / 'tleap').chmod(stat.S_IRWXU)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.chdir(tmp_path)
+    saved = get_runner()
+    try:
+        configure_runner(4)
+        runner = Tleap_runner(AUTOMD_HOME, ['leaprc.protein.ff14SB'], [], [], 'protein', 'MOL', 'solvateoct', 10.0, 12.0, None)
+        runner.generate_tleap_file()
+        with pytest.raises(SystemExit):
+            runner.run_tleap_units()
+    finally:
+        configure_runner(saved.max_cpus, saved.timeouts)
+    assert os.path.getsize('protein.prmtop') > 0 and not os.path.exists('rec.prmtop')
+    assert "tleap error" in capsys.readouterr().out
@@ -0,0 +1,137 @@
+import os
+import gzip
+import array
+import pytest
+from pyautomd.src.netcdf_reader import Netcdf_reader, STREAMING
+from pyautomd.src.prmtop_reader import Prmtop_reader
+from pyautomd.src.trajectory_compactor import (Amber_netcdf_writer, Trajectory_compactor, BOX_SECTIONS, IFBOX, iter_zqt_frames, kept_residues,
+                                               strip_prmtop)
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example', 'rec_lig_solvated_preparation')
+SOLVATED_PRMTOP = os.path.join(EXAMPLE, 'protein.prmtop')
+REC_LIG_PRMTOP = os.path.join(EXAMPLE, 'rec-lig.prmtop')
+# The force field tables of the solvated topology also hold the water and ion types, the stripped topology keeps them unchanged
+PARAMETER_SECTIONS = {'NONBONDED_PARM_INDEX', 'BOND_FORCE_CONSTANT', 'BOND_EQUIL_VALUE', 'SOLTY', 'LENNARD_JONES_ACOEF', 'LENNARD_JONES_BCOEF',
+                      'HBOND_ACOEF', 'HBOND_BCOEF', 'HBCUT'}
+PARAMETER_POINTERS = {1, 15, 18, 19} # NTYPES, NUMBND, NATYP, NPHB
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_prmcrd(prmcrd_file):
+    with open(prmcrd_file) as f:
+        f.readline()
+        n_atoms = int(f.readline().split()[0])
+        values = array.array('d')
+        for line in f:
+            values.extend(float(line[k:k + 12]) for k in range(0, len(line.rstrip('\n')), 12))
+    return n_atoms, values[:3 * n_atoms]
+
+
+def test_prmtop_write_round_trip(tmp_path):
+    output_file = str(tmp_path / 'copy.prmtop')
+    with Prmtop_reader(REC_LIG_PRMTOP) as prmtop:
+        prmtop.index_sections()
+        prmtop.write(output_file, {flag: prmtop.section(flag) for flag in prmtop.sections})
+    assert read_bytes(output_file) == read_bytes(REC_LIG_PRMTOP)
+
+
+def test_prmtop_write_remove(tmp_path):
+    output_file = str(tmp_path / 'nobox.prmtop')
+    with Prmtop_reader(SOLVATED_PRMTOP) as prmtop:
+        prmtop.write(output_file, {}, remove=BOX_SECTIONS)
+        flags = [flag for flag in prmtop.sections if flag not in BOX_SECTIONS]
+        with Prmtop_reader(output_file) as stripped:
+            stripped.index_sections()
+            assert list(stripped.sections) == flags
+            assert all(stripped.section(flag) == prmtop.section(flag) for flag in ('POINTERS', 'CHARGE', 'RESIDUE_POINTER'))
+
+
+def test_strip_prmtop_matches_rec_lig(tmp_path):
+    output_file = str(tmp_path / 'strip.prmtop')
+    with Prmtop_reader(SOLVATED_PRMTOP) as prmtop:
+        strip_prmtop(prmtop, kept_residues(prmtop), output_file)
+        parameters = {flag: prmtop.section(flag) for flag in PARAMETER_SECTIONS}
+    with Prmtop_reader(output_file) as stripped, Prmtop_reader(REC_LIG_PRMTOP) as reference:
+        stripped.index_sections()
+        reference.index_sections()
+        assert list(stripped.sections) == list(reference.sections)
+        for flag in reference.sections:
+            if flag in PARAMETER_SECTIONS:
+                assert stripped.section(flag) == parameters[flag], flag
+            elif flag == 'POINTERS':
+                assert [value for k, value in enumerate(stripped.section(flag)) if k not in PARAMETER_POINTERS] == \
+                       [value for k, value in enumerate(reference.section(flag)) if k not in PARAMETER_POINTERS]
+            else:
+                assert stripped.section(flag) == reference.section(flag), flag
+
+
+def test_netcdf_writer_round_trip(tmp_path):
+    nc_file = str(tmp_path / 'traj.nc')
+    frames = [array.array('d', (frame + 0.001 * k for k in range(30))) for frame in range(3)]
+    writer = Amber_netcdf_writer(nc_file, 10)
+    for frame, coords in enumerate(frames):
+        writer.write_frame(2.0 * frame, coords)
+    writer.file.flush()
+    with Netcdf_reader(nc_file) as nc:
+        assert nc.numrecs == STREAMING and nc.n_frames == 3 # readable while it is written
+    writer.close()
+    with Netcdf_reader(nc_file) as nc:
+        assert (nc.numrecs, nc.n_frames, nc.n_atoms) == (3, 3, 10)
+        assert nc.check(10) == []
+        assert nc.read('spatial') == 'xyz'
+        for frame, coords in nc.iter_frames():
+            assert list(coords) == pytest.approx(list(frames[frame]), abs=1e-5)
+            assert list(nc.read('time', frame)) == [2.0 * frame]
+
+
+@pytest.fixture(scope='module')
+def solvated_trajectory(tmp_path_factory):
+    """
+    A gzipped ASCII trajectory of the solvated example, three frames shifted from the coordinates of protein.prmcrd.
+    """
+    n_atoms, coords = read_prmcrd(os.path.join(EXAMPLE, 'protein.prmcrd'))
+    frames = [array.array('d', (value + 0.5 * frame for value in coords)) for frame in range(3)]
+    mdcrd_file = str(tmp_path_factory.mktemp('traj') / 'protein-prod1.mdcrd.gz')
+    with gzip.open(mdcrd_file, 'wt') as f:
+        f.write("default_name\n")
+        for frame in frames:
+            text = [f"{value:8.3f}" for value in frame]
+            f.writelines(''.join(text[k:k + 10]) + "\n" for k in range(0, len(text), 10))
+            f.write(f"{70.0:8.3f}{70.0:8.3f}{70.0:8.3f}\n")
+    return mdcrd_file, [array.array('d', (round(value, 3) for value in frame)) for frame in frames]
+
+
+def test_compact_to_netcdf(tmp_path, solvated_trajectory):
+    mdcrd_file, frames = solvated_trajectory
+    compactor = Trajectory_compactor(SOLVATED_PRMTOP, stride=2)
+    with Prmtop_reader(REC_LIG_PRMTOP) as reference:
+        assert compactor.n_kept == reference.n_atoms
+    output_file = str(tmp_path / 'strip.nc')
+    assert compactor.compact(mdcrd_file, output_file) == 2
+    with Netcdf_reader(output_file) as nc:
+        assert (nc.n_frames, nc.n_atoms, nc.check()) == (2, compactor.n_kept, [])
+        for (frame, coords), source in zip(nc.iter_frames(), (frames[0], frames[2])):
+            assert list(coords) == pytest.approx(list(compactor.strip(source)), abs=1e-4)
+
+
+def test_compact_to_zqt(tmp_path, solvated_trajectory):
+    mdcrd_file, frames = solvated_trajectory
+    compactor = Trajectory_compactor(SOLVATED_PRMTOP, precision=0.01, chunk_frames=2)
+    output_file = str(tmp_path / 'strip.zqt')
+    assert compactor.compact(mdcrd_file, output_file) == 3
+    decoded = list(iter_zqt_frames(output_file))
+    assert [time for time, _ in decoded] == [0.0, 1.0, 2.0]
+    for (_, coords), source in zip(decoded, frames):
+        assert max(abs(a - b) for a, b in zip(coords, compactor.strip(source))) <= 0.005 + 1e-9
+
+
+def test_stripped_topology_has_no_box(tmp_path):
+    output_file = str(tmp_path / 'strip.prmtop')
+    Trajectory_compactor(SOLVATED_PRMTOP).write_topology(output_file)
+    with Prmtop_reader(output_file) as prmtop:
+        assert prmtop.section('POINTERS')[IFBOX] == 0
+        assert not any(prmtop.has_section(flag) for flag in BOX_SECTIONS)